@@ -0,0 +1,207 @@
+import asyncio
+import datetime
+import logging
+import time
+
+import discord
+
+logger = logging.getLogger("red.ExtendedModLog")
+
+
+class AuditLogCache:
+    """
+        Shared per-guild audit log cache
+
+        The newest entries for a guild are fetched at most once per `ttl`
+        seconds and indexed by action and target ID so that every event
+        handler can be answered from memory. When a lookup misses, a single
+        refresh is made and shared by every handler waiting on that guild.
+        If the shared window was full and holds fewer entries of an action
+        than a caller asked for, that action is fetched on its own so busy
+        guilds don't push older entries out of reach.
+    """
+
+    def __init__(
+        self,
+        bot,
+        stats=None,
+        limit: int = 50,
+        ttl: float = 3.0,
+        miss_interval: float = 0.5,
+        max_age: float = 10.0,
+    ):
+        self.bot = bot
+        self.stats = stats
+        self.limit = limit
+        self.ttl = ttl
+        self.miss_interval = miss_interval
+        self.max_age = max_age
+        self._logs = {}
+        self._fetched_at = {}
+        self._full = {}
+        self._action_fetched = {}
+        self._pending = {}
+
+    def clear(self, guild_id: int = None):
+        if guild_id is None:
+            self._logs = {}
+            self._fetched_at = {}
+            self._full = {}
+            self._action_fetched = {}
+            return
+        self._logs.pop(guild_id, None)
+        self._fetched_at.pop(guild_id, None)
+        self._full.pop(guild_id, None)
+        for key in [k for k in self._action_fetched if k[0] == guild_id]:
+            del self._action_fetched[key]
+
+    async def _fetch(self, guild: discord.Guild):
+        index = {}
+        count = 0
+        try:
+            async for log in guild.audit_logs(limit=self.limit):
+                index.setdefault(log.action, []).append(log)
+                count += 1
+        except (discord.errors.Forbidden, discord.errors.HTTPException):
+            logger.debug("Could not fetch audit logs for {}".format(guild.id))
+        self._logs[guild.id] = index
+        self._fetched_at[guild.id] = time.monotonic()
+        self._full[guild.id] = count >= self.limit
+        for key in [k for k in self._action_fetched if k[0] == guild.id]:
+            del self._action_fetched[key]
+
+    async def _fetch_action(
+        self, guild: discord.Guild, action: discord.AuditLogAction, limit: int
+    ):
+        logs = []
+        try:
+            async for log in guild.audit_logs(limit=limit, action=action):
+                logs.append(log)
+        except (discord.errors.Forbidden, discord.errors.HTTPException):
+            logger.debug("Could not fetch {} audit logs for {}".format(action, guild.id))
+            return
+        self._logs.setdefault(guild.id, {})[action] = logs
+        self._action_fetched[(guild.id, action)] = (time.monotonic(), limit)
+
+    async def refresh(self, guild: discord.Guild):
+        """
+            Refresh the cached audit log for a guild
+
+            Concurrent callers share the same request
+        """
+        task = self._pending.get(guild.id)
+        if task is None:
+            if self.stats is not None:
+                self.stats.rest_call()
+            task = self.bot.loop.create_task(self._fetch(guild))
+            self._pending[guild.id] = task
+            task.add_done_callback(lambda t: self._pending.pop(guild.id, None))
+        await asyncio.shield(task)
+
+    async def refresh_action(
+        self, guild: discord.Guild, action: discord.AuditLogAction, limit: int
+    ):
+        """
+            Refresh the newest `limit` entries of one action for a guild
+
+            Concurrent callers for the same action share the same request
+        """
+        key = (guild.id, action)
+        task = self._pending.get(key)
+        if task is None:
+            if self.stats is not None:
+                self.stats.rest_call()
+            task = self.bot.loop.create_task(self._fetch_action(guild, action, limit))
+            self._pending[key] = task
+            task.add_done_callback(lambda t: self._pending.pop(key, None))
+        await asyncio.shield(task)
+
+    def _needs_action(self, guild, action, limit, interval) -> bool:
+        """
+            Whether the shared window may be missing entries of `action`
+        """
+        if len(self._logs.get(guild.id, {}).get(action, [])) >= limit:
+            return False
+        if not self._full.get(guild.id, False):
+            return False
+        fetched = self._action_fetched.get((guild.id, action))
+        if fetched is None:
+            return True
+        return fetched[1] < limit or time.monotonic() - fetched[0] > interval
+
+    def _age(self, guild: discord.Guild) -> float:
+        if guild.id not in self._fetched_at:
+            return float("inf")
+        return time.monotonic() - self._fetched_at[guild.id]
+
+    def _search(self, guild, action, target_id, limit, check):
+        for log in self._logs.get(guild.id, {}).get(action, [])[:limit]:
+            if target_id is not None and getattr(log.target, "id", None) != target_id:
+                continue
+            if check is not None and not check(log):
+                continue
+            return log
+        return None
+
+    async def entries(
+        self,
+        guild: discord.Guild,
+        action: discord.AuditLogAction,
+        limit: int = 5,
+        since: datetime.datetime = None,
+    ):
+        """
+            Return the newest `limit` audit log entries for an action
+
+            `since` is when the gateway event arrived in UTC. The cache is
+            refreshed if it was fetched before then and entries more than
+            `max_age` seconds older than the event are left out, so an
+            earlier change isn't credited to the wrong moderator.
+        """
+        if self._age(guild) > self.ttl:
+            await self.refresh(guild)
+        elif since is not None:
+            if self._age(guild) > (datetime.datetime.utcnow() - since).total_seconds():
+                await self.refresh(guild)
+        if self._needs_action(guild, action, limit, self.ttl):
+            await self.refresh_action(guild, action, limit)
+        logs = self._logs.get(guild.id, {}).get(action, [])[:limit]
+        if since is None:
+            return logs
+        oldest = since - datetime.timedelta(seconds=self.max_age)
+        recent = [log for log in logs if log.created_at >= oldest]
+        if not recent:
+            # The gateway event can arrive before the audit log entry exists
+            await asyncio.sleep(self.miss_interval)
+            await self.refresh(guild)
+            logs = self._logs.get(guild.id, {}).get(action, [])[:limit]
+            recent = [log for log in logs if log.created_at >= oldest]
+        return recent
+
+    async def find(
+        self,
+        guild: discord.Guild,
+        action: discord.AuditLogAction,
+        target_id: int = None,
+        limit: int = 5,
+        check=None,
+    ):
+        """
+            Find the newest audit log entry for an action and target
+
+            `limit` mirrors the old `guild.audit_logs(limit=...)` calls, only
+            the newest `limit` entries of that action are considered.
+            `check` is an optional callable to further filter entries.
+        """
+        if self._age(guild) > self.ttl:
+            await self.refresh(guild)
+        log = self._search(guild, action, target_id, limit, check)
+        if log is None and self._needs_action(guild, action, limit, self.miss_interval):
+            # The shared window was filled by other actions
+            await self.refresh_action(guild, action, limit)
+            log = self._search(guild, action, target_id, limit, check)
+        if log is None and self._age(guild) > self.miss_interval:
+            # The gateway event can arrive before the audit log entry exists
+            await self.refresh(guild)
+            log = self._search(guild, action, target_id, limit, check)
+        return log
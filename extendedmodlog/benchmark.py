@@ -0,0 +1,264 @@
+"""
+    Offline event replay benchmark for the ExtendedModLog EventMixin
+
+    Replays a synthetic stream of gateway-like events through the mixin
+    using stub guild objects and an in-memory Config, no discord
+    connection is made. Run from the repository root with:
+
+        python -m extendedmodlog.benchmark --events 5000 --guilds 10
+"""
+import argparse
+import asyncio
+import datetime
+import random
+import time
+from types import SimpleNamespace
+
+from . import eventmixin
+from .auditlogcache import AuditLogCache
+from .eventmixin import EventMixin
+from .eventstats import EventStats
+from .extendedmodlog import inv_settings
+from .invitetracker import InviteTracker
+from .logqueue import LogQueue
+from .messagecache import MessageCache
+
+
+class MemoryValue:
+    def __init__(self, data: dict, key: str):
+        self._data = data
+        self._key = key
+
+    async def __call__(self):
+        return self._data[self._key]
+
+    async def set(self, value):
+        self._data[self._key] = value
+
+
+class MemoryGroup:
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getattr__(self, key):
+        return MemoryValue(self._data, key)
+
+    async def get_raw(self, key):
+        return self._data[key]
+
+    async def set(self, value):
+        self._data.update(value)
+
+
+class MemoryConfig:
+    """
+        Just enough of Config for the EventMixin
+    """
+
+    def __init__(self, defaults: dict):
+        self.defaults = defaults
+        self._guilds = {}
+
+    def guild(self, guild):
+        if guild.id not in self._guilds:
+            self._guilds[guild.id] = dict(self.defaults)
+        return MemoryGroup(self._guilds[guild.id])
+
+    async def all_guilds(self):
+        return self._guilds
+
+
+class StubPermissions:
+    def __getattr__(self, key):
+        return True
+
+
+class StubChannel:
+    def __init__(self, guild, id, name="general"):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.mention = "<#{}>".format(id)
+        self.sent = 0
+
+    def permissions_for(self, member):
+        return StubPermissions()
+
+    async def send(self, content=None, embed=None, file=None):
+        self.sent += 1
+
+
+class StubMember:
+    def __init__(self, guild, id):
+        now = datetime.datetime.utcnow()
+        self.guild = guild
+        self.id = id
+        self.name = "member{}".format(id)
+        self.discriminator = "0001"
+        self.display_name = self.name
+        self.nick = None
+        self.bot = False
+        self.mention = "<@{}>".format(id)
+        self.avatar_url = "https://cdn.discordapp.com/embed/avatars/0.png"
+        self.created_at = now - datetime.timedelta(days=id % 1000)
+        self.joined_at = now
+        self.roles = []
+        self.guild_permissions = StubPermissions()
+        self.colour = 0
+
+    def __str__(self):
+        return "{}#{}".format(self.name, self.discriminator)
+
+
+class StubGuild:
+    def __init__(self, id, members: int):
+        self.id = id
+        self.name = "guild{}".format(id)
+        self.icon_url = ""
+        self.features = []
+        self.me = StubMember(self, 0)
+        self.members = [StubMember(self, id * 100000 + i) for i in range(1, members + 1)]
+        self.channels = [StubChannel(self, id * 1000 + i) for i in range(1, 6)]
+        self.modlog = StubChannel(self, id * 1000, "modlog")
+        self.rest_calls = 0
+
+    def get_channel(self, channel_id):
+        for channel in self.channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+    def get_member(self, member_id):
+        return None
+
+    def get_role(self, role_id):
+        return None
+
+    async def audit_logs(self, limit=100, action=None):
+        self.rest_calls += 1
+        return
+        yield
+
+    async def invites(self):
+        self.rest_calls += 1
+        return []
+
+
+class StubBot:
+    def __init__(self, loop, guilds):
+        self.loop = loop
+        self.guilds = {g.id: g for g in guilds}
+        self.db = SimpleNamespace(
+            guild=lambda g: SimpleNamespace(use_bot_color=MemoryValue({"b": False}, "b")),
+            color=MemoryValue({"color": 0}, "color"),
+        )
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_user(self, user_id):
+        return None
+
+
+class BenchmarkLog(EventMixin):
+    def __init__(self, bot, config):
+        self.bot = bot
+        self.config = config
+        self.event_stats = EventStats()
+        self.audit_log = AuditLogCache(bot, self.event_stats)
+        self.log_queue = LogQueue(bot, self.event_stats, flush_delay=0)
+        self.invite_tracker = InviteTracker(bot, config, self.event_stats)
+        self.message_cache = MessageCache(config, self.event_stats)
+
+
+async def _get_modlog_channel(guild):
+    return guild.modlog
+
+
+def synthetic_events(guilds: list, count: int, seed: int = 0):
+    """
+        Yield `(name, args)` tuples of gateway-like events
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        guild = rng.choice(guilds)
+        member = rng.choice(guild.members)
+        kind = rng.choice(["join", "update", "voice", "delete"])
+        if kind == "join":
+            yield "on_member_join", (member,)
+        elif kind == "update":
+            after = SimpleNamespace(**vars(member))
+            after.nick = "nick{}".format(i)
+            yield "on_member_update", (member, after)
+        elif kind == "voice":
+            before_channel, after_channel = rng.sample(guild.channels, 2)
+            before = SimpleNamespace(deaf=False, mute=False, channel=before_channel)
+            after = SimpleNamespace(deaf=False, mute=False, channel=after_channel)
+            yield "on_voice_state_update", (member, before, after)
+        else:
+            message = SimpleNamespace(
+                id=i,
+                guild=guild,
+                channel=rng.choice(guild.channels),
+                author=member,
+                content="message {}".format(i),
+                attachments=[],
+                mentions=[],
+                created_at=datetime.datetime.utcnow(),
+            )
+            yield "on_message_delete", (message,)
+
+
+async def run(events: int, guild_count: int, members: int, seed: int):
+    loop = asyncio.get_event_loop()
+    guilds = [StubGuild(i, members) for i in range(1, guild_count + 1)]
+    bot = StubBot(loop, guilds)
+    config = MemoryConfig(inv_settings)
+    for guild in guilds:
+        await config.guild(guild).set({k: True for k, v in inv_settings.items() if v is False})
+    eventmixin.modlog = SimpleNamespace(get_modlog_channel=_get_modlog_channel)
+    cog = BenchmarkLog(bot, config)
+
+    latencies = {}
+    start = time.perf_counter()
+    for name, args in synthetic_events(guilds, events, seed):
+        event_start = time.perf_counter()
+        await getattr(cog, name)(*args)
+        latencies.setdefault(name, []).append(time.perf_counter() - event_start)
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.1)
+
+    rate = events / elapsed
+    print("Replayed {} events in {:.2f}s ({:.0f} events/sec)".format(events, elapsed, rate))
+    print("{:<28}{:>8}{:>10}{:>10}{:>10}".format("Event", "Count", "Mean ms", "p50 ms", "p99 ms"))
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        print(
+            "{:<28}{:>8}{:>10.3f}{:>10.3f}{:>10.3f}".format(
+                name,
+                len(values),
+                sum(values) / len(values) * 1000,
+                values[len(values) // 2] * 1000,
+                values[min(len(values) - 1, int(len(values) * 0.99))] * 1000,
+            )
+        )
+    print()
+    print(cog.event_stats.table())
+    print()
+    print("Audit log/invite requests: {}".format(sum(g.rest_calls for g in guilds)))
+    print("Modlog messages sent: {}".format(sum(g.modlog.sent for g in guilds)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(args.events, args.guilds, args.members, args.seed))
+
+
+if __name__ == "__main__":
+    main()
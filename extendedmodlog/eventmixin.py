@@ -3,9 +3,16 @@ import datetime
 import discord
 import asyncio
 import logging
+from io import BytesIO
 from random import choice, randint
 from redbot.core.i18n import Translator, cog_i18n
 
+from .auditlogcache import AuditLogCache
+from .logqueue import LogQueue
+from .invitetracker import InviteTracker
+from .messagecache import MessageCache
+from .eventstats import EventStats, instrumented
+
 _ = Translator("ExtendedModLog", __file__)
 logger = logging.getLogger("red.ExtendedModLog")
 
@@ -19,11 +26,26 @@ class EventMixin:
     def __init__(self, *args):
         self.config: Config
         self.bot: Red
+        self.audit_log: AuditLogCache
+        self.log_queue: LogQueue
+        self.invite_tracker: InviteTracker
+        self.message_cache: MessageCache
+        self.event_stats: EventStats
+
+    async def guild_setting(self, guild, setting):
+        self.event_stats.config_read()
+        return await self.config.guild(guild).get_raw(setting)
+
+    async def get_modlog_channel(self, guild):
+        self.event_stats.config_read()
+        return await modlog.get_modlog_channel(guild)
 
     async def get_colour(self, guild):
+        self.event_stats.config_read()
         if await self.bot.db.guild(guild).use_bot_color():
             return guild.me.colour
         else:
+            self.event_stats.config_read()
             return await self.bot.db.color()
 
     async def member_can_run(self, ctx):
@@ -49,16 +71,17 @@ class EventMixin:
                 can = False
         return can
 
+    @instrumented
     async def on_command(self, ctx: commands.Context):
         guild = ctx.guild
         if guild is None:
             return
-        if not await self.config.guild(guild).commands_used():
+        if not await self.guild_setting(guild, "commands_used"):
             return
-        if ctx.channel.id in await self.config.guild(guild).ignored_channels():
+        if ctx.channel.id in await self.guild_setting(guild, "ignored_channels"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         time = ctx.message.created_at
@@ -114,21 +137,35 @@ class EventMixin:
             embed.set_footer(text=_("User ID: ") + str(message.author.id))
             author_title = name + _(" - Used a MOD/ADMIN Command")
             embed.set_author(name=author_title, icon_url=message.author.avatar_url)
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
             clean_msg = f"{infomessage}\n`{cleanmsg}`"
-            await channel.send(clean_msg)
+            await self.log_queue.send(channel, clean_msg)
+
+    @instrumented
+    async def on_message(self, message):
+        guild = message.guild
+        if guild is None:
+            return
+        if message.author.bot:
+            return
+        if message.channel.id not in await self.message_cache.tracked_channels(guild):
+            return
+        self.message_cache.add(message)
 
+    @instrumented
     async def on_message_delete(self, message):
         guild = message.guild
         if guild is None:
             return
-        if not await self.config.guild(guild).message_delete():
+        # Popped before any await so on_raw_message_delete knows this handler owns it
+        self.message_cache.pop(guild.id, message.id)
+        if not await self.guild_setting(guild, "message_delete"):
             return
-        if message.channel.id in await self.config.guild(guild).ignored_channels():
+        if message.channel.id in await self.guild_setting(guild, "ignored_channels"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if message.content == "" and message.attachments == []:
@@ -141,11 +178,15 @@ class EventMixin:
         perp = None
         if channel.permissions_for(guild.me).view_audit_log:
             action = discord.AuditLogAction.message_delete
-            async for log in guild.audit_logs(limit=2, action=action):
-                same_chan = log.extra.channel.id == message.channel.id
-                if log.target.id == message.author.id and same_chan:
-                    perp = log.user
-                    break
+            log = await self.audit_log.find(
+                guild,
+                action,
+                target_id=message.author.id,
+                limit=2,
+                check=lambda l: l.extra.channel.id == message.channel.id,
+            )
+            if log:
+                perp = log.user
         author = message.author
         if perp is None:
             infomessage = (
@@ -170,81 +211,207 @@ class EventMixin:
             embed.set_author(
                 name=str(author) + _(" - Deleted Message"), icon_url=message.author.avatar_url
             )
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
+        else:
+            await self.log_queue.send(channel, infomessage)
+
+    @instrumented
+    async def on_raw_message_delete(self, payload):
+        guild = self.bot.get_guild(getattr(payload, "guild_id", None))
+        if guild is None:
+            return
+        # discord.py dispatches on_message_delete right after this event when it
+        # still has the message, yielding once lets that handler pop it first
+        await asyncio.sleep(0)
+        cached = self.message_cache.pop(guild.id, payload.message_id)
+        if cached is None:
+            return
+        if not await self.guild_setting(guild, "message_delete"):
+            return
+        if payload.channel_id in await self.guild_setting(guild, "ignored_channels"):
+            return
+        try:
+            channel = await self.get_modlog_channel(guild)
+        except:
+            return
+        message_channel = guild.get_channel(payload.channel_id)
+        if message_channel is None:
+            return
+        author = guild.get_member(cached.author_id) or self.bot.get_user(cached.author_id)
+        author_name = str(author) if author else str(cached.author_id)
+        perp = None
+        if channel.permissions_for(guild.me).view_audit_log:
+            action = discord.AuditLogAction.message_delete
+            log = await self.audit_log.find(
+                guild,
+                action,
+                target_id=cached.author_id,
+                limit=2,
+                check=lambda l: l.extra.channel.id == payload.channel_id,
+            )
+            if log:
+                perp = log.user
+        if perp is None:
+            infomessage = (
+                _("A message from ")
+                + author_name
+                + _(" was deleted in ")
+                + message_channel.name
+                + "\n"
+                + cached.content
+            )
+        else:
+            infomessage = (
+                str(perp)
+                + _(" Deleted a message ")
+                + _(" in ")
+                + message_channel.name
+                + "\n"
+                + cached.content
+            )
+        if channel.permissions_for(guild.me).embed_links:
+            embed = discord.Embed(
+                description=cached.content,
+                colour=discord.Colour.dark_red(),
+                timestamp=cached.timestamp,
+            )
+            embed.add_field(name=_("Channel"), value=message_channel.mention)
+            if perp:
+                embed.add_field(name=_("Deleted by"), value=perp.mention)
+            if cached.attachments:
+                embed.add_field(name=_("Attachments"), value=", ".join(cached.attachments))
+            embed.set_footer(text=_("User ID: ") + str(cached.author_id))
+            icon_url = author.avatar_url if author else discord.Embed.Empty
+            embed.set_author(name=author_name + _(" - Deleted Message"), icon_url=icon_url)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(infomessage)
+            await self.log_queue.send(channel, infomessage[:2000])
+
+    @instrumented
+    async def on_bulk_message_delete(self, messages):
+        # on_raw_bulk_message_delete logs these with the rest of the ids
+        for message in messages:
+            if message.guild is not None:
+                self.message_cache.add(message)
+
+    @instrumented
+    async def on_raw_bulk_message_delete(self, payload):
+        guild = self.bot.get_guild(getattr(payload, "guild_id", None))
+        if guild is None:
+            return
+        # Let on_bulk_message_delete add the messages discord.py still had
+        await asyncio.sleep(0)
+        messages = []
+        for message_id in sorted(payload.message_ids):
+            cached = self.message_cache.pop(guild.id, message_id)
+            if cached is not None:
+                messages.append(cached)
+        if not await self.guild_setting(guild, "message_delete"):
+            return
+        if payload.channel_id in await self.guild_setting(guild, "ignored_channels"):
+            return
+        try:
+            channel = await self.get_modlog_channel(guild)
+        except:
+            return
+        message_channel = guild.get_channel(payload.channel_id)
+        if message_channel is None:
+            return
+        total = len(payload.message_ids)
+        infomessage = _("{total} messages were bulk deleted in {channel}").format(
+            total=total, channel=message_channel.name
+        )
+        lines = []
+        for cached in messages:
+            author = guild.get_member(cached.author_id) or self.bot.get_user(cached.author_id)
+            attachments = ""
+            if cached.attachments:
+                attachments = " [" + ", ".join(cached.attachments) + "]"
+            lines.append(
+                "[{time}] {author} ({author_id}): {content}{attachments}".format(
+                    time=cached.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                    author=author or _("Unknown"),
+                    author_id=cached.author_id,
+                    content=cached.content,
+                    attachments=attachments,
+                )
+            )
+        report = "\n".join(lines)
+        if not lines:
+            report = _("None of the deleted messages were cached.")
+        file = None
+        if len(report) > 1500:
+            file = discord.File(
+                BytesIO(report.encode("utf-8")),
+                filename="deleted-messages-{}.txt".format(payload.channel_id),
+            )
+            report = ""
+        if channel.permissions_for(guild.me).embed_links:
+            embed = discord.Embed(
+                description=report,
+                colour=discord.Colour.dark_red(),
+                timestamp=datetime.datetime.utcnow(),
+            )
+            embed.add_field(name=_("Channel"), value=message_channel.mention)
+            embed.add_field(name=_("Recovered"), value="{}/{}".format(len(messages), total))
+            embed.set_author(name=infomessage)
+            await self.log_queue.send(channel, embed=embed, file=file)
+        else:
+            await self.log_queue.send(channel, (infomessage + "\n" + report)[:2000], file=file)
 
     async def invite_links_loop(self):
-        """Check every 5 minutes for updates to the invite links"""
+        """Refresh invite links spread across every 5 minutes"""
         await self.bot.wait_until_ready()
         while self is self.bot.get_cog("ExtendedModLog"):
-            for guild_id in await self.config.all_guilds():
+            guilds = []
+            for guild_id, settings in (await self.config.all_guilds()).items():
                 guild = self.bot.get_guild(guild_id)
                 if guild is None:
                     # Let's remove missing guilds
                     await self.config.clear_scope(Config.GUILD, str(guild_id))
-                if await self.config.guild(guild).user_join():
-                    await self.save_invite_links(guild)
-            await asyncio.sleep(300)
+                    continue
+                if settings.get("user_join") and guild.me.guild_permissions.manage_guild:
+                    guilds.append(guild)
+            if guilds:
+                await self.invite_tracker.poll(guilds, 300)
+            else:
+                await asyncio.sleep(300)
 
     async def save_invite_links(self, guild):
-        invites = {}
         if not guild.me.guild_permissions.manage_guild:
             return False
-        for invite in await guild.invites():
-            try:
-                invites[invite.code] = {
-                    "uses": invite.uses,
-                    "max_age": invite.max_age,
-                    "created_at": invite.created_at.timestamp(),
-                    "max_uses": invite.max_uses,
-                    "temporary": invite.temporary,
-                    "inviter": invite.inviter.id,
-                    "channel": invite.channel.id,
-                }
-            except:
-                pass
-        await self.config.guild(guild).invite_links.set(invites)
+        await self.invite_tracker.refresh(guild)
+        await self.invite_tracker.persist()
         return True
 
+    @instrumented
+    async def on_invite_create(self, invite):
+        self.invite_tracker.add(invite)
+
+    @instrumented
+    async def on_invite_delete(self, invite):
+        self.invite_tracker.remove(invite)
+
     async def get_invite_link(self, guild):
         manage_guild = guild.me.guild_permissions.manage_guild
-        invites = await self.config.guild(guild).invite_links()
         possible_link = ""
+        invites = {}
         check_logs = manage_guild and guild.me.guild_permissions.view_audit_log
         if manage_guild and "VANITY_URL" in guild.features:
+            self.event_stats.rest_call()
             possible_link = str(await guild.vanity_invite())
-        if invites and manage_guild:
-            guild_invites = await guild.invites()
-            for invite in guild_invites:
-                if invite.code in invites:
-                    uses = invites[invite.code]["uses"]
-                    # logger.info(f"{invite.code}: {invite.uses} - {uses}")
-                    if invite.uses > uses:
-                        possible_link = _(
-                            "https://discord.gg/{code}\n" "Invited by: {inviter}"
-                        ).format(code=invite.code, inviter=str(invite.inviter))
-
-            if not possible_link:
-                for code, data in invites.items():
-                    try:
-                        invite = await self.bot.get_invite(code)
-                    except (discord.errors.NotFound, discord.errors.HTTPException) as e:
-                        logger.error("Error getting invite ".format(code))
-                        invite = None
-                        pass
-                    if not invite:
-                        if (data["max_uses"] - data["uses"]) == 1:
-                            # The invite link was on its last uses and subsequently
-                            # deleted so we're fairly sure this was the one used
-                            inviter = await self.bot.get_user_info(data["inviter"])
-                            possible_link = _(
-                                "https://discord.gg/{code}\n" "Invited by: {inviter}"
-                            ).format(code=code, inviter=str(inviter))
-            await self.save_invite_links(guild)  # Save all the invites again since they've changed
+        if manage_guild:
+            invites = await self.invite_tracker.get(guild)
+            for code, data in await self.invite_tracker.refresh(guild):
+                inviter = data.get("inviter_name")
+                if inviter is None:
+                    inviter = self.bot.get_user(data["inviter"]) or data["inviter"]
+                possible_link = _(
+                    "https://discord.gg/{code}\n" "Invited by: {inviter}"
+                ).format(code=code, inviter=str(inviter))
         if check_logs and not possible_link:
             action = discord.AuditLogAction.invite_create
-            async for log in guild.audit_logs(action=action):
+            for log in await self.audit_log.entries(guild, action, limit=100):
                 if log.target.code not in invites:
                     possible_link = _(
                         "https://discord.gg/{code}\n" "Invited by: {inviter}"
@@ -252,13 +419,14 @@ class EventMixin:
                     break
         return possible_link
 
+    @instrumented
     async def on_member_join(self, member):
         guild = member.guild
 
-        if not await self.config.guild(guild).user_join():
+        if not await self.guild_setting(guild, "user_join"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         time = datetime.datetime.utcnow()
@@ -289,7 +457,7 @@ class EventMixin:
             if possible_link:
                 embed.add_field(name=_("Invite Link"), value=possible_link)
             embed.set_thumbnail(url=member.avatar_url)
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
             msg = (
                 f":white_check_mark: **{member}** "
@@ -298,15 +466,16 @@ class EventMixin:
                 + "\n"
                 + possible_link
             )
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
+    @instrumented
     async def on_member_remove(self, member):
         guild = member.guild
 
-        if not await self.config.guild(guild).user_left():
+        if not await self.guild_setting(guild, "user_left"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -318,11 +487,10 @@ class EventMixin:
         if channel.permissions_for(guild.me).embed_links:
             if channel.permissions_for(guild.me).view_audit_log:
                 action = discord.AuditLogAction.kick
-                async for log in guild.audit_logs(limit=5, action=action):
-                    if log.target.id == member.id:
-                        perp = log.user
-                        reason = log.reason
-                        break
+                log = await self.audit_log.find(guild, action, target_id=member.id)
+                if log:
+                    perp = log.user
+                    reason = log.reason
             embed = discord.Embed(
                 description=member.mention, colour=discord.Colour.dark_green(), timestamp=time
             )
@@ -338,7 +506,7 @@ class EventMixin:
                 icon_url=member.avatar_url,
             )
             embed.set_thumbnail(url=member.avatar_url)
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
             msg = (
                 f":x:**{member}** "
@@ -353,7 +521,7 @@ class EventMixin:
                     + _(". Total users: ")
                     + str(len(guild.members))
                 )
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
     async def get_permission_change(self, before, after, embed_links):
         p_msg = ""
@@ -396,12 +564,13 @@ class EventMixin:
                 continue
         return p_msg
 
+    @instrumented
     async def on_guild_channel_create(self, new_channel):
         guild = new_channel.guild
-        if not await self.config.guild(guild).channel_change():
+        if not await self.guild_setting(guild, "channel_change"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -417,12 +586,11 @@ class EventMixin:
         reason = None
         if channel.permissions_for(guild.me).view_audit_log:
             action = discord.AuditLogAction.channel_create
-            async for log in guild.audit_logs(limit=2, action=action):
-                if log.target.id == new_channel.id:
-                    perp = log.user
-                    if log.reason:
-                        reason = log.reason
-                    break
+            log = await self.audit_log.find(guild, action, target_id=new_channel.id, limit=2)
+            if log:
+                perp = log.user
+                if log.reason:
+                    reason = log.reason
         if type(new_channel) == discord.TextChannel:
             msg += _("Text Channel Created")
             embed.add_field(name=_("Type"), value=_("Text"))
@@ -439,16 +607,17 @@ class EventMixin:
             msg += _("Reason ") + reason + "\n"
             embed.add_field(name=_("Reason "), value=reason)
         if embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
+    @instrumented
     async def on_guild_channel_delete(self, old_channel):
         guild = old_channel.guild
-        if not await self.config.guild(guild).channel_change():
+        if not await self.guild_setting(guild, "channel_change"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -464,12 +633,11 @@ class EventMixin:
         reason = None
         if channel.permissions_for(guild.me).view_audit_log:
             action = discord.AuditLogAction.channel_delete
-            async for log in guild.audit_logs(limit=2, action=action):
-                if log.target.id == old_channel.id:
-                    perp = log.user
-                    if log.reason:
-                        reason = log.reason
-                    break
+            log = await self.audit_log.find(guild, action, target_id=old_channel.id, limit=2)
+            if log:
+                perp = log.user
+                if log.reason:
+                    reason = log.reason
         if type(old_channel) == discord.TextChannel:
             msg += _("Text Channel Deleted")
             embed.add_field(name=_("Type"), value=_("Text"))
@@ -486,16 +654,17 @@ class EventMixin:
             msg += _("Reason ") + reason + "\n"
             embed.add_field(name=_("Reason "), value=reason)
         if embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
+    @instrumented
     async def on_guild_channel_update(self, before, after):
         guild = before.guild
-        if not await self.config.guild(guild).channel_change():
+        if not await self.guild_setting(guild, "channel_change"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -511,12 +680,11 @@ class EventMixin:
         reason = None
         if channel.permissions_for(guild.me).view_audit_log:
             action = discord.AuditLogAction.channel_update
-            async for log in guild.audit_logs(limit=5, action=action):
-                if log.target.id == before.id:
-                    perp = log.user
-                    if log.reason:
-                        reason = log.reason
-                    break
+            log = await self.audit_log.find(guild, action, target_id=before.id)
+            if log:
+                perp = log.user
+                if log.reason:
+                    reason = log.reason
         if type(before) == discord.TextChannel:
             text_updates = {
                 "name": _("Name:"),
@@ -577,9 +745,9 @@ class EventMixin:
         if len(embed.fields) == 0:
             return
         if channel.permissions_for(guild.me).embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
     async def get_role_permission_change(self, before, after):
         permission_list = [
@@ -620,12 +788,13 @@ class EventMixin:
                 p_msg += f"{p} Set to {change}\n"
         return p_msg
 
+    @instrumented
     async def on_guild_role_update(self, before, after):
         guild = before.guild
-        if not await self.config.guild(guild).role_change():
+        if not await self.guild_setting(guild, "role_change"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -634,12 +803,11 @@ class EventMixin:
         reason = None
         if channel.permissions_for(guild.me).view_audit_log:
             action = discord.AuditLogAction.role_update
-            async for log in guild.audit_logs(limit=5, action=action):
-                if log.target.id == before.id:
-                    perp = log.user
-                    if log.reason:
-                        reason = log.reason
-                    break
+            log = await self.audit_log.find(guild, action, target_id=before.id)
+            if log:
+                perp = log.user
+                if log.reason:
+                    reason = log.reason
         embed_links = channel.permissions_for(guild.me).embed_links
         time = datetime.datetime.utcnow()
         embed = discord.Embed(description=after.mention, colour=after.colour, timestamp=time)
@@ -682,16 +850,17 @@ class EventMixin:
         if len(embed.fields) == 0:
             return
         if embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
+    @instrumented
     async def on_guild_role_create(self, role):
         guild = role.guild
-        if not await self.config.guild(guild).role_change():
+        if not await self.guild_setting(guild, "role_change"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -700,12 +869,11 @@ class EventMixin:
         reason = None
         if channel.permissions_for(guild.me).view_audit_log:
             action = discord.AuditLogAction.role_create
-            async for log in guild.audit_logs(limit=5, action=action):
-                if log.target.id == role.id:
-                    perp = log.user
-                    if log.reason:
-                        reason = log.reason
-                    break
+            log = await self.audit_log.find(guild, action, target_id=role.id)
+            if log:
+                perp = log.user
+                if log.reason:
+                    reason = log.reason
         embed_links = channel.permissions_for(guild.me).embed_links
         time = datetime.datetime.utcnow()
         embed = discord.Embed(
@@ -721,16 +889,17 @@ class EventMixin:
             msg += _("Reason ") + reason + "\n"
             embed.add_field(name=_("Reason "), value=reason)
         if embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
+    @instrumented
     async def on_guild_role_delete(self, role):
         guild = role.guild
-        if not await self.config.guild(guild).role_change():
+        if not await self.guild_setting(guild, "role_change"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -739,12 +908,11 @@ class EventMixin:
         reason = None
         if channel.permissions_for(guild.me).view_audit_log:
             action = discord.AuditLogAction.role_delete
-            async for log in guild.audit_logs(limit=5, action=action):
-                if log.target.id == role.id:
-                    perp = log.user
-                    if log.reason:
-                        reason = log.reason
-                    break
+            log = await self.audit_log.find(guild, action, target_id=role.id)
+            if log:
+                perp = log.user
+                if log.reason:
+                    reason = log.reason
         embed_links = channel.permissions_for(guild.me).embed_links
         time = datetime.datetime.utcnow()
         embed = discord.Embed(
@@ -760,19 +928,30 @@ class EventMixin:
             msg += _("Reason ") + reason + "\n"
             embed.add_field(name=_("Reason "), value=reason)
         if embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
+    @instrumented
+    async def on_raw_message_edit(self, payload):
+        # When discord.py has the message on_message_edit runs after this
+        # and replaces the content with the clean content
+        guild_id = payload.data.get("guild_id")
+        if guild_id is None or "content" not in payload.data:
+            return
+        self.message_cache.edit(int(guild_id), payload.message_id, payload.data["content"])
+
+    @instrumented
     async def on_message_edit(self, before, after):
         guild = before.guild
         if guild is None:
             return
+        self.message_cache.edit(guild.id, after.id, after.clean_content)
         if before.author.bot:
             return
-        if not await self.config.guild(guild).message_edit():
+        if not await self.guild_setting(guild, "message_edit"):
             return
-        if before.channel.id in await self.config.guild(guild).ignored_channels():
+        if before.channel.id in await self.guild_setting(guild, "ignored_channels"):
             return
         if before.content == after.content:
             return
@@ -783,7 +962,7 @@ class EventMixin:
         for i in after.mentions:
             cleanafter = cleanafter.replace(i.mention, str(i))
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -810,7 +989,7 @@ class EventMixin:
             embed.add_field(name=_("Channel:"), value=before.channel.mention)
             embed.set_footer(text=_("User ID: ") + str(before.author.id))
             embed.set_author(name=name + _(" - Edited Message"), icon_url=before.author.avatar_url)
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
             msg = (
                 f":pencil: `{time.strftime(fmt)}` **"
@@ -822,14 +1001,16 @@ class EventMixin:
                 + _("\nAfter: ")
                 + cleanafter
             )
-            await channel.send(msg[:2000])
+            await self.log_queue.send(channel, msg[:2000])
 
+    @instrumented
     async def on_guild_update(self, before, after):
+        received = datetime.datetime.utcnow()
         guild = after
-        if not await self.config.guild(guild).guild_change():
+        if not await self.guild_setting(guild, "guild_change"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -863,7 +1044,8 @@ class EventMixin:
         reasons = []
         if channel.permissions_for(guild.me).view_audit_log:
             action = discord.AuditLogAction.guild_update
-            async for log in guild.audit_logs(limit=int(len(embed.fields) / 2), action=action):
+            limit = int(len(embed.fields) / 2)
+            for log in await self.audit_log.entries(guild, action, limit=limit, since=received):
                 perps.append(log.user)
                 if log.reason:
                     reasons.append(log.reason)
@@ -877,15 +1059,17 @@ class EventMixin:
             msg += _("Reasons ") + f"{reasons}\n"
             embed.add_field(name=_("Reasons "), value=reasons)
         if channel.permissions_for(guild.me).embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
+    @instrumented
     async def on_guild_emojis_update(self, guild, before, after):
-        if not await self.config.guild(guild).guild_change():
+        received = datetime.datetime.utcnow()
+        if not await self.guild_setting(guild, "guild_change"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -927,11 +1111,10 @@ class EventMixin:
 
         if channel.permissions_for(guild.me).view_audit_log:
             if action:
-                async for log in guild.audit_logs(limit=1, action=action):
+                for log in await self.audit_log.entries(guild, action, limit=1, since=received):
                     perp = log.user
                     if log.reason:
                         reason = log.reason
-                    break
         if perp:
             embed.add_field(name=_("Updated by "), value=perp.mention)
             msg += _("Updated by ") + str(perp) + "\n"
@@ -939,18 +1122,19 @@ class EventMixin:
             msg += _("Reason ") + reason + "\n"
             embed.add_field(name=_("Reason "), value=reason)
         if channel.permissions_for(guild.me).embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
 
+    @instrumented
     async def on_voice_state_update(self, member, before, after):
         guild = member.guild
-        if not await self.config.guild(guild).voice_change():
+        if not await self.guild_setting(guild, "voice_change"):
             return
         if member.bot:
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -1008,29 +1192,33 @@ class EventMixin:
         reason = None
         if channel.permissions_for(guild.me).view_audit_log and change_type:
             action = discord.AuditLogAction.member_update
-            async for log in guild.audit_logs(limit=5, action=action):
-                is_change = getattr(log.after, change_type, None)
-                if log.target.id == member.id and is_change:
-                    perp = log.user
-                    if log.reason:
-                        reason = log.reason
-                    break
+            log = await self.audit_log.find(
+                guild,
+                action,
+                target_id=member.id,
+                check=lambda l: getattr(l.after, change_type, None),
+            )
+            if log:
+                perp = log.user
+                if log.reason:
+                    reason = log.reason
         if perp:
             embed.add_field(name=_("Updated by"), value=perp.mention)
         if reason:
             msg += _("Reason ") + reason + "\n"
             embed.add_field(name=_("Reason "), value=reason)
         if channel.permissions_for(guild.me).embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg.replace(member.mention, str(member)))
+            await self.log_queue.send(channel, msg.replace(member.mention, str(member)))
 
+    @instrumented
     async def on_member_update(self, before, after):
         guild = before.guild
-        if not await self.config.guild(guild).user_change():
+        if not await self.guild_setting(guild, "user_change"):
             return
         try:
-            channel = await modlog.get_modlog_channel(guild)
+            channel = await self.get_modlog_channel(guild)
         except:
             return
         if channel is None:
@@ -1063,21 +1251,19 @@ class EventMixin:
                             embed.description = role.mention + _(" Role Applied.")
                     if channel.permissions_for(guild.me).view_audit_log:
                         action = discord.AuditLogAction.member_role_update
-                        async for log in guild.audit_logs(limit=5, action=action):
-                            if log.target.id == before.id:
-                                perp = log.user
-                                if log.reason:
-                                    reason = log.reason
-                                break
+                        log = await self.audit_log.find(guild, action, target_id=before.id)
+                        if log:
+                            perp = log.user
+                            if log.reason:
+                                reason = log.reason
                 else:
                     if channel.permissions_for(guild.me).view_audit_log:
                         action = discord.AuditLogAction.member_update
-                        async for log in guild.audit_logs(limit=5, action=action):
-                            if log.target.id == before.id:
-                                perp = log.user
-                                if log.reason:
-                                    reason = log.reason
-                                break
+                        log = await self.audit_log.find(guild, action, target_id=before.id)
+                        if log:
+                            perp = log.user
+                            if log.reason:
+                                reason = log.reason
                     msg += _("Before ") + f"{name} {before_attr}\n"
                     msg += _("After ") + f"{name} {after_attr}\n"
                     embed.add_field(name=_("Before ") + name, value=str(before_attr)[:1024])
@@ -1091,6 +1277,6 @@ class EventMixin:
             msg += _("Reason: ") + f"{reason}\n"
             embed.add_field(name=_("Reason"), value=reason)
         if embed_links:
-            await channel.send(embed=embed)
+            await self.log_queue.send(channel, embed=embed)
         else:
-            await channel.send(msg)
+            await self.log_queue.send(channel, msg)
@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import time
+
+
+def _current_task():
+    current_task = getattr(asyncio, "current_task", None)
+    if current_task is None:
+        current_task = asyncio.Task.current_task
+    try:
+        return current_task()
+    except RuntimeError:
+        return None
+
+
+class HandlerStats:
+    """
+        Counters for a single event handler
+    """
+
+    __slots__ = ("count", "total", "longest", "rest_calls", "config_reads")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.rest_calls = 0
+        self.config_reads = 0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class EventStats:
+    """
+        Per handler timing, REST call and Config read counts
+
+        Handlers wrapped with `instrumented` register their task while they
+        run so that REST calls and Config reads made anywhere in that task
+        are attributed to the handler.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self._running = {}
+
+    def get(self, name: str) -> HandlerStats:
+        if name not in self.handlers:
+            self.handlers[name] = HandlerStats()
+        return self.handlers[name]
+
+    def current(self) -> str:
+        return self._running.get(_current_task(), "background")
+
+    def rest_call(self, name: str = None):
+        self.get(name or self.current()).rest_calls += 1
+
+    def config_read(self, name: str = None):
+        self.get(name or self.current()).config_reads += 1
+
+    def reset(self):
+        self.handlers = {}
+
+    def table(self) -> str:
+        header = "{:<28}{:>8}{:>12}{:>10}{:>10}{:>7}{:>8}".format(
+            "Handler", "Events", "Total ms", "Avg ms", "Max ms", "REST", "Config"
+        )
+        lines = [header]
+        for name, stats in sorted(self.handlers.items(), key=lambda x: x[1].total, reverse=True):
+            lines.append(
+                "{:<28}{:>8}{:>12.1f}{:>10.2f}{:>10.2f}{:>7}{:>8}".format(
+                    name,
+                    stats.count,
+                    stats.total * 1000,
+                    stats.average * 1000,
+                    stats.longest * 1000,
+                    stats.rest_calls,
+                    stats.config_reads,
+                )
+            )
+        return "\n".join(lines)
+
+
+def instrumented(func):
+    """
+        Record the handlers timing in `self.event_stats`
+    """
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        stats = self.event_stats
+        task = _current_task()
+        stats._running[task] = func.__name__
+        start = time.perf_counter()
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            handler = stats.get(func.__name__)
+            handler.count += 1
+            handler.total += elapsed
+            handler.longest = max(handler.longest, elapsed)
+            stats._running.pop(task, None)
+
+    return wrapper
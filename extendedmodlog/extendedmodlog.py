@@ -4,8 +4,14 @@ import discord
 import asyncio
 from random import choice, randint
 from redbot.core.i18n import Translator, cog_i18n
+from redbot.core.utils.chat_formatting import box
 
 from .eventmixin import EventMixin
+from .auditlogcache import AuditLogCache
+from .logqueue import LogQueue
+from .invitetracker import InviteTracker
+from .messagecache import MessageCache
+from .eventstats import EventStats
 
 inv_settings = {
     "message_edit": False,
@@ -20,6 +26,7 @@ inv_settings = {
     "emoji_change": False,
     "commands_used": False,
     "ignored_channels": [],
+    "cached_channels": [],
     "invite_links": {},
 }
 
@@ -37,6 +44,11 @@ class ExtendedModLog(EventMixin, commands.Cog):
         self.bot = bot
         self.config = Config.get_conf(self, 154457677895)
         self.config.register_guild(**inv_settings, force_registration=True)
+        self.event_stats = EventStats()
+        self.audit_log = AuditLogCache(bot, self.event_stats)
+        self.log_queue = LogQueue(bot, self.event_stats)
+        self.invite_tracker = InviteTracker(bot, self.config, self.event_stats)
+        self.message_cache = MessageCache(self.config, self.event_stats)
         self.loop = bot.loop.create_task(self.invite_links_loop())
 
     @checks.admin_or_permissions(manage_channels=True)
@@ -96,6 +108,14 @@ class ExtendedModLog(EventMixin, commands.Cog):
                 chans = ", ".join(guild.get_channel(c).mention for c in ignored_channels)
                 msg += _("Ignored Channels") + ": " + chans
                 e.add_field(name=_("Ignored Channels"), value=chans)
+            cached_channels = await self.config.guild(guild).cached_channels()
+            # Channels deleted since they were cached are skipped
+            cached_channels = [guild.get_channel(c) for c in cached_channels]
+            cached_channels = [c for c in cached_channels if c is not None]
+            if cached_channels:
+                chans = ", ".join(c.mention for c in cached_channels)
+                msg += "\n" + _("Cached Channels") + ": " + chans
+                e.add_field(name=_("Cached Channels"), value=chans)
 
             e.set_thumbnail(url=guild.icon_url)
             if ctx.channel.permissions_for(ctx.me).embed_links:
@@ -320,5 +340,43 @@ class ExtendedModLog(EventMixin, commands.Cog):
         else:
             await ctx.send(channel.mention + _(" is not being ignored."))
 
+    @modlogtoggles.command()
+    async def cache(self, ctx, channel: discord.TextChannel = None):
+        """
+            Toggle caching message content for a channel
+
+            Cached messages can still be logged when deleted after
+            they have left the bots message cache, useful in busy channels.
+            `channel` the channel to cache messages in
+            defaults to current channel
+        """
+        if channel is None:
+            channel = ctx.channel
+        if await self.message_cache.toggle_channel(channel):
+            await ctx.send(_("Now caching deleted message content in ") + channel.mention)
+        else:
+            await ctx.send(_("No longer caching deleted message content in ") + channel.mention)
+
+    @modlogtoggles.command()
+    @checks.is_owner()
+    async def stats(self, ctx, reset: bool = False):
+        """
+            Show how much time each event handler has used
+
+            Lists events handled, total, average and longest time,
+            REST calls and Config reads made by each handler since load.
+            `reset` clear the stats after showing them
+        """
+        if not self.event_stats.handlers:
+            await ctx.send(_("No events have been handled yet."))
+            return
+        await ctx.send(box(self.event_stats.table()))
+        if reset:
+            self.event_stats.reset()
+
     def __unload(self):
         self.loop.cancel()
+        self.audit_log.clear()
+        self.bot.loop.create_task(self.log_queue.close())
+        self.message_cache.clear()
+        self.bot.loop.create_task(self.invite_tracker.persist())
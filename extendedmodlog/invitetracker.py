@@ -0,0 +1,154 @@
+import asyncio
+import logging
+
+import discord
+
+logger = logging.getLogger("red.ExtendedModLog")
+
+
+class InviteTracker:
+    """
+        In-memory invite usage cache
+
+        Invite uses are kept per guild in memory, refreshed on demand when
+        a member joins and updated from invite create/delete events.
+        Changes are only written back to Config by `persist`.
+    """
+
+    def __init__(self, bot, config, stats=None, concurrency: int = 5):
+        self.bot = bot
+        self.config = config
+        self.stats = stats
+        self._invites = {}
+        self._dirty = set()
+        self._pending = {}
+        self._waiting = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @staticmethod
+    def serialize(invite: discord.Invite) -> dict:
+        return {
+            "uses": invite.uses,
+            "max_age": invite.max_age,
+            "created_at": invite.created_at.timestamp(),
+            "max_uses": invite.max_uses,
+            "temporary": invite.temporary,
+            "inviter": invite.inviter.id,
+            "inviter_name": str(invite.inviter),
+            "channel": invite.channel.id,
+        }
+
+    async def get(self, guild: discord.Guild) -> dict:
+        if guild.id not in self._invites:
+            if self.stats is not None:
+                self.stats.config_read()
+            self._invites[guild.id] = await self.config.guild(guild).invite_links()
+        return self._invites[guild.id]
+
+    def add(self, invite: discord.Invite):
+        if invite.guild is None or invite.guild.id not in self._invites:
+            return
+        try:
+            self._invites[invite.guild.id][invite.code] = self.serialize(invite)
+        except AttributeError:
+            return
+        self._dirty.add(invite.guild.id)
+
+    def remove(self, invite: discord.Invite):
+        if invite.guild is None or invite.code not in self._invites.get(invite.guild.id, {}):
+            return
+        # Keep the entry until the next refresh so a final use can still be matched
+        self._invites[invite.guild.id][invite.code]["deleted"] = True
+        self._dirty.add(invite.guild.id)
+
+    async def _fetch(self, guild: discord.Guild) -> list:
+        old = await self.get(guild)
+        fresh = {}
+        try:
+            guild_invites = await guild.invites()
+        except (discord.errors.Forbidden, discord.errors.HTTPException):
+            logger.error("Error getting invites for {}".format(guild.id))
+            return []
+        for invite in guild_invites:
+            try:
+                fresh[invite.code] = self.serialize(invite)
+            except AttributeError:
+                pass
+        used = []
+        for code, data in fresh.items():
+            if code in old and data["uses"] > old[code]["uses"]:
+                used.append((code, data))
+            elif old and code not in old and data["uses"]:
+                used.append((code, data))
+        if not used:
+            for code, data in old.items():
+                if code in fresh or not data["max_uses"]:
+                    continue
+                if (data["max_uses"] - data["uses"]) == 1:
+                    # The invite link was on its last uses and subsequently
+                    # deleted so we're fairly sure this was the one used
+                    used.append((code, data))
+            deleted = [(code, data) for code, data in used if data.get("deleted")]
+            if deleted:
+                # Discord deletes an invite once it reaches max uses so the
+                # ones we saw deleted are the likelier match
+                used = deleted
+        self._invites[guild.id] = fresh
+        if fresh != old:
+            self._dirty.add(guild.id)
+        return used
+
+    async def refresh(self, guild: discord.Guild) -> list:
+        """
+            Refresh a guilds invites and return the `(code, data)` of used invites
+
+            Concurrent callers for the same guild share a single request.
+            A caller arriving while a request is already running waits for
+            the next one so its join isn't diffed against an older snapshot.
+        """
+        task = self._waiting.get(guild.id)
+        if task is None:
+            if self.stats is not None:
+                self.stats.rest_call()
+            task = self.bot.loop.create_task(self._fetch_next(guild, self._pending.get(guild.id)))
+            self._waiting[guild.id] = task
+        return await asyncio.shield(task)
+
+    async def _fetch_next(self, guild: discord.Guild, running) -> list:
+        if running is not None:
+            await asyncio.wait([running])
+        self._waiting.pop(guild.id, None)
+        task = self.bot.loop.create_task(self._fetch(guild))
+        self._pending[guild.id] = task
+
+        def done(t):
+            if self._pending.get(guild.id) is t:
+                del self._pending[guild.id]
+
+        task.add_done_callback(done)
+        return await task
+
+    async def _poll_guild(self, guild: discord.Guild):
+        try:
+            await self.refresh(guild)
+        finally:
+            self._semaphore.release()
+
+    async def poll(self, guilds: list, interval: float):
+        """
+            Refresh every guild spread evenly across `interval` seconds
+        """
+        delay = interval / max(len(guilds), 1)
+        for guild in guilds:
+            await self._semaphore.acquire()
+            self.bot.loop.create_task(self._poll_guild(guild))
+            await asyncio.sleep(delay)
+        await self.persist()
+
+    async def persist(self):
+        dirty, self._dirty = self._dirty, set()
+        for guild_id in dirty:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None or guild_id not in self._invites:
+                continue
+            await self.config.guild(guild).invite_links.set(self._invites[guild_id])
@@ -0,0 +1,173 @@
+import asyncio
+import datetime
+import logging
+import time
+from collections import deque
+
+import discord
+from redbot.core.i18n import Translator
+
+_ = Translator("ExtendedModLog", __file__)
+logger = logging.getLogger("red.ExtendedModLog")
+
+MAX_FIELDS = 25
+MAX_FIELD_NAME = 256
+MAX_FIELD_VALUE = 1024
+MAX_EMBED_SIZE = 5500
+MAX_MESSAGE_SIZE = 2000
+
+
+class LogQueue:
+    """
+        Burst aware output pipeline for modlog channels
+
+        Log entries are posted immediately while a channel is quiet.
+        Once more than `burst_threshold` entries arrive within
+        `burst_window` seconds the channel is considered in a burst and
+        entries are queued then packed into digest embeds which are
+        flushed after `flush_delay` seconds or as soon as a digest is full.
+        `close` sends whatever is still queued straight away.
+    """
+
+    def __init__(
+        self,
+        bot,
+        stats=None,
+        burst_window: float = 5.0,
+        burst_threshold: int = 4,
+        flush_delay: float = 3.0,
+    ):
+        self.bot = bot
+        self.stats = stats
+        self.burst_window = burst_window
+        self.burst_threshold = burst_threshold
+        self.flush_delay = flush_delay
+        self._recent = {}
+        self._queues = {}
+        self._full = {}
+        self._flushers = {}
+        self._closing = False
+
+    async def close(self):
+        """
+            Flush every queued digest now, called when the cog unloads
+        """
+        self._closing = True
+        for full in self._full.values():
+            full.set()
+        await asyncio.gather(*self._flushers.values(), return_exceptions=True)
+
+    def _in_burst(self, channel_id: int) -> bool:
+        now = time.monotonic()
+        recent = self._recent.setdefault(channel_id, deque())
+        recent.append(now)
+        while recent and now - recent[0] > self.burst_window:
+            recent.popleft()
+        return len(recent) > self.burst_threshold or bool(self._queues.get(channel_id))
+
+    async def send(self, channel: discord.TextChannel, content: str = None, embed=None, file=None):
+        """
+            Send a log entry to a modlog channel
+
+            Files are never batched and are always sent straight away
+        """
+        if file is not None or self._closing or not self._in_burst(channel.id):
+            if self.stats is not None:
+                self.stats.rest_call()
+            await channel.send(content=content, embed=embed, file=file)
+            return
+        queue = self._queues.setdefault(channel.id, [])
+        queue.append((content, embed))
+        if channel.id not in self._flushers:
+            self._full[channel.id] = asyncio.Event()
+            self._flushers[channel.id] = self.bot.loop.create_task(self._flusher(channel))
+        if self._is_full(queue):
+            self._full[channel.id].set()
+
+    @staticmethod
+    def _is_full(queue: list) -> bool:
+        embeds = [e for c, e in queue if e is not None]
+        text = sum(len(c) + 1 for c, e in queue if e is None and c)
+        return len(embeds) >= MAX_FIELDS or text >= MAX_MESSAGE_SIZE
+
+    async def _flusher(self, channel: discord.TextChannel):
+        full = self._full[channel.id]
+        try:
+            while self._queues.get(channel.id):
+                try:
+                    if not self._closing:
+                        await asyncio.wait_for(full.wait(), timeout=self.flush_delay)
+                except asyncio.TimeoutError:
+                    pass
+                full.clear()
+                entries = self._queues.pop(channel.id, [])
+                for kwargs in self.pack(entries):
+                    if self.stats is not None:
+                        self.stats.rest_call("log_queue")
+                    try:
+                        await channel.send(**kwargs)
+                    except discord.errors.HTTPException:
+                        logger.error("Error sending modlog digest to {}".format(channel.id))
+        finally:
+            self._flushers.pop(channel.id, None)
+            self._full.pop(channel.id, None)
+
+    @staticmethod
+    def embed_to_field(embed: discord.Embed):
+        name = embed.author.name or embed.title or "\u200b"
+        lines = []
+        if embed.description:
+            lines.append(str(embed.description))
+        for field in embed.fields:
+            lines.append("**{}** {}".format(field.name, field.value))
+        if embed.footer.text:
+            lines.append(str(embed.footer.text))
+        value = "\n".join(lines) or "\u200b"
+        return str(name)[:MAX_FIELD_NAME], value[:MAX_FIELD_VALUE]
+
+    def pack(self, entries: list):
+        """
+            Pack queued entries into as few messages as possible
+
+            Consecutive embeds become multi-field digest embeds and
+            consecutive text entries are joined up to the message limit.
+        """
+        messages = []
+        embeds = []
+        text = ""
+        for content, embed in entries + [(None, None)]:
+            if embed is None and embeds:
+                messages.extend(self._digests(embeds))
+                embeds = []
+            if (embed is not None or content is None) and text:
+                messages.append({"content": text})
+                text = ""
+            if embed is not None:
+                embeds.append(embed)
+            elif content:
+                content = content[:MAX_MESSAGE_SIZE]
+                if text and len(text) + len(content) + 1 > MAX_MESSAGE_SIZE:
+                    messages.append({"content": text})
+                    text = ""
+                text = text + "\n" + content if text else content
+        return messages
+
+    def _digests(self, embeds: list):
+        if len(embeds) == 1:
+            return [{"embed": embeds[0]}]
+        digests = []
+        digest = None
+        size = 0
+        for embed in embeds:
+            name, value = self.embed_to_field(embed)
+            too_big = size + len(name) + len(value) > MAX_EMBED_SIZE
+            if digest is None or len(digest.fields) >= MAX_FIELDS or too_big:
+                digest = discord.Embed(colour=embed.colour, timestamp=datetime.datetime.utcnow())
+                digests.append(digest)
+                size = 0
+            digest.add_field(name=name, value=value, inline=False)
+            size += len(name) + len(value)
+        for digest in digests:
+            author = _("Modlog digest: {count} events").format(count=len(digest.fields))
+            digest.set_author(name=author)
+        return [{"embed": d} for d in digests]
@@ -0,0 +1,115 @@
+import datetime
+from collections import OrderedDict
+
+import discord
+
+
+class CachedMessage:
+    """
+        Compact copy of a message kept for delete logs
+    """
+
+    __slots__ = ("id", "channel_id", "author_id", "created_at", "content", "attachments")
+
+    def __init__(self, id, channel_id, author_id, created_at, content, attachments):
+        self.id = id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.created_at = created_at
+        self.content = content
+        self.attachments = attachments
+
+    @classmethod
+    def from_message(cls, message: discord.Message, content_limit: int = 1000):
+        return cls(
+            message.id,
+            message.channel.id,
+            message.author.id,
+            message.created_at.timestamp(),
+            message.clean_content[:content_limit],
+            tuple(a.filename for a in message.attachments),
+        )
+
+    @property
+    def size(self) -> int:
+        return 64 + len(self.content) + sum(len(a) for a in self.attachments)
+
+    @property
+    def timestamp(self) -> datetime.datetime:
+        return datetime.datetime.utcfromtimestamp(self.created_at)
+
+
+class MessageCache:
+    """
+        Ring buffer of message content for opted in channels
+
+        Each guild keeps its newest messages up to `budget` bytes,
+        the oldest messages are dropped first once the budget is used.
+    """
+
+    def __init__(self, config, stats=None, budget: int = 256 * 1024, content_limit: int = 1000):
+        self.config = config
+        self.stats = stats
+        self.budget = budget
+        self.content_limit = content_limit
+        self._channels = {}
+        self._messages = {}
+        self._sizes = {}
+
+    async def tracked_channels(self, guild: discord.Guild) -> set:
+        if guild.id not in self._channels:
+            if self.stats is not None:
+                self.stats.config_read()
+            self._channels[guild.id] = set(await self.config.guild(guild).cached_channels())
+        return self._channels[guild.id]
+
+    async def toggle_channel(self, channel: discord.TextChannel) -> bool:
+        """
+            Start or stop caching a channel, returns whether it is now cached
+        """
+        channels = await self.tracked_channels(channel.guild)
+        if channel.id in channels:
+            channels.discard(channel.id)
+            self.clear_channel(channel.guild.id, channel.id)
+        else:
+            channels.add(channel.id)
+        await self.config.guild(channel.guild).cached_channels.set(list(channels))
+        return channel.id in channels
+
+    def add(self, message: discord.Message):
+        guild_id = message.guild.id
+        cached = CachedMessage.from_message(message, self.content_limit)
+        messages = self._messages.setdefault(guild_id, OrderedDict())
+        messages[cached.id] = cached
+        self._sizes[guild_id] = self._sizes.get(guild_id, 0) + cached.size
+        while self._sizes[guild_id] > self.budget and messages:
+            __, old = messages.popitem(last=False)
+            self._sizes[guild_id] -= old.size
+
+    def edit(self, guild_id: int, message_id: int, content: str):
+        """
+            Replace the content of a cached message after it is edited
+        """
+        cached = self._messages.get(guild_id, {}).get(message_id)
+        if cached is None:
+            return
+        self._sizes[guild_id] -= cached.size
+        cached.content = content[: self.content_limit]
+        self._sizes[guild_id] += cached.size
+
+    def pop(self, guild_id: int, message_id: int):
+        messages = self._messages.get(guild_id)
+        if not messages or message_id not in messages:
+            return None
+        cached = messages.pop(message_id)
+        self._sizes[guild_id] -= cached.size
+        return cached
+
+    def clear_channel(self, guild_id: int, channel_id: int):
+        messages = self._messages.get(guild_id, {})
+        for message_id in [k for k, v in messages.items() if v.channel_id == channel_id]:
+            self.pop(guild_id, message_id)
+
+    def clear(self):
+        self._messages = {}
+        self._sizes = {}
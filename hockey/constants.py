@@ -1,6 +1,17 @@
 BASE_URL = "https://statsapi.web.nhl.com"
 HEADSHOT_URL = "https://nhl.bamcontent.com/images/headshots/current/168x168/{}.jpg"
 CONFIG_ID = 13457745779
+# Polling intervals in seconds for the game check loop
+POLL_LIVE = 15
+POLL_INTERMISSION = 120
+POLL_FINAL = 60
+POLL_PREVIEW_MAX = 1800
+POLL_SLATE_MIN = 300
+POLL_SLATE_MAX = 21600
+# Minutes before puck drop that preview messages are posted
+PREVIEW_POSTS = [60, 30, 10]
+# How long a game feed shown in the games menu can be reused
+MENU_TTL = 60
 TEAMS = {
     "Anaheim Ducks": {
         "away": "#F95602",
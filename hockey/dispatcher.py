@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import discord
+
+from .health import loop_health
+
+log = logging.getLogger("red.Hockey")
+
+
+class RateBucket:
+    """
+        Allows at most `rate` uses every `per` seconds
+    """
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self._uses = deque()
+        self._lock = asyncio.Lock()
+
+    def _expire(self, now: float):
+        while self._uses and now - self._uses[0] >= self.per:
+            self._uses.popleft()
+
+    @property
+    def idle(self) -> bool:
+        self._expire(time.monotonic())
+        return not self._uses and not self._lock.locked()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if len(self._uses) >= self.rate:
+                await asyncio.sleep(self.per - (now - self._uses[0]))
+                self._uses.popleft()
+            self._uses.append(time.monotonic())
+
+
+class Dispatcher:
+    """
+        Sends, edits and deletes messages in many channels at once
+
+        Every request waits on its channels bucket and the global bucket
+        so a large fan-out stays under discords rate limits instead of
+        relying on 429 retries.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 50,
+        channel_rate: tuple = (5, 5.0),
+        global_rate: tuple = (50, 1.0),
+    ):
+        self.concurrency = concurrency
+        self.channel_rate = channel_rate
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._global = RateBucket(*global_rate)
+        self._buckets = {}
+
+    def bucket(self, channel_id: int) -> RateBucket:
+        if channel_id not in self._buckets:
+            self._buckets[channel_id] = RateBucket(*self.channel_rate)
+        return self._buckets[channel_id]
+
+    def _prune(self):
+        for channel_id in [k for k, v in self._buckets.items() if v.idle]:
+            del self._buckets[channel_id]
+
+    async def _run_one(self, channel, func, start: float):
+        async with self._semaphore:
+            await self.bucket(channel.id).acquire()
+            await self._global.acquire()
+            try:
+                result = await func(channel)
+            except Exception as e:
+                log.error("Error dispatching to {}".format(channel.id), exc_info=True)
+                result = None
+        return channel, result, time.monotonic() - start
+
+    async def run(self, label: str, channels: list, func) -> dict:
+        """
+            Calls `func(channel)` for every channel concurrently
+
+            Returns the non None results keyed by the channels id as a string
+            which is how message ids are saved for goals
+        """
+        if not channels:
+            return {}
+        start = time.monotonic()
+        results = await asyncio.gather(*[self._run_one(c, func, start) for c in channels])
+        self._prune()
+        timings = [t for c, r, t in results]
+        self.report(label, timings)
+        loop_health.record_fanout(label, timings)
+        return {str(c.id): r for c, r, t in results if r is not None}
+
+    @staticmethod
+    def report(label: str, timings: list):
+        timings = sorted(timings)
+        p50 = timings[len(timings) // 2]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        log.info(
+            "{} delivered to {} channels p50 {:.2f}s p99 {:.2f}s".format(
+                label, len(timings), p50, p99
+            )
+        )
+
+    async def send(self, label: str, channels: list, func) -> dict:
+        """
+            `func(channel)` should send a message and return it,
+            the sent message ids are returned keyed by channel id
+        """
+
+        async def _send(channel):
+            msg = await func(channel)
+            return msg.id if msg is not None else None
+
+        return await self.run(label, channels, _send)
+
+    async def edit(self, label: str, bot, messages: dict, func) -> dict:
+        """
+            Edits every saved `{channel_id: message_id}` with the fields
+            returned by `func(channel)` without fetching the messages first
+
+            Returns True for edited messages and False for messages
+            or channels that no longer exist keyed by channel id
+        """
+        channels, message_ids, results = self._resolve(bot, messages)
+
+        async def _edit(channel):
+            try:
+                await bot.http.edit_message(
+                    message_id=message_ids[channel.id], channel_id=channel.id, **func(channel)
+                )
+            except discord.NotFound:
+                return False
+            return True
+
+        results.update(await self.run(label, channels, _edit))
+        return results
+
+    async def delete(self, label: str, bot, messages: dict) -> dict:
+        """
+            Deletes every saved `{channel_id: message_id}` without fetching them first
+
+            Returns True for deleted messages and False for messages
+            or channels that no longer exist keyed by channel id
+        """
+        channels, message_ids, results = self._resolve(bot, messages)
+
+        async def _delete(channel):
+            try:
+                await bot.http.delete_message(
+                    channel_id=channel.id, message_id=message_ids[channel.id]
+                )
+            except discord.NotFound:
+                return False
+            return True
+
+        results.update(await self.run(label, channels, _delete))
+        return results
+
+    @staticmethod
+    def _resolve(bot, messages: dict):
+        channels = []
+        message_ids = {}
+        missing = {}
+        for channel_id, message_id in messages.items():
+            channel = bot.get_channel(id=int(channel_id))
+            if channel is None:
+                missing[str(channel_id)] = False
+                continue
+            channels.append(channel)
+            message_ids[channel.id] = message_id
+        return channels, message_ids, missing
+
+
+dispatcher = Dispatcher()
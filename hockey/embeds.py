@@ -1,8 +1,8 @@
 import discord
-import aiohttp
 from datetime import datetime
 from .constants import BASE_URL, TEAMS, HEADSHOT_URL
 from .helper import *
+from .hockeyapi import api
 from .standings import Standings
 from redbot.core.i18n import Translator
 import logging
@@ -55,9 +55,7 @@ async def roster_embed(post_list, page):
     """
     player_list = post_list[page]
     url = BASE_URL + player_list["person"]["link"] + "?expand=person.stats&stats=yearByYear"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            player_data = await resp.json()
+    player_data = await api.get(url)
     player = player_data["people"][0]
     year_stats = [
         league
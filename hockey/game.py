@@ -1,12 +1,15 @@
-import aiohttp
+import asyncio
 from datetime import datetime
 from redbot.core import Config
 from .embeds import *
 from .pickems import Pickems
-from .constants import BASE_URL, TEAMS
+from .constants import *
 from .goal import Goal
 from .helper import *
-from .standings import Standings
+from .hockeyapi import api
+from .subscriptions import subscriptions
+from .gamefeed import *
+from .standings import Standings, standings_cache
 import discord
 import logging
 from redbot.core.i18n import Translator
@@ -45,6 +48,8 @@ class Game:
         first_star: str,
         second_star: str,
         third_star: str,
+        intermission_time_left: int = 0,
+        game_id: int = None,
     ):
         super().__init__()
         self.game_state = game_state
@@ -87,6 +92,8 @@ class Game:
         self.first_star = first_star
         self.second_star = second_star
         self.third_star = third_star
+        self.intermission_time_left = intermission_time_left
+        self.game_id = game_id
         self.config = hockey_config()
 
     def to_json(self) -> dict:
@@ -129,18 +136,8 @@ class Game:
             returns a list of game objects
         """
         games_list = await Game.get_games_list(team, start_date, end_date)
-        return_games_list = []
-        if games_list != []:
-            for games in games_list:
-                try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(BASE_URL + games["link"]) as resp:
-                            data = await resp.json()
-                    return_games_list.append(await Game.from_json(data))
-                except Exception as e:
-                    log.error("Error grabbing game data:", exc_info=True)
-                    continue
-        return return_games_list
+        games = await asyncio.gather(*[Game.from_url(game["link"]) for game in games_list])
+        return [game for game in games if game is not None]
 
     @staticmethod
     async def get_games_list(team=None, start_date: datetime = None, end_date: datetime = None):
@@ -171,9 +168,7 @@ class Game:
         if team not in ["all", None]:
             # if a team is provided get just that TEAMS data
             url += "&teamId={}".format(TEAMS[team]["id"])
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                data = await resp.json()
+        data = await api.get(url)
         game_list = [game for date in data["dates"] for game in date["games"]]
         return game_list
 
@@ -185,9 +180,7 @@ class Game:
         game = post_list[page]
 
         if type(game) is dict:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(BASE_URL + game["link"]) as resp:
-                    game_json = await resp.json()
+            game_json = await api.get(game["link"], ttl=MENU_TTL)
             data = await Game.from_json(game_json)
             log.debug(BASE_URL + game["link"])
         else:
@@ -195,6 +188,23 @@ class Game:
 
         return await data.make_game_embed()
 
+    @staticmethod
+    def prefetch_games(post_list: list, page: int):
+        """
+            Fetches the games either side of `page` in the background
+            so turning the page in the games menu doesn't wait on the api
+        """
+
+        async def _prefetch(link):
+            try:
+                await api.get(link, ttl=MENU_TTL)
+            except Exception as e:
+                log.debug("Error prefetching {}".format(link), exc_info=True)
+
+        for index in {(page + 1) % len(post_list), (page - 1) % len(post_list)} - {page}:
+            if type(post_list[index]) is dict:
+                asyncio.ensure_future(_prefetch(post_list[index]["link"]))
+
     async def make_game_embed(self):
         """
             Builds the game embed when the command is called
@@ -381,37 +391,55 @@ class Game:
         home_str = "GP:**0** W:**0** L:**0\n**OT:**0** PTS:**0** S:**0**\n"
         away_str = "GP:**0** W:**0** L:**0\n**OT:**0** PTS:**0** S:**0**\n"
         try:
-            stats, home_i = await Standings.get_team_standings(self.home_team)
-            for team in stats:
-                if team.name == self.away_team:
-                    streak = "{} {}".format(team.streak, streak_types[team.streak_type])
-                    away_str = msg.format(
-                        wins=team.wins,
-                        losses=team.losses,
-                        ot=team.ot,
-                        pts=team.pts,
-                        gp=team.gp,
-                        streak=streak,
-                    )
-                if team.name == self.home_team:
-                    streak = "{} {}".format(team.streak, streak_types[team.streak_type])
-                    home_str = msg.format(
-                        wins=team.wins,
-                        losses=team.losses,
-                        ot=team.ot,
-                        pts=team.pts,
-                        gp=team.gp,
-                        streak=streak,
-                    )
+            for team_name in [self.home_team, self.away_team]:
+                team = await standings_cache.get_team(team_name)
+                if team is None:
+                    continue
+                streak = "{} {}".format(team.streak, streak_types[team.streak_type])
+                team_str = msg.format(
+                    wins=team.wins,
+                    losses=team.losses,
+                    ot=team.ot,
+                    pts=team.pts,
+                    gp=team.gp,
+                    streak=streak,
+                )
+                if team_name == self.home_team:
+                    home_str = team_str
+                else:
+                    away_str = team_str
         except:
             pass
         return home_str, away_str
 
+    def next_poll(self) -> float:
+        """
+            Seconds to wait before this games data should be checked again
+
+            Previews are checked just after each preview post is due,
+            live games are checked often except during intermissions
+        """
+        if self.game_state == "Preview":
+            minutes = (self.game_start - datetime.utcnow()).total_seconds() / 60
+            for mark in PREVIEW_POSTS:
+                if minutes > mark:
+                    wait = (minutes - mark) * 60 + 5
+                    return max(POLL_LIVE, min(wait, POLL_PREVIEW_MAX))
+            # Waiting on puck drop
+            return POLL_LIVE
+        if self.game_state == "Live":
+            if self.intermission_time_left > 0:
+                return max(POLL_LIVE, min(self.intermission_time_left, POLL_INTERMISSION))
+            return POLL_LIVE
+        return POLL_FINAL
+
     async def check_game_state(self, bot):
+        """
+            Posts any changes since the last poll, returns the feed events
+        """
         post_state = ["all", self.home_team, self.away_team]
         home = await get_team(self.home_team)
         away = await get_team(self.away_team)
-        team_list = await self.config.teams()
         # Home team checking
         if self.game_state == "Preview":
             """Checks if the the game state has changes from Final to Preview
@@ -438,29 +466,52 @@ class Game:
 
                 # Create channel and look for game day thread
 
-        if self.game_state == "Live":
-            """Checks what the period is and posts the game is starting in the appropriate channel"""
-            if home["period"] != self.period:
-                msg = "**{} Period starting {} at {}**"
-                log.debug(msg.format(self.period_ord, self.away_team, self.home_team))
-                await self.post_game_state(bot)
-                await self.save_game_state()
+        events = []
+        if self.game_state in ["Live", "Final"]:
+            events = await game_feed.diff(self)
+            await game_feed.dispatch(bot, self, events)
+        return events
+
+    async def on_period_start(self, bot, event):
+        msg = "**{} Period starting {} at {}**"
+        log.debug(msg.format(self.period_ord, self.away_team, self.home_team))
+        await self.post_game_state(bot)
+        await self.save_game_state()
+
+    async def on_final(self, bot, event):
+        # Post game final data and check for next game
+        msg = "Game Final {} @ {}"
+        log.debug(msg.format(self.home_team, self.away_team))
+        await self.post_game_state(bot)
+        await self.save_game_state()
+
+    async def on_goal(self, bot, event):
+        """
+            Posts a new goal and saves where it was posted
+        """
+        goal = event.goal
+        msg_list = await goal.post_team_goal(bot, self)
+        team_data = await get_team(goal.team_name)
+        team_data["goal_id"][goal.goal_id] = {"goal": goal.to_json(), "messages": msg_list}
+        await save_team(team_data)
 
-            if (self.home_score + self.away_score) != 0:
-                # Check if there's goals only if there are goals
-                await self.check_team_goals(bot)
-
-        if self.game_state == "Final" and self.first_star is not None:
-            """Final game state checks"""
-            if (self.home_score + self.away_score) != 0:
-                """ Check for goal before posting game final, happens with OT games"""
-                await self.check_team_goals(bot)
-            if home["game_state"] != self.game_state and home["game_state"] != "Null":
-                # Post game final data and check for next game
-                msg = "Game Final {} @ {}"
-                log.debug(msg.format(self.home_team, self.away_team))
-                await self.post_game_state(bot)
-                await self.save_game_state()
+    async def on_goal_edited(self, bot, event):
+        """
+            Edits the original posts when the goal scorers have changed
+        """
+        goal = event.goal
+        team_data = await get_team(goal.team_name)
+        if goal.goal_id not in team_data["goal_id"]:
+            return
+        old_msgs = team_data["goal_id"][goal.goal_id]["messages"]
+        team_data["goal_id"][goal.goal_id]["goal"] = goal.to_json()
+        for channel_id in await goal.edit_team_goal(bot, self, old_msgs):
+            # Forget posts in deleted channels or that were deleted
+            old_msgs.pop(channel_id, None)
+        await save_team(team_data)
+
+    async def on_goal_disallowed(self, bot, event):
+        await Goal.remove_goal_post(bot, event.goal.goal_id, event.goal.team_name, self)
 
     async def post_game_state(self, bot):
         """
@@ -470,111 +521,55 @@ class Game:
         post_state = ["all", self.home_team, self.away_team]
         state_embed = await self.game_state_embed()
         state_text = await self.game_state_text()
-        for channels in await self.config.all_channels():
-            channel = bot.get_channel(id=channels)
-            if channel is None:
-                await self.config._clear_scope(Config.CHANNEL, str(channels))
-                log.info("{} channel was removed because it no longer exists".format(channels))
-                continue
+        for channel in await subscriptions.get_channels(bot, post_state):
             guild = channel.guild
-            should_post = await check_to_post(channel, post_state)
-            if should_post:
-                game_day_channels = await self.config.guild(guild).gdc()
-                can_embed = channel.permissions_for(guild.me).embed_links
-                can_manage_webhooks = False  # channel.permissions_for(guild.me).manage_webhooks
-
-                if self.game_state == "Live":
-                    home_role, away_role = await get_team_role(
-                        guild, self.home_team, self.away_team
-                    )
-                    if game_day_channels is not None:
-                        # We don't want to ping people in the game day channels twice
-                        if channel.id in game_day_channels:
-                            home_role, away_role = self.home_team, self.away_team
-                    msg = (
-                        "**"
-                        + str(self.period_ord)
-                        + _(" Period starting ")
-                        + away_role
-                        + _(" at ")
-                        + home_role
-                        + "**"
-                    )
-                    try:
-                        if not can_embed:
-                            await channel.send(msg + "\n{}".format(state_text))
-                        else:
-                            await channel.send(msg, embed=state_embed)
-                    except Exception as e:
-                        log.error(_("Could not post goal in ") + str(channels), exc_info=True)
+            is_gdc = await subscriptions.is_gdc(channel)
+            can_embed = channel.permissions_for(guild.me).embed_links
+            can_manage_webhooks = False  # channel.permissions_for(guild.me).manage_webhooks
 
-                else:
-                    if self.game_state == "Preview":
-                        if game_day_channels is not None:
-                            # Don't post the preview message twice in the channel
-                            if channel.id in game_day_channels:
-                                continue
-                    try:
-                        if not can_embed:
-                            preview_msg = await channel.send(state_text)
-                        else:
-                            preview_msg = await channel.send(embed=state_embed)
-
-                        # Create new pickems object for the game
-                        if self.game_state == "Preview":
-                            await Pickems.create_pickem_object(guild, preview_msg, channel, self)
-                            if channel.permissions_for(guild.me).add_reactions:
-                                try:
-                                    await preview_msg.add_reaction(self.away_emoji[2:-1])
-                                    await preview_msg.add_reaction(self.home_emoji[2:-1])
-                                except Exception as e:
-                                    log.debug("Could not add reactions")
-                    except Exception as e:
-                        log.error(_("Could not post goal in ") + str(channels), exc_info=True)
-
-    async def check_team_goals(self, bot):
-        """
-            Checks to see if a goal needs to be posted
-        """
-        home_team_data = await get_team(self.home_team)
-        away_team_data = await get_team(self.away_team)
-        all_data = await get_team("all")
-        team_list = await self.config.teams()
-        post_state = ["all", self.home_team, self.away_team]
+            if self.game_state == "Live":
+                home_role, away_role = await get_team_role(guild, self.home_team, self.away_team)
+                if is_gdc:
+                    # We don't want to ping people in the game day channels twice
+                    home_role, away_role = self.home_team, self.away_team
+                msg = (
+                    "**"
+                    + str(self.period_ord)
+                    + _(" Period starting ")
+                    + away_role
+                    + _(" at ")
+                    + home_role
+                    + "**"
+                )
+                try:
+                    if not can_embed:
+                        await channel.send(msg + "\n{}".format(state_text))
+                    else:
+                        await channel.send(msg, embed=state_embed)
+                except Exception as e:
+                    log.error(_("Could not post goal in ") + str(channel.id), exc_info=True)
 
-        home_goal_ids = [goal.goal_id for goal in self.home_goals]
-        away_goal_ids = [goal.goal_id for goal in self.away_goals]
-
-        home_goal_list = list(home_team_data["goal_id"])
-        away_goal_list = list(away_team_data["goal_id"])
-
-        for goal in self.goals:
-            # goal_id = str(goal["result"]["eventCode"])
-            # team = goal["team"]["name"]
-            team_data = await get_team(goal.team_name)
-            if goal.goal_id not in team_data["goal_id"]:
-                # attempts to post the goal if there is a new goal
-                msg_list = await goal.post_team_goal(bot, self)
-                team_list.remove(team_data)
-                team_data["goal_id"][goal.goal_id] = {"goal": goal.to_json(), "messages": msg_list}
-                team_list.append(team_data)
-                await self.config.teams.set(team_list)
-                continue
-            if goal.goal_id in team_data["goal_id"]:
-                # attempts to edit the goal if the scorers have changed
-                old_goal = Goal(**team_data["goal_id"][goal.goal_id]["goal"])
-                if goal.description != old_goal.description:
-                    old_msgs = team_data["goal_id"][goal.goal_id]["messages"]
-                    team_list.remove(team_data)
-                    team_data["goal_id"][goal.goal_id]["goal"] = goal.to_json()
-                    team_list.append(team_data)
-                    await self.config.teams.set(team_list)
-                    await goal.edit_team_goal(bot, self, old_msgs)
-        # attempts to delete the goal if it was called back
-        for goal_str in home_goal_list:
-            await Goal.remove_goal_post(bot, goal_str, self.home_team, self)
-        for goal_str in away_goal_list:
-            await Goal.remove_goal_post(bot, goal_str, self.away_team, self)
+            else:
+                if self.game_state == "Preview" and is_gdc:
+                    # Don't post the preview message twice in the channel
+                    continue
+                try:
+                    if not can_embed:
+                        preview_msg = await channel.send(state_text)
+                    else:
+                        preview_msg = await channel.send(embed=state_embed)
+
+                    # Create new pickems object for the game
+                    if self.game_state == "Preview":
+                        await Pickems.create_pickem_object(guild, preview_msg, channel, self)
+                        if channel.permissions_for(guild.me).add_reactions:
+                            try:
+                                await preview_msg.add_reaction(self.away_emoji[2:-1])
+                                await preview_msg.add_reaction(self.home_emoji[2:-1])
+                            except Exception as e:
+                                log.debug("Could not add reactions")
+                except Exception as e:
+                    log.error(_("Could not post goal in ") + str(channel.id), exc_info=True)
 
     async def save_game_state(self, time_to_game_start: str = "0"):
         """
@@ -582,9 +577,6 @@ class Game:
         """
         home = await get_team(self.home_team)
         away = await get_team(self.away_team)
-        team_list = await self.config.teams()
-        team_list.remove(home)
-        team_list.remove(away)
         if self.game_state != "Final":
             if self.game_state == "Preview" and time_to_game_start != "0":
                 home["game_state"] = self.game_state + time_to_game_start
@@ -597,73 +589,64 @@ class Game:
             home["game_start"] = self.game_start.strftime("%Y-%m-%dT%H:%M:%SZ")
             away["game_start"] = self.game_start.strftime("%Y-%m-%dT%H:%M:%SZ")
         else:
-            home["game_state"] = "Null"
-            away["game_state"] = "Null"
-            home["period"] = 0
-            away["period"] = 0
-            home["goal_id"] = {}
-            away["goal_id"] = {}
-            home["game_start"] = ""
-            away["game_start"] = ""
-        team_list.append(home)
-        team_list.append(away)
-        await self.config.teams.set(team_list)
+            team_store.compact(home)
+            team_store.compact(away)
+        await save_team(home)
+        await save_team(away)
 
     async def post_time_to_game_start(self, bot, time_left):
         """
             Post when there is 60, 30, and 10 minutes until the game starts in all channels
         """
         post_state = ["all", self.home_team, self.away_team]
-        for channels in await self.config.all_channels():
-            channel = bot.get_channel(id=channels)
-            if channel is None:
-                await self.config._clear_scope(Config.CHANNEL, str(channels))
-                log.info("{} channel was removed because it no longer exists".format(channels))
+        for channel in await subscriptions.get_channels(bot, post_state):
+            if "all" in await subscriptions.teams(channel.id):
                 continue
-
-            should_post = await check_to_post(channel, post_state)
-            team_to_post = await self.config.channel(channel).team()
-            if should_post and "all" not in team_to_post:
-                guild = channel.guild
-                msg = (
-                    str(time_left)
-                    + _(" minutes until ")
-                    + f"{self.away_emoji} {self.away_team}"
-                    + f" @ {self.home_emoji} {self.home_team}"
-                    + _(" starts")
-                )
-                try:
-                    await channel.send(msg)
-                except Exception as e:
-                    log.error(_("Could not post goal in ") + str(channels), exc_info=True)
+            guild = channel.guild
+            msg = (
+                str(time_left)
+                + _(" minutes until ")
+                + f"{self.away_emoji} {self.away_team}"
+                + f" @ {self.home_emoji} {self.home_team}"
+                + _(" starts")
+            )
+            try:
+                await channel.send(msg)
+            except Exception as e:
+                log.error(_("Could not post goal in ") + str(channel.id), exc_info=True)
 
     @staticmethod
     async def from_url(url: str):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(BASE_URL + url) as resp:
-                    data = await resp.json()
+            data = await api.get(url)
             return await Game.from_json(data)
         except Exception as e:
             log.error(_("Error grabbing game data: "), exc_info=True)
             return
 
     @classmethod
-    async def from_json(cls, data: dict):
+    async def from_json(cls, data: dict, known_goals: dict = None):
+        """
+            `known_goals` are goals from the last poll of this game,
+            unchanged goals are reused instead of parsed again
+        """
+        known_goals = {} if known_goals is None else known_goals
         event = data["liveData"]["plays"]["allPlays"]
         home_team = data["gameData"]["teams"]["home"]["name"]
         away_team = data["gameData"]["teams"]["away"]["name"]
-        players = data["liveData"]["boxscore"]["teams"]["away"]["players"]
+        players = dict(data["liveData"]["boxscore"]["teams"]["away"]["players"])
         players.update(data["liveData"]["boxscore"]["teams"]["home"]["players"])
-        goals = [
-            await Goal.from_json(goal, players)
-            for goal in event
-            if goal["result"]["eventTypeId"] == "GOAL"
-            or (
+        goals = []
+        for goal in event:
+            if goal["result"]["eventTypeId"] == "GOAL" or (
                 goal["result"]["eventTypeId"] in ["SHOT", "MISSED_SHOT"]
                 and goal["about"]["ordinalNum"] == "SO"
-            )
-        ]
+            ):
+                known = known_goals.get(goal["result"]["eventCode"])
+                if known is not None and known.description == goal["result"]["description"]:
+                    goals.append(known)
+                else:
+                    goals.append(await Goal.from_json(goal, players))
 
         if "currentPeriodOrdinal" in data["liveData"]["linescore"]:
             period_ord = data["liveData"]["linescore"]["currentPeriodOrdinal"]
@@ -677,6 +660,11 @@ class Game:
         first_star = decisions["firstStar"]["fullName"] if "firstStar" in decisions else None
         second_star = decisions["secondStar"]["fullName"] if "secondStar" in decisions else None
         third_star = decisions["thirdStar"]["fullName"] if "thirdStar" in decisions else None
+        intermission = data["liveData"]["linescore"].get("intermissionInfo", {})
+        if intermission.get("inIntermission", False):
+            intermission_time_left = intermission.get("intermissionTimeRemaining", 0)
+        else:
+            intermission_time_left = 0
 
         return cls(
             data["gameData"]["status"]["abstractGameState"],
@@ -699,4 +687,13 @@ class Game:
             first_star,
             second_star,
             third_star,
+            intermission_time_left,
+            data["gamePk"],
         )
+
+
+game_feed.subscribe(PERIOD_START, Game.on_period_start)
+game_feed.subscribe(GOAL, Game.on_goal)
+game_feed.subscribe(GOAL_EDITED, Game.on_goal_edited)
+game_feed.subscribe(GOAL_DISALLOWED, Game.on_goal_disallowed)
+game_feed.subscribe(FINAL, Game.on_final)
@@ -1,13 +1,83 @@
-from datetime import datetime
+import asyncio
+from datetime import datetime, date
 from redbot.core import Config
 from .game import Game
 from .constants import BASE_URL, CONFIG_ID, TEAMS
 from .pickems import Pickems
 from .helper import *
+from .subscriptions import subscriptions
 import logging
 
 log = logging.getLogger("red.Hockey")
 
+MAX_CONCURRENT_GUILDS = 10
+
+
+class ScheduleIndex:
+    """
+        The schedule from today on resolved to each teams next game
+
+        Fetched once per day and shared by every guild so creating
+        game day channels doesn't repeat the same requests per guild
+    """
+
+    def __init__(self):
+        self.day = None
+        self._next = {}
+        self._today = None
+        self._games = {}
+        self._lock = asyncio.Lock()
+
+    async def refresh(self):
+        schedule = await Game.get_games_list(None, datetime.now())
+        self._next = {}
+        if schedule:
+            # Guilds following all teams create the next game on the schedule
+            self._next["all"] = schedule[0]["link"]
+        for game in schedule:
+            for side in ["home", "away"]:
+                self._next.setdefault(game["teams"][side]["team"]["name"], game["link"])
+        self._today = None
+        self._games = {}
+        self.day = date.today()
+
+    async def load(self):
+        if self.day == date.today():
+            return
+        async with self._lock:
+            if self.day != date.today():
+                await self.refresh()
+
+    async def today(self) -> list:
+        """
+            Todays games as game objects
+        """
+        await self.load()
+        if self._today is None:
+            self._today = asyncio.ensure_future(Game.get_games())
+        return await asyncio.shield(self._today)
+
+    async def next_game(self, team: str):
+        """
+            The next game object for `team` or None if they have no games left
+        """
+        await self.load()
+        link = self._next.get(team)
+        if link is None:
+            return None
+        if link not in self._games:
+            self._games[link] = asyncio.ensure_future(Game.from_url(link))
+        return await asyncio.shield(self._games[link])
+
+    def clear(self):
+        self.day = None
+        self._next = {}
+        self._today = None
+        self._games = {}
+
+
+schedule_index = ScheduleIndex()
+
 
 class GameDayChannels:
     """
@@ -32,44 +102,56 @@ class GameDayChannels:
     @staticmethod
     async def check_new_gdc(bot):
         config = Config.get_conf(None, CONFIG_ID, cog_name="Hockey")
-        game_list = await Game.get_games()  # Do this once so we don't spam the api
-        for guilds in await config.all_guilds():
-            guild = bot.get_guild(guilds)
-            if guild is None:
-                continue
-            if not await config.guild(guild).create_channels():
-                continue
-            team = await config.guild(guild).gdc_team()
-            if team != "all":
-                next_games = await Game.get_games_list(team, datetime.now())
-                if next_games != []:
-                    next_game = await Game.from_url(next_games[0]["link"])
-                if next_game is None:
-                    continue
-                chn_name = await GameDayChannels.get_chn_name(next_game)
+        await schedule_index.refresh()
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_GUILDS)
+        guilds = [bot.get_guild(guild_id) for guild_id in await config.all_guilds()]
+
+        async def _check(guild):
+            async with semaphore:
                 try:
-                    cur_channels = await config.guild(guild).gdc()
-                    cur_channel = bot.get_channel(cur_channels[0])
+                    await GameDayChannels.check_guild_gdc(bot, guild)
                 except Exception as e:
-                    log.error("Error checking new GDC", exc_info=True)
-                    cur_channel = None
-                if cur_channel is None:
-                    await GameDayChannels.create_gdc(bot, guild)
-                elif cur_channel.name != chn_name.lower():
-                    await GameDayChannels.delete_gdc(bot, guild)
-                    await GameDayChannels.create_gdc(bot, guild)
-
-            else:
+                    log.error("Error checking new GDC in {}".format(guild.id), exc_info=True)
+
+        await asyncio.gather(*[_check(guild) for guild in guilds if guild is not None])
+
+    @staticmethod
+    async def check_guild_gdc(bot, guild):
+        """
+            Replaces a guilds game day channels if they're out of date
+        """
+        config = Config.get_conf(None, CONFIG_ID, cog_name="Hockey")
+        if not await config.guild(guild).create_channels():
+            return
+        team = await config.guild(guild).gdc_team()
+        if team != "all":
+            next_game = await schedule_index.next_game(team)
+            if next_game is None:
+                return
+            chn_name = await GameDayChannels.get_chn_name(next_game)
+            try:
+                cur_channels = await config.guild(guild).gdc()
+                cur_channel = bot.get_channel(cur_channels[0])
+            except Exception as e:
+                log.error("Error checking new GDC", exc_info=True)
+                cur_channel = None
+            if cur_channel is None:
+                await GameDayChannels.create_gdc(bot, guild)
+            elif cur_channel.name != chn_name.lower():
                 await GameDayChannels.delete_gdc(bot, guild)
-                for game in game_list:
-                    await GameDayChannels.create_gdc(bot, guild, game)
+                await GameDayChannels.create_gdc(bot, guild)
+
+        else:
+            await GameDayChannels.delete_gdc(bot, guild)
+            for game in await schedule_index.today():
+                await GameDayChannels.create_gdc(bot, guild, game)
 
     @staticmethod
     async def create_gdc(bot, guild, game_data=None):
         """
             Creates a game day channel for the given game object
             if no game object is passed it looks for the set team for the guild
-            returns None if not setup
+            returns the new channel or None if nothing was created
         """
         config = Config.get_conf(None, CONFIG_ID, cog_name="Hockey")
         category = bot.get_channel(await config.guild(guild).category())
@@ -78,13 +160,8 @@ class GameDayChannels:
             return
         if game_data is None:
             team = await config.guild(guild).gdc_team()
-
-            next_games = await Game.get_games_list(team, datetime.now())
-            if next_games != []:
-                next_game = await Game.from_url(next_games[0]["link"])
-                if next_game is None:
-                    return
-            else:
+            next_game = await schedule_index.next_game(team)
+            if next_game is None:
                 # Return if no more games are playing for this team
                 return
         else:
@@ -104,6 +181,8 @@ class GameDayChannels:
         await config.guild(guild).gdc.set(cur_channels)
         await config.guild(guild).create_channels.set(True)
         await config.channel(new_chn).team.set([team])
+        subscriptions.set_gdc(guild.id, cur_channels)
+        subscriptions.set_channel(new_chn.id, [team])
         delete_gdc = await config.guild(guild).delete_gdc()
         await config.channel(new_chn).to_delete.set(delete_gdc)
 
@@ -143,6 +222,7 @@ class GameDayChannels:
                 await preview_msg.add_reaction(next_game.home_emoji[2:-1])
             except Exception as e:
                 log.debug("cannot add reactions")
+        return new_chn
 
     @staticmethod
     async def delete_gdc(bot, guild):
@@ -164,7 +244,9 @@ class GameDayChannels:
                 continue
             try:
                 await config.channel(chn).clear()
+                subscriptions.remove_channel(chn.id)
                 await chn.delete()
             except Exception as e:
                 log.error("Cannot delete GDC channels")
         await config.guild(guild).gdc.set([])
+        subscriptions.set_gdc(guild.id, [])
@@ -0,0 +1,188 @@
+import logging
+from collections import namedtuple
+
+from .goal import Goal
+from .health import loop_health
+from .helper import get_team
+
+log = logging.getLogger("red.Hockey")
+
+PERIOD_START = "period_start"
+GOAL = "goal"
+GOAL_EDITED = "goal_edited"
+GOAL_DISALLOWED = "goal_disallowed"
+FINAL = "final"
+STARS = "stars"
+
+GameEvent = namedtuple("GameEvent", ["kind", "goal"])
+
+MAX_RETRIES = 5
+
+
+class Snapshot:
+    """
+        The parts of a game we compare between polls
+    """
+
+    __slots__ = ("game_state", "period", "goals", "stars")
+
+    def __init__(self, game_state: str, period: int, goals: dict, stars: tuple):
+        self.game_state = game_state
+        self.period = period
+        self.goals = goals
+        self.stars = stars
+
+    @classmethod
+    def from_game(cls, game):
+        return cls(
+            game.game_state,
+            game.period,
+            {goal.goal_id: goal for goal in game.goals},
+            (game.first_star, game.second_star, game.third_star),
+        )
+
+    @classmethod
+    async def from_saved(cls, game):
+        """
+            Builds the first snapshot for a game from the saved team data
+            so a restart doesn't post everything again
+        """
+        home = await get_team(game.home_team)
+        away = await get_team(game.away_team)
+        goals = {}
+        for team in [home, away]:
+            for goal_id, data in team["goal_id"].items():
+                goals[goal_id] = Goal(**data["goal"])
+        return cls(home["game_state"], home["period"], goals, (None, None, None))
+
+
+class GameFeed:
+    """
+        Keeps the last snapshot of every followed game and turns the
+        difference between polls into typed events for posting code
+
+        Events whose handlers fail are rolled back out of the snapshot
+        so the next poll emits them again, up to `MAX_RETRIES` polls
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._previous = {}
+        self._failures = {}
+        self._handlers = {}
+
+    def subscribe(self, kind: str, handler):
+        """
+            Registers `handler(game, bot, event)` to be awaited for every `kind` event
+        """
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def known_goals(self, game_id) -> dict:
+        """
+            Goals from the last snapshot so unchanged goals can be reused
+        """
+        snapshot = self._snapshots.get(game_id)
+        return snapshot.goals if snapshot is not None else {}
+
+    def forget(self, game_id):
+        self._snapshots.pop(game_id, None)
+        self._previous.pop(game_id, None)
+        self._failures.pop(game_id, None)
+
+    def clear(self):
+        self._snapshots = {}
+        self._previous = {}
+        self._failures = {}
+
+    def retrying(self, game_id) -> bool:
+        """
+            Whether the last poll had events that failed and will be emitted again
+        """
+        return 0 < self._failures.get(game_id, 0) < MAX_RETRIES
+
+    @staticmethod
+    def goal_events(old: Snapshot, game) -> list:
+        events = []
+        current = {goal.goal_id: goal for goal in game.goals}
+        for goal_id, goal in current.items():
+            if goal_id not in old.goals:
+                events.append(GameEvent(GOAL, goal))
+            elif goal.description != old.goals[goal_id].description:
+                events.append(GameEvent(GOAL_EDITED, goal))
+        for goal_id in old.goals.keys() - current.keys():
+            events.append(GameEvent(GOAL_DISALLOWED, old.goals[goal_id]))
+        return events
+
+    async def diff(self, game) -> list:
+        """
+            Returns the events between the last snapshot and `game`
+
+            `game` becomes the new snapshot once it is live, finals are
+            only compared once the three stars are available
+        """
+        old = self._snapshots.get(game.game_id)
+        if old is None:
+            old = await Snapshot.from_saved(game)
+        events = []
+        if game.game_state == "Live":
+            if old.period != game.period:
+                events.append(GameEvent(PERIOD_START, None))
+            events += self.goal_events(old, game)
+        elif game.game_state == "Final" and game.first_star is not None:
+            # Check for goals before posting game final, happens with OT games
+            events += self.goal_events(old, game)
+            if old.game_state not in ["Final", "Null"]:
+                events.append(GameEvent(FINAL, None))
+            if old.stars != (game.first_star, game.second_star, game.third_star):
+                events.append(GameEvent(STARS, None))
+        else:
+            return events
+        self._snapshots[game.game_id] = Snapshot.from_game(game)
+        self._previous[game.game_id] = old
+        for event in events:
+            if event.kind == GOAL:
+                loop_health.goal_detected(event.goal.goal_id)
+        return events
+
+    def rollback(self, game_id, events: list):
+        """
+            Restores the previous snapshot for `events` so they're emitted again
+        """
+        snapshot = self._snapshots.get(game_id)
+        old = self._previous.get(game_id)
+        if snapshot is None or old is None:
+            return
+        for event in events:
+            if event.kind == PERIOD_START:
+                snapshot.period = old.period
+            elif event.kind in [GOAL, GOAL_EDITED, GOAL_DISALLOWED]:
+                goal_id = event.goal.goal_id
+                if goal_id in old.goals:
+                    snapshot.goals[goal_id] = old.goals[goal_id]
+                else:
+                    snapshot.goals.pop(goal_id, None)
+            elif event.kind == FINAL:
+                snapshot.game_state = old.game_state
+            elif event.kind == STARS:
+                snapshot.stars = old.stars
+
+    async def dispatch(self, bot, game, events: list):
+        failed = []
+        for event in events:
+            for handler in self._handlers.get(event.kind, []):
+                try:
+                    await handler(game, bot, event)
+                except Exception as e:
+                    log.error("Error handling {} event".format(event.kind), exc_info=True)
+                    if event not in failed:
+                        failed.append(event)
+        if not failed:
+            self._failures.pop(game.game_id, None)
+        else:
+            self._failures[game.game_id] = self._failures.get(game.game_id, 0) + 1
+            if self._failures[game.game_id] < MAX_RETRIES:
+                self.rollback(game.game_id, failed)
+        self._previous.pop(game.game_id, None)
+
+
+game_feed = GameFeed()
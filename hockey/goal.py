@@ -2,6 +2,9 @@ from .constants import HEADSHOT_URL
 from datetime import datetime
 import discord
 from .helper import *
+from .dispatcher import dispatcher
+from .health import loop_health
+from .subscriptions import subscriptions
 from redbot.core.i18n import Translator
 from redbot.core import Config
 import logging
@@ -113,7 +116,6 @@ class Goal:
         """
         # scorer = self.headshots.format(goal["players"][0]["player"]["id"])
         post_state = ["all", game_data.home_team, game_data.away_team]
-        msg_list = {}
         if "Edmonton Oilers" in self.team_name and "missed" not in self.event.lower():
             try:
                 hue = Oilers(bot)
@@ -122,97 +124,72 @@ class Goal:
                 pass
         goal_embed = await self.goal_post_embed(game_data)
         goal_text = await self.goal_post_text(game_data)
-        for channels in await self.config.all_channels():
-            role = None
-            channel = bot.get_channel(id=channels)
-            if channel is None:
-                await self.config._clear_scope(Config.CHANNEL, str(channels))
-                log.info("{} channel was removed because it no longer exists".format(channels))
-                continue
-            should_post = await check_to_post(channel, post_state)
-            if should_post:
-                try:
-                    guild = channel.guild
-                    game_day_channels = await self.config.guild(guild).gdc()
-                    # Don't want to ping people in the game day channels
-                    can_embed = channel.permissions_for(guild.me).embed_links
-                    can_manage_webhooks = (
-                        False
-                    )  # channel.permissions_for(guild.me).manage_webhooks
+        channels = await subscriptions.get_channels(bot, post_state)
+        game_day_channels = set()
+        for channel in channels:
+            if await subscriptions.is_gdc(channel):
+                game_day_channels.add(channel.id)
+
+        async def _post(channel):
+            guild = channel.guild
+            can_embed = channel.permissions_for(guild.me).embed_links
+            can_manage_webhooks = False  # channel.permissions_for(guild.me).manage_webhooks
 
-                    for roles in guild.roles:
-                        if roles.name == self.team_name + " GOAL":
-                            role = roles
-                    if game_day_channels is not None:
-                        # We don't want to ping people in the game day channels twice
-                        if channel.id in game_day_channels:
-                            role = None
+            role = role_cache.goal_role(guild, self.team_name)
+            if channel.id in game_day_channels:
+                # We don't want to ping people in the game day channels twice
+                role = None
 
-                    if not can_embed and can_manage_webhooks:
-                        # try to create a webhook with the teams info to bypass embed permissions
-                        # Waiting for d.py to return messages from webhook responses
-                        # After testing it doesn't look as nice as I would like
-                        # Will leave it off until at some point I can make it look better
-                        webhook = None
-                        for hook in await channel.webhooks():
-                            if hook.name == guild.me.name:
-                                webhook = hook
-                        if webhook is None:
-                            webhook = await channel.create_webhook(name=guild.me.name)
-                        url = TEAMS[self.team_name]["logo"]
-                        await webhook.send(
-                            username=self.team_name, avatar_url=url, embed=goal_embed
-                        )
-                        continue
+            if not can_embed and can_manage_webhooks:
+                # try to create a webhook with the teams info to bypass embed permissions
+                # Waiting for d.py to return messages from webhook responses
+                # After testing it doesn't look as nice as I would like
+                # Will leave it off until at some point I can make it look better
+                webhook = None
+                for hook in await channel.webhooks():
+                    if hook.name == guild.me.name:
+                        webhook = hook
+                if webhook is None:
+                    webhook = await channel.create_webhook(name=guild.me.name)
+                url = TEAMS[self.team_name]["logo"]
+                await webhook.send(username=self.team_name, avatar_url=url, embed=goal_embed)
+                return
 
-                    if not can_embed and not can_manage_webhooks:
-                        # Create text only message if embed_links permission is not set
-                        if role is not None:
-                            msg = await channel.send("{}\n{}".format(role, goal_text))
-                        else:
-                            msg = await channel.send("{}".format(goal_text))
-                        msg_list[str(channel.id)] = msg.id
-                        continue
+            if not can_embed and not can_manage_webhooks:
+                # Create text only message if embed_links permission is not set
+                if role is not None:
+                    return await channel.send("{}\n{}".format(role, goal_text))
+                return await channel.send("{}".format(goal_text))
 
-                    if role is None or "missed" in self.event.lower():
-                        msg = await channel.send(embed=goal_embed)
-                        msg_list[str(channel.id)] = msg.id
-                    else:
-                        msg = await channel.send(role.mention, embed=goal_embed)
-                        msg_list[str(channel.id)] = msg.id
-                except Exception as e:
-                    log.error(_("Could not post goal in ") + str(channels), exc_info=True)
-                    pass
-        return msg_list
+            if role is None or "missed" in self.event.lower():
+                return await channel.send(embed=goal_embed)
+            return await channel.send(role.mention, embed=goal_embed)
+
+        async def _post_and_record(channel):
+            msg = await _post(channel)
+            if msg is not None:
+                loop_health.goal_posted(self.goal_id)
+            return msg
+
+        label = "Goal {} {}".format(self.team_name, self.goal_id)
+        return await dispatcher.send(label, channels, _post_and_record)
 
     @staticmethod
     async def remove_goal_post(bot, goal, team, data):
         """
             Attempt to delete a goal if it was pulled back
         """
-        config = hockey_config()
-        team_list = await config.teams()
         team_data = await get_team(team)
         if goal not in [goal.goal_id for goal in data.goals]:
             try:
-                old_msgs = team_data["goal_id"][goal]["messages"].items()
+                old_msgs = team_data["goal_id"][goal]["messages"]
             except Exception as e:
                 log.error("Error iterating saved goals", exc_info=True)
                 return
-            for channel_id, message_id in old_msgs:
-                channel = bot.get_channel(id=int(channel_id))
-                try:
-                    message = await channel.get_message(message_id)
-                    if message is not None:
-                        await message.delete()
-                except Exception as e:
-                    log.error(f"Cannot find message {str(team)} {str(goal)}", exc_info=True)
-                    pass
+            await dispatcher.delete(f"Removed goal {str(team)} {str(goal)}", bot, old_msgs)
             try:
-                team_list.remove(team_data)
                 del team_data["goal_id"][goal]
-                team_list.append(team_data)
-                await config.teams.set(team_list)
+                await save_team(team_data)
             except Exception as e:
                 log.error("Error removing team data", exc_info=True)
                 return
@@ -221,35 +198,35 @@ class Goal:
     async def edit_team_goal(self, bot, game_data, og_msg):
         """
             When a goal scorer has changed we want to edit the original post
+
+            Returns the channel ids whose post no longer exists
         """
         # scorer = self.headshots.format(goal["players"][0]["player"]["id"])
         post_state = ["all", game_data.home_team, game_data.away_team]
         em = await self.goal_post_embed(game_data)
+        embed = em.to_dict()
+        to_edit = {}
+        game_day_channels = set()
         for channel_id, message_id in og_msg.items():
-            try:
+            channel = bot.get_channel(id=int(channel_id))
+            if channel is not None and not channel.permissions_for(channel.guild.me).embed_links:
+                continue
+            to_edit[channel_id] = message_id
+            if channel is not None and await subscriptions.is_gdc(channel):
+                game_day_channels.add(channel.id)
+
+        def _edit(channel):
+            role = role_cache.goal_role(channel.guild, self.team_name)
+            if channel.id in game_day_channels:
+                # We don't want to ping people in the game day channels twice
                 role = None
-                channel = bot.get_channel(id=int(channel_id))
-                if channel is None:
-                    continue
-                if not channel.permissions_for(channel.guild.me).embed_links:
-                    continue
-                message = await channel.get_message(message_id)
-                guild = message.guild
-                game_day_channels = await self.config.guild(guild).gdc()
-                for roles in guild.roles:
-                    if roles.name == self.team_name + " GOAL":
-                        role = roles
-                if game_day_channels is not None:
-                    # We don't want to ping people in the game day channels twice
-                    if channel.id in game_day_channels:
-                        role = None
-                if role is None or "missed" in self.event.lower():
-                    await message.edit(embed=em)
-                else:
-                    await message.edit(content=role.mention, embed=em)
-            except:
-                log.error(_("Could not edit goal in") + str(channel_id))
-        return
+            if role is None or "missed" in self.event.lower():
+                return {"embed": embed}
+            return {"content": role.mention, "embed": embed}
+
+        label = "Edited goal {} {}".format(self.team_name, self.goal_id)
+        results = await dispatcher.edit(label, bot, to_edit, _edit)
+        return [channel_id for channel_id, done in results.items() if not done]
 
     async def get_shootout_display(self, game_goals):
         """
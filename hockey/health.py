@@ -0,0 +1,117 @@
+import time
+from collections import OrderedDict, deque
+
+from .hockeyapi import api
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+class LoopHealth:
+    """
+        Rolling timings for the game check loop and posting pipeline
+
+        Only the last `window` polls, fan-outs and goals are kept
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.started = time.monotonic()
+        self.cycles = deque(maxlen=window)
+        self.fanouts = deque(maxlen=window)
+        self.goals = OrderedDict()
+        self.failures = 0
+        self._requests = deque(maxlen=window)
+
+    def record_cycle(self, fetch: float, parse: float, post: float, events: int, failed: bool):
+        """
+            Records one poll of one game
+        """
+        now = time.monotonic()
+        self.cycles.append((now, fetch, parse, post, events, failed))
+        self._requests.append((now, api.requests))
+        if failed:
+            self.failures += 1
+
+    def record_fanout(self, label: str, timings: list):
+        self.fanouts.append((label, len(timings), percentile(timings, 0.5), max(timings)))
+
+    def goal_detected(self, goal_id: str):
+        self.goals[goal_id] = [time.monotonic(), None, None, 0]
+        while len(self.goals) > self.window:
+            self.goals.popitem(last=False)
+
+    def goal_posted(self, goal_id: str):
+        goal = self.goals.get(goal_id)
+        if goal is None:
+            return
+        now = time.monotonic()
+        if goal[1] is None:
+            goal[1] = now
+        goal[2] = now
+        goal[3] += 1
+
+    def request_rate(self) -> float:
+        """
+            Upstream requests per minute over the window
+        """
+        if len(self._requests) < 2:
+            return 0.0
+        (start, first), (end, last) = self._requests[0], self._requests[-1]
+        if end == start:
+            return 0.0
+        return (last - first) / (end - start) * 60
+
+    def summary(self) -> str:
+        cycles = list(self.cycles)
+        lines = [
+            "Uptime: {:.0f}m".format((time.monotonic() - self.started) / 60),
+            "Polls: {} ({} failed, {} failed since load)".format(
+                len(cycles), len([c for c in cycles if c[5]]), self.failures
+            ),
+        ]
+        for name, index in [("Fetch", 1), ("Parse", 2), ("Post", 3)]:
+            values = [c[index] for c in cycles]
+            lines.append(
+                "{}: p50 {:.3f}s p99 {:.3f}s".format(
+                    name, percentile(values, 0.5), percentile(values, 0.99)
+                )
+            )
+        lines.append("Events: {}".format(sum(c[4] for c in cycles)))
+        fanouts = list(self.fanouts)
+        if fanouts:
+            lines.append(
+                "Fan-out: {} sends to {} channels, p50 {:.2f}s max {:.2f}s".format(
+                    len(fanouts),
+                    sum(f[1] for f in fanouts),
+                    percentile([f[2] for f in fanouts], 0.5),
+                    max(f[3] for f in fanouts),
+                )
+            )
+        posted = [g for g in self.goals.values() if g[1] is not None]
+        if posted:
+            first = [g[1] - g[0] for g in posted]
+            last = [g[2] - g[0] for g in posted]
+            lines.append(
+                "Goal to first post: p50 {:.2f}s p99 {:.2f}s over {} goals".format(
+                    percentile(first, 0.5), percentile(first, 0.99), len(posted)
+                )
+            )
+            lines.append(
+                "Goal to last post: p50 {:.2f}s p99 {:.2f}s".format(
+                    percentile(last, 0.5), percentile(last, 0.99)
+                )
+            )
+        lines.append(
+            "Stats api: {:.1f} requests/min, {} requests, {} not modified, {} cache hits".format(
+                self.request_rate(), api.requests, api.not_modified, api.hits
+            )
+        )
+        return "\n".join(lines)
+
+
+loop_health = LoopHealth()
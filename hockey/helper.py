@@ -27,6 +27,145 @@ def hockey_config():
     return Config.get_conf(None, CONFIG_ID, cog_name="Hockey")
 
 
+_config_locks = {}
+
+
+def config_lock(*key):
+    """
+        Returns a shared lock for read-modify-write access to config
+        values that may be updated by more than one game at a time
+    """
+    if key not in _config_locks:
+        _config_locks[key] = asyncio.Lock()
+    return _config_locks[key]
+
+
+class TeamStore:
+    """
+        In-memory copy of the saved teams keyed by team name
+
+        Games update team state here and `flush` writes it back to
+        config at most once per poll instead of on every change.
+    """
+
+    def __init__(self):
+        self._teams = None
+        self._dirty = False
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> dict:
+        if self._teams is None:
+            async with self._lock:
+                if self._teams is None:
+                    team_list = await hockey_config().teams()
+                    self._teams = {team["team_name"]: team for team in team_list}
+        return self._teams
+
+    async def get(self, team: str) -> dict:
+        teams = await self.load()
+        if team not in teams:
+            # Add unknown teams to the config to track stats
+            teams[team] = TeamEntry("Null", team, 0, [], {}, [], "").to_json()
+            self._dirty = True
+        return teams[team]
+
+    async def save(self, team_data: dict):
+        teams = await self.load()
+        teams[team_data["team_name"]] = team_data
+        self._dirty = True
+
+    async def reset(self, team_names: list = None):
+        """
+            Clears saved game data for the given teams or every team
+        """
+        teams = await self.load()
+        for name, team in teams.items():
+            if team_names is not None and name not in team_names:
+                continue
+            self.compact(team)
+        self._dirty = True
+
+    @staticmethod
+    def compact(team_data: dict):
+        """
+            Drops a finished games state and goal message ids
+        """
+        team_data["goal_id"] = {}
+        team_data["game_state"] = "Null"
+        team_data["game_start"] = ""
+        team_data["period"] = 0
+
+    async def flush(self):
+        async with self._lock:
+            if not self._dirty or self._teams is None:
+                return
+            # Cleared first so changes made during the write are kept for the next flush
+            self._dirty = False
+            try:
+                await hockey_config().teams.set(list(self._teams.values()))
+            except Exception:
+                self._dirty = True
+                raise
+
+    def clear(self):
+        self._teams = None
+        self._dirty = False
+
+
+team_store = TeamStore()
+
+
+class RoleCache:
+    """
+        Per guild map of team roles and team goal roles
+
+        Built with a single pass over the guilds roles the first time
+        it's needed and invalidated by the role listeners
+    """
+
+    def __init__(self):
+        self._guilds = {}
+
+    def _build(self, guild) -> tuple:
+        team_roles = {}
+        goal_roles = {}
+        for role in guild.roles:
+            if role.name.endswith(" GOAL"):
+                goal_roles[role.name[:-5]] = role
+            elif "Montreal Canadiens" in role.name:
+                team_roles["Montréal Canadiens"] = role
+            elif role.name in TEAMS:
+                team_roles[role.name] = role
+        return team_roles, goal_roles
+
+    def get(self, guild) -> tuple:
+        if guild.id not in self._guilds:
+            self._guilds[guild.id] = self._build(guild)
+        return self._guilds[guild.id]
+
+    def team_role(self, guild, team: str):
+        return self.get(guild)[0].get(team)
+
+    def goal_role(self, guild, team: str):
+        return self.get(guild)[1].get(team)
+
+    def invalidate(self, guild_id: int):
+        self._guilds.pop(guild_id, None)
+
+    def clear(self):
+        self._guilds = {}
+
+
+role_cache = RoleCache()
+
+
+async def save_team(team_data: dict):
+    """
+        Replaces a single teams data in the saved teams
+    """
+    await team_store.save(team_data)
+
+
 def utc_to_local(utc_dt, new_timezone="US/Eastern"):
     eastern = pytz.timezone(new_timezone)
     return utc_dt.replace(tzinfo=timezone.utc).astimezone(tz=eastern)
@@ -141,39 +280,15 @@ async def check_to_post(channel, post_state):
 
 
 async def get_team_role(guild, home_team, away_team):
-    home_role = None
-    away_role = None
-
-    for role in guild.roles:
-        if "Montréal Canadiens" in home_team and "Montreal Canadiens" in role.name:
-            home_role = role.mention
-        elif role.name == home_team:
-            home_role = role.mention
-        if "Montréal Canadiens" in away_team and "Montreal Canadiens" in role.name:
-            away_role = role.mention
-        elif role.name == away_team:
-            away_role = role.mention
-    if home_role is None:
-        home_role = home_team
-    if away_role is None:
-        away_role = away_team
+    home_role = role_cache.team_role(guild, home_team)
+    away_role = role_cache.team_role(guild, away_team)
+    home_role = home_role.mention if home_role is not None else home_team
+    away_role = away_role.mention if away_role is not None else away_team
     return home_role, away_role
 
 
 async def get_team(team):
-    config = Config.get_conf(None, CONFIG_ID, cog_name="Hockey")
-    return_team = None
-    team_list = await config.teams()
-    for teams in team_list:
-        if team == teams["team_name"]:
-            return_team = team
-            return teams
-    if return_team is None:
-        # Add unknown teams to the config to track stats
-        return_team = TeamEntry("Null", team, 0, [], {}, [], "")
-        team_list.append(return_team.to_json())
-        await config.teams.set(team_list)
-        return await get_team(team)
+    return await team_store.get(team)
 
 
 async def check_valid_team(team_name, standings=False):
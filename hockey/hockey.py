@@ -1,14 +1,15 @@
 import discord
-import aiohttp
 import asyncio
 import json
 import yaml
 import logging
+import time
 from datetime import datetime, timedelta
 from io import BytesIO
 from urllib.parse import quote
 from redbot.core import commands, checks, Config
 from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.chat_formatting import box
 from redbot.core.i18n import Translator, cog_i18n
 from .teamentry import TeamEntry
 from .menu import hockey_menu
@@ -16,9 +17,14 @@ from .embeds import *
 from .helper import *
 from .errors import *
 from .game import Game
-from .pickems import Pickems
-from .standings import Standings
-from .gamedaychannels import GameDayChannels
+from .gamefeed import game_feed
+from .health import loop_health
+from .hockeyapi import api
+from .pickems import Pickems, pickems_store, leaderboards
+from .players import player_index
+from .standings import Standings, standings_cache
+from .gamedaychannels import GameDayChannels, schedule_index
+from .subscriptions import subscriptions
 from .constants import *
 
 try:
@@ -36,6 +42,8 @@ log = logging.getLogger("red.Hockey")
 __version__ = "2.3.2"
 __author__ = "TrustyJAID"
 
+MAX_CONCURRENT_FETCHES = 5
+
 
 @cog_i18n(_)
 class Hockey(getattr(commands, "Cog", object)):
@@ -45,7 +53,6 @@ class Hockey(getattr(commands, "Cog", object)):
 
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession(loop=self.bot.loop)
         default_global = {"teams": [], "created_gdc": False, "print": False}
         for team in TEAMS:
             team_entry = TeamEntry("Null", team, 0, [], {}, [], "")
@@ -72,6 +79,8 @@ class Hockey(getattr(commands, "Cog", object)):
         self.config.register_global(**default_global, force_registration=True)
         self.config.register_guild(**default_guild)
         self.config.register_channel(**default_channel)
+        self.fetch_semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+        self.new_day_lock = asyncio.Lock()
         self.loop = bot.loop.create_task(self.game_check_loop())
         self.TEST_LOOP = False  # used to test a continuous loop of a single game data
 
@@ -86,14 +95,17 @@ class Hockey(getattr(commands, "Cog", object)):
         await self.bot.wait_until_ready()
         while self is self.bot.get_cog("Hockey"):
             # await self.refactor_data()
-            async with self.session.get(BASE_URL + "/api/v1/schedule") as resp:
-                data = await resp.json()
+            player_index.start_refresh()
+            data = await api.get("/api/v1/schedule")
             if data["dates"] != []:
                 games = [
                     game["link"]
                     for game in data["dates"][0]["games"]
                     if game["status"]["abstractGameState"] != "Final"
                 ]
+                if games == []:
+                    # Every game today is final so set up for the next slate
+                    await self.check_new_day()
             else:
                 games = []
                 # Only try to create game day channels if there's no games for the day
@@ -103,69 +115,131 @@ class Hockey(getattr(commands, "Cog", object)):
             games_playing = False
             if self.TEST_LOOP:
                 games = [1]
-            while games != []:
-                to_remove = []
-                games_playing = True
-                for link in games:
-                    if not self.TEST_LOOP:
-                        try:
-                            async with self.session.get(BASE_URL + link) as resp:
-                                data = await resp.json()
-                        except Exception as e:
-                            log.error(_("Error grabbing game data: "), exc_info=True)
-                            continue
-                    else:
-                        games_playing = False
-                        with open(str(__file__)[:-9] + "testgame.json", "r") as infile:
-                            data = json.loads(infile.read())
-                    game = await Game.from_json(data)
-                    try:
-                        await self.check_new_day()
-                        await game.check_game_state(self.bot)
-                    except Exception as e:
-                        log.error("Error checking game state: ", exc_info=True)
-
-                    log.debug(
-                        (
-                            f"{game.away_team} @ {game.home_team} "
-                            f"{game.game_state} {game.away_score} - {game.home_score}"
-                        )
-                    )
-
-                    if game.game_state == "Final" and game.first_star is not None:
-                        try:
-                            await Pickems.set_guild_pickem_winner(self.bot, game)
-                        except Exception as e:
-                            log.error(_("Pickems Set Winner error: "), exc_info=True)
-                        to_remove.append(link)
-
-                for link in to_remove:
-                    games.remove(link)
-                await asyncio.sleep(60)
+            if games != []:
+                games_playing = not self.TEST_LOOP
+                # Each game is followed in its own task so that one slow game
+                # doesn't delay posts for the rest of the slate
+                await asyncio.gather(*[self.game_worker(link) for link in games])
             log.debug(_("Games Done Playing"))
             try:
                 await Pickems.tally_leaderboard(self.bot)
             except Exception as e:
                 log.error(_("Error tallying leaderboard:"), exc_info=True)
                 pass
+            wait = None
             if games_playing:
                 await self.config.created_gdc.set(False)
+                # Check again shortly so the next days game day channels
+                # and standings are posted once this slate ends
+                wait = POLL_SLATE_MIN
 
             # Final cleanup of config incase something went wrong
             # Should be mostly unnecessary at this point
-            all_teams = await self.config.teams()
-            for team in await self.config.teams():
-                all_teams.remove(team)
-                team["goal_id"] = {}
-                team["game_state"] = "Null"
-                team["game_start"] = ""
-                team["period"] = 0
-                all_teams.append(team)
-
-            await self.config.teams.set(all_teams)
-            await asyncio.sleep(300)
+            await team_store.reset()
+            await team_store.flush()
+            if wait is None:
+                wait = await self.time_until_next_slate()
+            await asyncio.sleep(wait)
+
+    async def time_until_next_slate(self):
+        """
+            Seconds to sleep before the schedule should be checked again
+
+            Wakes an hour before the next scheduled game so the
+            preview posts are picked up by that games worker
+        """
+        now = datetime.utcnow()
+        try:
+            end_date = datetime.now() + timedelta(days=7)
+            games = await Game.get_games_list(None, datetime.now(), end_date)
+        except Exception as e:
+            log.error(_("Error grabbing the schedule: "), exc_info=True)
+            return POLL_SLATE_MIN
+        starts = [
+            datetime.strptime(game["gameDate"], "%Y-%m-%dT%H:%M:%SZ")
+            for game in games
+            if game["status"]["abstractGameState"] != "Final"
+        ]
+        starts = [start for start in starts if start > now]
+        if starts == []:
+            return POLL_SLATE_MAX
+        wait = (min(starts) - now).total_seconds() - 3600
+        return max(POLL_SLATE_MIN, min(wait, POLL_SLATE_MAX))
+
+    async def get_game_data(self, link):
+        """
+            Fetch a games live feed, at most `MAX_CONCURRENT_FETCHES` at once
+        """
+        if self.TEST_LOOP:
+            with open(str(__file__)[:-9] + "testgame.json", "r") as infile:
+                return json.loads(infile.read())
+        async with self.fetch_semaphore:
+            try:
+                return await api.get(link)
+            except Exception as e:
+                log.error(_("Error grabbing game data: "), exc_info=True)
+                return None
+
+    async def game_worker(self, link):
+        """
+            Follows a single game until it is final
+            state changes for a game are always processed in order
+        """
+        while self is self.bot.get_cog("Hockey"):
+            start = time.monotonic()
+            data = await self.get_game_data(link)
+            fetched = time.monotonic()
+            if data is None:
+                loop_health.record_cycle(fetched - start, 0, 0, 0, True)
+                await asyncio.sleep(60)
+                continue
+            try:
+                game = await Game.from_json(data, game_feed.known_goals(data.get("gamePk")))
+            except Exception as e:
+                log.error(_("Error grabbing game data: "), exc_info=True)
+                loop_health.record_cycle(fetched - start, time.monotonic() - fetched, 0, 0, True)
+                await asyncio.sleep(60)
+                continue
+            parsed = time.monotonic()
+            events = []
+            failed = False
+            try:
+                await self.check_new_day()
+                events = await game.check_game_state(self.bot)
+            except Exception as e:
+                failed = True
+                log.error("Error checking game state: ", exc_info=True)
+            try:
+                await team_store.flush()
+            except Exception as e:
+                failed = True
+                log.error("Error saving team data: ", exc_info=True)
+            loop_health.record_cycle(
+                fetched - start, parsed - fetched, time.monotonic() - parsed, len(events), failed
+            )
+
+            log.debug(
+                (
+                    f"{game.away_team} @ {game.home_team} "
+                    f"{game.game_state} {game.away_score} - {game.home_score}"
+                )
+            )
+
+            final = game.game_state == "Final" and game.first_star is not None
+            if final and not game_feed.retrying(game.game_id):
+                try:
+                    await Pickems.set_guild_pickem_winner(self.bot, game)
+                except Exception as e:
+                    log.error(_("Pickems Set Winner error: "), exc_info=True)
+                game_feed.forget(game.game_id)
+                return
+            await asyncio.sleep(game.next_poll())
 
     async def check_new_day(self):
+        async with self.new_day_lock:
+            await self._check_new_day()
+
+    async def _check_new_day(self):
         if not await self.config.created_gdc():
             if datetime.now().weekday() == 6:
                 try:
@@ -183,59 +257,58 @@ class Hockey(getattr(commands, "Cog", object)):
             await self.config.created_gdc.set(True)
 
     async def on_raw_reaction_add(self, payload):
+        pickem = await pickems_store.get_by_message(payload.message_id)
+        if pickem is None:
+            return
         channel = self.bot.get_channel(id=payload.channel_id)
         try:
             guild = channel.guild
         except:
             return
-        pickems_list = await self.config.guild(guild).pickems()
-
-        if pickems_list is None:
-            return
-        pickems = [Pickems.from_json(p) for p in pickems_list]
-        if len(pickems) == 0:
-            return
-        try:
-            msg = await channel.get_message(id=payload.message_id)
-        except:
-            return
         user = guild.get_member(payload.user_id)
         # log.debug(payload.user_id)
-        if user.bot:
+        if user is None or user.bot:
             return
-        is_pickems_vote = False
-        for pickem in pickems:
-            if msg.id in pickem.message:
-                is_pickems_vote = True
-                reply_message = ""
-                try:
-                    # log.debug(payload.emoji)
-                    pickem.add_vote(user.id, payload.emoji)
-                except UserHasVotedError as team:
-                    if msg.channel.permissions_for(msg.guild.me).manage_messages:
-                        emoji = (
-                            pickem.home_emoji
-                            if str(payload.emoji.id) in pickem.away_emoji
-                            else pickem.away_emoji
-                        )
-                        await msg.remove_reaction(emoji, user)
-                    reply_message = _("You have already voted! Changing vote to) ") + str(team)
-                except VotingHasEndedError as error_msg:
-                    if msg.channel.permissions_for(msg.guild.me).manage_messages:
-                        await msg.remove_reaction(payload.emoji, user)
-                    reply_message = _("Voting has ended!") + str(error_msg)
-                except NotAValidTeamError:
-                    if msg.channel.permissions_for(msg.guild.me).manage_messages:
-                        await msg.remove_reaction(payload.emoji, user)
-                    reply_message = _("Don't clutter the voting message with emojis!")
-                if reply_message != "":
-                    try:
-                        await user.send(reply_message)
-                    except:
-                        pass
-        if is_pickems_vote:
-            pickems_list = [p.to_json() for p in pickems]
-            await self.config.guild(guild).pickems.set(pickems_list)
+        can_manage = channel.permissions_for(guild.me).manage_messages
+        reply_message = ""
+        remove_emoji = None
+        try:
+            # log.debug(payload.emoji)
+            pickem.add_vote(user.id, payload.emoji)
+        except UserHasVotedError as team:
+            remove_emoji = (
+                pickem.home_emoji
+                if str(payload.emoji.id) in pickem.away_emoji
+                else pickem.away_emoji
+            )
+            reply_message = _("You have already voted! Changing vote to) ") + str(team)
+        except VotingHasEndedError as error_msg:
+            remove_emoji = payload.emoji
+            reply_message = _("Voting has ended!") + str(error_msg)
+        except NotAValidTeamError:
+            remove_emoji = payload.emoji
+            reply_message = _("Don't clutter the voting message with emojis!")
+        if remove_emoji is not None and can_manage:
+            try:
+                msg = await channel.get_message(id=payload.message_id)
+                await msg.remove_reaction(remove_emoji, user)
+            except:
+                pass
+        if reply_message != "":
+            try:
+                await user.send(reply_message)
+            except:
+                pass
+        pickems_store.save(guild.id)
+
+    async def on_guild_role_create(self, role):
+        role_cache.invalidate(role.guild.id)
+
+    async def on_guild_role_update(self, before, after):
+        role_cache.invalidate(after.guild.id)
+
+    async def on_guild_role_delete(self, role):
+        role_cache.invalidate(role.guild.id)
 
     async def change_custom_emojis(self, attachments):
         """
@@ -243,7 +316,7 @@ class Hockey(getattr(commands, "Cog", object)):
              with values in a properly formatted .yaml file
         """
         try:
-            async with self.session.get(attachments[0].url) as infile:
+            async with api.session.get(attachments[0].url) as infile:
                 data = yaml.safe_load(await infile.read())
         except yaml.error.YAMLError as exc:
             raise InvalidFileError("Error Parsing the YAML") from exc
@@ -443,8 +516,12 @@ class Hockey(getattr(commands, "Cog", object)):
             Creates the next gdc for the server
         """
 
-        if await self.config.guild(ctx.guild).create_channels():
-            await GameDayChannels.create_gdc(self.bot, ctx.guild)
+        if not await self.config.guild(ctx.guild).create_channels():
+            await ctx.send(_("Game day channels are not enabled on this server."))
+            return
+        if await GameDayChannels.create_gdc(self.bot, ctx.guild) is None:
+            await ctx.send(_("No game day channel was created, there may be no games left."))
+            return
         await ctx.send(_("Game day channels created."))
 
     @gdc.command(name="toggle")
@@ -565,6 +642,7 @@ class Hockey(getattr(commands, "Cog", object)):
             del leaderboard[str(user.id)]
             leaderboard[str(user.id)] = {"season": season, "weekly": weekly, "total": total}
         await self.config.guild(ctx.guild).leaderboard.set(leaderboard)
+        leaderboards.invalidate(ctx.guild.id)
         msg = (
             user.display_name
             + _(" now has ")
@@ -606,11 +684,7 @@ class Hockey(getattr(commands, "Cog", object)):
             )
             return
 
-        standings, page = await Standings.get_team_standings(standings_type.lower())
-        if standings_type.lower() != "all":
-            em = await Standings.build_standing_embed(standings, page)
-        else:
-            em = await Standings.all_standing_embed(standings, page)
+        em = await standings_cache.embed(standings_type)
         await self.config.guild(guild).standings_type.set(standings_type)
         await self.config.guild(guild).standings_channel.set(channel.id)
         await ctx.send(_("Sending standings to") + channel.mention)
@@ -656,10 +730,11 @@ class Hockey(getattr(commands, "Cog", object)):
         cur_teams = await self.config.channel(channel).team()
         cur_teams = [] if cur_teams is None else cur_teams
         if team in cur_teams:
-            await self.config.channel(channel).team.set([team])
+            cur_teams = [team]
         else:
             cur_teams.append(team)
-            await self.config.channel(channel).team.set(cur_teams)
+        await self.config.channel(channel).team.set(cur_teams)
+        subscriptions.set_channel(channel.id, cur_teams)
         await ctx.send(team + _(" goals will be posted in ") + channel.mention)
 
     @hockeyset_commands.command(name="del", aliases=["remove", "rem"])
@@ -678,12 +753,14 @@ class Hockey(getattr(commands, "Cog", object)):
             return
         if team is None:
             await self.config.channel(channel).clear()
+            subscriptions.remove_channel(channel.id)
             await ctx.send(_("All goal updates will not be posted in ") + channel.mention)
             return
         if team is not None:
             guild = ctx.message.guild
             if team in cur_teams:
                 cur_teams.remove(team)
+                subscriptions.set_channel(channel.id, cur_teams)
                 if cur_teams == []:
                     await self.config.channel(channel).clear()
                     await ctx.send(_("All goal updates will not be posted in ") + channel.mention)
@@ -818,30 +895,13 @@ class Hockey(getattr(commands, "Cog", object)):
         """
             Search for a player or get a team roster
         """
-        rosters = {}
         players = []
         teams = [team for team in TEAMS if search.lower() in team.lower()]
         if teams != []:
             for team in teams:
-                url = f"{BASE_URL}/api/v1/teams/{TEAMS[team]['id']}/roster"
-                async with self.session.get(url) as resp:
-                    data = await resp.json()
-                for player in data["roster"]:
-                    players.append(player)
+                players += await player_index.get_team(team)
         else:
-            for team in TEAMS:
-                url = f"{BASE_URL}/api/v1/teams/{TEAMS[team]['id']}/roster"
-                async with self.session.get(url) as resp:
-                    data = await resp.json()
-                try:
-                    rosters[team] = data["roster"]
-                except KeyError:
-                    pass
-
-            for team in rosters:
-                for player in rosters[team]:
-                    if search.lower() in player["person"]["fullName"].lower():
-                        players.append(player)
+            players = await player_index.search(search)
 
         if players != []:
             await hockey_menu(ctx, "roster", players)
@@ -904,24 +964,16 @@ class Hockey(getattr(commands, "Cog", object)):
         """
             Posts the leaderboard based on specific style
         """
-        leaderboard = await self.config.guild(ctx.guild).leaderboard()
-        if leaderboard == {} or leaderboard is None:
+        leaderboard = await leaderboards.get(ctx.guild, leaderboard_type)
+        if leaderboard == []:
             await ctx.send(_("There is no current leaderboard for this server!"))
             return
-        if leaderboard_type != "worst":
-            leaderboard = sorted(
-                leaderboard.items(), key=lambda i: i[1][leaderboard_type], reverse=True
-            )
-        else:
-            leaderboard = sorted(
-                leaderboard.items(), key=lambda i: i[1]["total"] - i[1]["season"], reverse=True
-            )
         msg_list = []
         count = 1
         user_position = None
         for member_id in leaderboard:
             if str(member_id[0]) == str(ctx.author.id):
-                user_position = leaderboard.index(member_id)
+                user_position = count - 1
             member = ctx.guild.get_member(int(member_id[0]))
             if member is None:
                 member_mention = _("User has left the server ") + member_id[0]
@@ -1034,7 +1086,7 @@ class Hockey(getattr(commands, "Cog", object)):
             )
             eastern_conference = "https://i.imgur.com/CtXvcCs.png"
             western_conference = "https://i.imgur.com/UFYJTDF.png"
-            async with self.session.get(eastern_conference) as resp:
+            async with api.session.get(eastern_conference) as resp:
                 data = await resp.read()
             logo = BytesIO()
             logo.write(data)
@@ -1043,7 +1095,7 @@ class Hockey(getattr(commands, "Cog", object)):
             await ctx.send(msg1, file=image)
             for division in team_list:
                 if division == "Central":
-                    async with self.session.get(western_conference) as resp:
+                    async with api.session.get(western_conference) as resp:
                         data = await resp.read()
                     logo = BytesIO()
                     logo.write(data)
@@ -1073,19 +1125,9 @@ class Hockey(getattr(commands, "Cog", object)):
         # log.debug(data)
         game = await Game.from_json(data)
         await game.check_game_state(self.bot)
-        if (game.home_score + game.away_score) != 0:
-            await game.check_team_goals(self.bot)
-        all_teams = await self.config.teams()
-        for team in await self.config.teams():
-            if team["team_name"] in [game.home_team, game.away_team]:
-                all_teams.remove(team)
-                team["goal_id"] = {}
-                team["game_state"] = "Null"
-                team["game_start"] = ""
-                team["period"] = 0
-                all_teams.append(team)
-
-        await self.config.teams.set(all_teams)
+        game_feed.forget(game.game_id)
+        await team_store.reset([game.home_team, game.away_team])
+        await team_store.flush()
         await ctx.send("Done testing.")
 
     @hockeyset_commands.command(hidden=True)
@@ -1139,7 +1181,7 @@ class Hockey(getattr(commands, "Cog", object)):
     async def cogstats(self, ctx):
         """
             Display current number of servers and channels
-            the cog is storing in console
+            the cog is storing and the game loops health
         """
         all_channels = await self.config.all_channels()
         all_guilds = await self.config.all_guilds()
@@ -1157,6 +1199,10 @@ class Hockey(getattr(commands, "Cog", object)):
             guild_list, len(all_channels), len(all_guilds)
         )
         log.debug(msg)
+        msg = "Channels: {}\nServers: {}\n{}".format(
+            len(all_channels), len(all_guilds), loop_health.summary()
+        )
+        await ctx.send(box(msg))
 
     #######################################################################
     # Owner Only Commands Mostly for Testing
@@ -1202,16 +1248,8 @@ class Hockey(getattr(commands, "Cog", object)):
         """
             Resets the bots game data incase something goes wrong
         """
-        all_teams = await self.config.teams()
-        for team in await self.config.teams():
-            all_teams.remove(team)
-            team["goal_id"] = {}
-            team["game_state"] = "Null"
-            team["game_start"] = ""
-            team["period"] = 0
-            all_teams.append(team)
-
-        await self.config.teams.set(all_teams)
+        await team_store.reset()
+        await team_store.flush()
         await ctx.send(_("Saved game data reset."))
 
     @gdc.command()
@@ -1236,11 +1274,13 @@ class Hockey(getattr(commands, "Cog", object)):
             channel = self.bot.get_channel(channels)
             if channel is None:
                 await self.config._clear_scope(Config.CHANNEL, str(channels))
+                subscriptions.remove_channel(channels)
                 log.info("Removed the following channels" + str(channels))
                 continue
             else:
                 good_channels.append(channel.id)
         await self.config.guild(guild).gdc.set(good_channels)
+        subscriptions.set_gdc(guild.id, good_channels)
 
     @hockeyset_commands.command()
     @checks.is_owner()
@@ -1252,6 +1292,7 @@ class Hockey(getattr(commands, "Cog", object)):
             channel = self.bot.get_channel(channels)
             if channel is None:
                 await self.config._clear_scope(Config.CHANNEL, str(channels))
+                subscriptions.remove_channel(int(channels))
                 log.info("Removed the following channels" + str(channels))
                 continue
             # if await self.config.channel(channel).to_delete():
@@ -1269,9 +1310,11 @@ class Hockey(getattr(commands, "Cog", object)):
             guild = self.bot.get_guild(guilds)
             if guild is None:
                 await self.config._clear_scope(Config.GUILD, str(guilds))
+                subscriptions.set_gdc(int(guilds), [])
             else:
                 if not await self.config.guild(guild).create_channels():
                     await self.config.guild(guild).gdc.set([])
+                    subscriptions.set_gdc(guild.id, [])
 
         await ctx.send(_("Saved servers the bot is no longer on have been removed."))
 
@@ -1289,6 +1332,7 @@ class Hockey(getattr(commands, "Cog", object)):
         for user in leaderboard:
             leaderboard[str(user)]["weekly"] = 0
         await self.config.guild(ctx.guild).leaderboard.set(leaderboard)
+        leaderboards.invalidate(ctx.guild.id)
 
     @hockey_commands.command(hidden=True)
     @checks.is_owner()
@@ -1322,7 +1366,7 @@ class Hockey(getattr(commands, "Cog", object)):
         """
             Clears the servers current pickems object list
         """
-        await self.config.guild(ctx.guild).pickems.set([])
+        await pickems_store.set(ctx.guild.id, [])
         await ctx.send(_("All pickems removed on this server."))
 
     @hockeyset_commands.command()
@@ -1332,11 +1376,18 @@ class Hockey(getattr(commands, "Cog", object)):
             Clears the servers pickems leaderboard
         """
         await self.config.guild(ctx.guild).leaderboard.set({})
+        leaderboards.invalidate(ctx.guild.id)
         await ctx.send(_("Server leaderboard reset."))
 
     def __unload(self):
-        self.bot.loop.create_task(self.session.close())
+        self.bot.loop.create_task(api.close())
         if getattr(self, "loop", None) is not None:
             self.loop.cancel()
+        subscriptions.clear()
+        game_feed.clear()
+        role_cache.clear()
+        schedule_index.clear()
+        self.bot.loop.create_task(pickems_store.flush())
+        self.bot.loop.create_task(team_store.flush())
 
     __del__ = __unload
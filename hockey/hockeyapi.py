@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from .constants import BASE_URL
+
+log = logging.getLogger("red.Hockey")
+
+
+class CachedResponse:
+    __slots__ = ("data", "etag", "last_modified", "fetched")
+
+    def __init__(self, data, etag: str, last_modified: str, fetched: float):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched
+
+
+class HockeyAPI:
+    """
+        Shared client for the NHL stats api
+
+        Responses are kept for `ttl` seconds and then revalidated with
+        ETag/If-Modified-Since. Concurrent requests for the same url share
+        a single upstream request. Returned data is shared between callers
+        and should not be modified. The cog uses `session` for its other
+        downloads so only one connection pool is kept open.
+    """
+
+    def __init__(self, ttl: float = 10.0, limit: int = 20, max_entries: int = 512):
+        self.ttl = ttl
+        self.limit = limit
+        self.max_entries = max_entries
+        self._session = None
+        self._cache = {}
+        self._pending = {}
+        self.requests = 0
+        self.not_modified = 0
+        self.hits = 0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._cache = {}
+
+    def _prune(self):
+        if len(self._cache) <= self.max_entries:
+            return
+        oldest = sorted(self._cache, key=lambda url: self._cache[url].fetched)
+        for url in oldest[: len(self._cache) - self.max_entries]:
+            del self._cache[url]
+
+    async def _fetch(self, url: str):
+        cached = self._cache.get(url)
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        self.requests += 1
+        async with self.session.get(url, headers=headers) as resp:
+            if resp.status == 304 and cached is not None:
+                self.not_modified += 1
+                cached.fetched = time.monotonic()
+                return cached.data
+            data = await resp.json()
+            if resp.status == 200:
+                self._cache[url] = CachedResponse(
+                    data,
+                    resp.headers.get("ETag"),
+                    resp.headers.get("Last-Modified"),
+                    time.monotonic(),
+                )
+                self._prune()
+        return data
+
+    async def get(self, url: str, ttl: float = None):
+        """
+            Returns the json at `url`, paths are relative to the stats api
+        """
+        if not url.startswith("http"):
+            url = BASE_URL + url
+        ttl = self.ttl if ttl is None else ttl
+        cached = self._cache.get(url)
+        if cached is not None and time.monotonic() - cached.fetched < ttl:
+            self.hits += 1
+            return cached.data
+        task = self._pending.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url))
+            self._pending[url] = task
+            task.add_done_callback(lambda t: self._pending.pop(url, None))
+        return await asyncio.shield(task)
+
+
+api = HockeyAPI()
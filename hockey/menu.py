@@ -38,6 +38,7 @@ async def hockey_menu(
             em = await roster_embed(post_list, page)
         if display_type == "game":
             em = await Game.get_game_embed(post_list, page)
+            Game.prefetch_games(post_list, page)
         if display_type == "season":
             leaderboard = {"type": "Seasonal", "lists": post_list}
             em = await make_leaderboard_embed(ctx.guild, leaderboard, page)
@@ -1,3 +1,6 @@
+import asyncio
+import discord
+from collections import OrderedDict
 from .errors import *
 from datetime import datetime
 from .constants import TEAMS
@@ -23,7 +26,7 @@ class Pickems:
         game_start: str,
         home_team: str,
         away_team: str,
-        votes: list,
+        votes: dict,
         winner: str = None,
     ):
         super().__init__()
@@ -51,28 +54,21 @@ class Pickems:
             team_choice = self.away_team
         if team_choice is None:
             raise NotAValidTeamError()
-        user_voted = False
-        for user, choice in self.votes:
-            if user_id == user:
-                user_voted = True
-                if time_now > self.game_start:
-                    if choice == self.home_team:
-                        emoji = self.home_emoji
-                    if choice == self.away_team:
-                        emoji = self.away_emoji
-                    raise VotingHasEndedError(_("You have voted for ") + f"<:{emoji}>")
-                if choice != team_choice:
-                    if (user, choice) in self.votes:
-                        self.votes.remove((user, choice))
-                    if (user, team_choice) in self.votes:
-                        # Redundancy so we don't end up with duplicate votes
-                        self.votes.remove((user, team_choice))
-                    self.votes.append((user_id, team_choice))
-                    raise UserHasVotedError("{} {}".format(team, team_choice))
-        if time_now > self.game_start and not user_voted:
+        choice = self.votes.get(str(user_id))
+        if choice is not None:
+            if time_now > self.game_start:
+                if choice == self.home_team:
+                    emoji = self.home_emoji
+                if choice == self.away_team:
+                    emoji = self.away_emoji
+                raise VotingHasEndedError(_("You have voted for ") + f"<:{emoji}>")
+            if choice != team_choice:
+                self.votes[str(user_id)] = team_choice
+                raise UserHasVotedError("{} {}".format(team, team_choice))
+            return
+        if time_now > self.game_start:
             raise VotingHasEndedError(_("You did not vote on this game!"))
-        if not user_voted and team_choice is not None:
-            self.votes.append((user_id, team_choice))
+        self.votes[str(user_id)] = team_choice
 
     async def set_pickem_winner(self, game):
         """
@@ -83,44 +79,78 @@ class Pickems:
         if game.away_score > game.home_score:
             self.winner = self.away_team
 
+    def is_game(self, game) -> bool:
+        # Only use the old one if the date is the same and the same teams are playing
+        return (
+            self.home_team == game.home_team
+            and self.away_team == game.away_team
+            and self.game_start == game.game_start
+        )
+
     @staticmethod
     async def find_pickems_object(bot, game):
         """
             Returns a list of all pickems on the bot for that game
         """
-        config = hockey_config()
         return_pickems = []
-        for guild_id in await config.all_guilds():
-            guild = bot.get_guild(int(guild_id))
-            if guild is None:
-                await config._clear_scope(Config.GUILD, str(guild_id))
-                continue
-            pickems = await config.guild(guild).pickems()
-            if pickems is None:
-                pickems = []
-            for p in pickems:
-                if p["home_team"] == game.home_team and p["away_team"] == game.away_team:
-                    if p["game_start"] == game.game_start.strftime("%Y-%m-%dT%H:%M:%SZ"):
-                        # Only use the old one if the date is the same and the same teams are playing
-                        return_pickems.append(Pickems.from_json(p))
+        for guild_id, pickems in (await pickems_store.load()).items():
+            for pickem in pickems:
+                if pickem.is_game(game):
+                    return_pickems.append(pickem)
         return return_pickems
 
     @staticmethod
     async def set_guild_pickem_winner(bot, game):
-        pickem_obj = await Pickems.find_pickems_object(bot, game)
+        """
+            Sets the winner on every pickem for the game and tallies
+            the votes into each guilds leaderboard straight away
+        """
+        finished = {}
+        for guild_id, pickems in (await pickems_store.load()).items():
+            for pickem in pickems:
+                if pickem.winner is None and pickem.is_game(game):
+                    await pickem.set_pickem_winner(game)
+                    if pickem.winner is not None:
+                        finished.setdefault(guild_id, []).append(pickem)
+        await asyncio.gather(
+            *[Pickems.apply_results(guild_id, done) for guild_id, done in finished.items()]
+        )
+
+    @staticmethod
+    def tally_votes(leaderboard: dict, pickems: list) -> dict:
+        """
+            Adds the results of finished pickems to a leaderboard
+        """
+        for pickem in pickems:
+            for user, choice in pickem.votes.items():
+                if str(user) not in leaderboard:
+                    leaderboard[str(user)] = {"season": 0, "weekly": 0, "total": 0}
+                if choice == pickem.winner:
+                    leaderboard[str(user)]["season"] += 1
+                    leaderboard[str(user)]["weekly"] += 1
+                if "total" not in leaderboard[str(user)]:
+                    leaderboard[str(user)]["total"] = 0
+                leaderboard[str(user)]["total"] += 1
+        return leaderboard
+
+    @staticmethod
+    async def apply_results(guild_id: int, finished: list):
+        """
+            Tallies finished pickems with one leaderboard write
+            and removes them from the guilds pickems
+        """
         config = hockey_config()
-        for pickem in pickem_obj:
-            for channel in pickem.channel:
-                chn = bot.get_channel(channel)
-                if chn is None:
-                    continue
-                if pickem.winner != None:
-                    continue
-                p_data = await config.guild(chn.guild).pickems()
-                p_data.remove(pickem.to_json())
-                await pickem.set_pickem_winner(game)
-                p_data.append(pickem.to_json())
-                await config.guild(chn.guild).pickems.set(p_data)
+        guild = discord.Object(id=guild_id)
+        async with config_lock("leaderboard", guild_id):
+            leaderboard = await config.guild(guild).leaderboard()
+            if leaderboard is None:
+                leaderboard = {}
+            Pickems.tally_votes(leaderboard, finished)
+            await config.guild(guild).leaderboard.set(leaderboard)
+        leaderboards.invalidate(guild_id)
+        pickems_store.close(finished)
+        pickems = await pickems_store.get(guild_id)
+        await pickems_store.set(guild_id, [p for p in pickems if p not in finished])
 
     @staticmethod
     async def create_pickem_object(guild, message, channel, game):
@@ -128,36 +158,28 @@ class Pickems:
             Checks to see if a pickem object is already created for the game
             if not it creates one or adds the message, channel to the current ones
         """
-        config = hockey_config()
-        pickems = await config.guild(guild).pickems()
-        if pickems is None:
-            pickems = []
+        pickems = await pickems_store.get(guild.id)
         old_pickem = None
         for p in pickems:
-            if p["home_team"] == game.home_team and p["away_team"] == game.away_team:
-                if p["game_start"] == game.game_start.strftime("%Y-%m-%dT%H:%M:%SZ"):
-                    # Only use the old one if the date is the same and the same teams are playing
-                    log.debug(_("Pickem already exists, adding channel"))
-                    old_pickem = p
+            if p.is_game(game):
+                log.debug(_("Pickem already exists, adding channel"))
+                old_pickem = p
 
         if old_pickem is None:
-            pickems.append(
-                {
-                    "message": [message.id],
-                    "channel": [channel.id],
-                    "game_start": game.game_start.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                    "home_team": game.home_team,
-                    "away_team": game.away_team,
-                    "votes": [],
-                    "winner": None,
-                }
+            old_pickem = Pickems(
+                [],
+                [],
+                game.game_start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                game.home_team,
+                game.away_team,
+                {},
+                None,
             )
-        else:
-            pickems.remove(old_pickem)
-            old_pickem["message"].append(message.id)
-            old_pickem["channel"].append(channel.id)
             pickems.append(old_pickem)
-        await config.guild(guild).pickems.set(pickems)
+        old_pickem.message.append(message.id)
+        old_pickem.channel.append(channel.id)
+        pickems_store.index(old_pickem)
+        await pickems_store.flush(guild.id)
 
     @staticmethod
     async def reset_weekly(bot):
@@ -173,44 +195,26 @@ class Pickems:
             for user in leaderboard:
                 leaderboard[str(user)]["weekly"] = 0
             await config.guild(guild).leaderboard.set(leaderboard)
+            leaderboards.invalidate(guild.id)
 
     @staticmethod
     async def tally_leaderboard(bot):
         """
             This should be where the pickems is removed and tallies are added
             to the leaderboard
+
+            Winners are normally tallied as each game ends, this catches
+            any pickems that were given a winner without being tallied
         """
-        config = hockey_config()
-        for guild_id in await config.all_guilds():
+        for guild_id, pickems in (await pickems_store.load()).items():
             guild = bot.get_guild(id=guild_id)
             if guild is None:
                 continue
+            finished = [p for p in pickems if p.winner is not None]
+            if finished == []:
+                continue
             try:
-                pickem_list_json = await config.guild(guild).pickems()
-                if pickem_list_json is None:
-                    continue
-                pickem_list = [Pickems.from_json(p) for p in pickem_list_json]
-                for pickems in pickem_list:
-                    if pickems.winner is not None:
-                        leaderboard = await config.guild(guild).leaderboard()
-                        if leaderboard is None:
-                            leaderboard = {}
-                        for user, choice in pickems.votes:
-                            if str(user) not in leaderboard:
-                                leaderboard[str(user)] = {"season": 0, "weekly": 0, "total": 0}
-                            if choice == pickems.winner:
-                                if str(user) not in leaderboard:
-                                    leaderboard[str(user)] = {"season": 1, "weekly": 1, "total": 0}
-                                else:
-                                    leaderboard[str(user)]["season"] += 1
-                                    leaderboard[str(user)]["weekly"] += 1
-                            if "total" not in leaderboard[str(user)]:
-                                leaderboard[str(user)]["total"] = 0
-                            leaderboard[str(user)]["total"] += 1
-                        await config.guild(guild).leaderboard.set(leaderboard)
-                await config.guild(guild).pickems.set(
-                    [p.to_json() for p in pickem_list if p.winner is None]
-                )
+                await Pickems.apply_results(guild_id, finished)
             except Exception as e:
                 log.error(_("Error tallying leaderboard in ") + f"{guild.name}", exc_info=True)
 
@@ -227,12 +231,161 @@ class Pickems:
 
     @classmethod
     def from_json(cls, data: dict):
+        votes = data["votes"]
+        if isinstance(votes, list):
+            # Votes used to be saved as a list of (user, team) pairs
+            votes = {str(user): choice for user, choice in votes}
         return cls(
             data["message"],
             data["channel"],
             data["game_start"],
             data["home_team"],
             data["away_team"],
-            data["votes"],
+            votes,
             data["winner"],
         )
+
+
+class PickemsStore:
+    """
+        In-memory pickems for every guild indexed by message id
+
+        Reactions are matched to a pickem without touching config and
+        vote changes are written back at most once every `delay` seconds.
+        The last `closed_size` messages of tallied pickems stay indexed so
+        late reactions are still told voting has ended.
+    """
+
+    def __init__(self, delay: float = 10.0, closed_size: int = 2000):
+        self.delay = delay
+        self.closed_size = closed_size
+        self._guilds = None
+        self._messages = {}
+        self._closed = OrderedDict()
+        self._pending = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> dict:
+        if self._guilds is None:
+            async with self._lock:
+                if self._guilds is None:
+                    guilds = {}
+                    for guild_id, data in (await hockey_config().all_guilds()).items():
+                        pickems = data.get("pickems") or []
+                        guilds[int(guild_id)] = [Pickems.from_json(p) for p in pickems]
+                    self._guilds = guilds
+                    self._messages = {}
+                    for pickems in guilds.values():
+                        for pickem in pickems:
+                            self.index(pickem)
+        return self._guilds
+
+    def index(self, pickem: Pickems):
+        for message_id in pickem.message:
+            self._messages[message_id] = pickem
+
+    async def get(self, guild_id: int) -> list:
+        guilds = await self.load()
+        if guild_id not in guilds:
+            guilds[guild_id] = []
+        return guilds[guild_id]
+
+    async def get_by_message(self, message_id: int):
+        await self.load()
+        if message_id in self._messages:
+            return self._messages[message_id]
+        return self._closed.get(message_id)
+
+    def close(self, pickems: list):
+        """
+            Keeps finished pickems answering reactions after they're removed
+        """
+        for pickem in pickems:
+            for message_id in pickem.message:
+                self._closed[message_id] = pickem
+                self._closed.move_to_end(message_id)
+        while len(self._closed) > self.closed_size:
+            self._closed.popitem(last=False)
+
+    async def set(self, guild_id: int, pickems: list):
+        old = await self.get(guild_id)
+        for pickem in old:
+            for message_id in pickem.message:
+                self._messages.pop(message_id, None)
+        self._guilds[guild_id] = pickems
+        for pickem in pickems:
+            self.index(pickem)
+        await self.flush(guild_id)
+
+    def save(self, guild_id: int):
+        """
+            Schedules a write of the guilds pickems after `delay` seconds
+        """
+        if guild_id not in self._pending:
+            self._pending[guild_id] = asyncio.ensure_future(self._save_later(guild_id))
+
+    async def _save_later(self, guild_id: int):
+        await asyncio.sleep(self.delay)
+        self._pending.pop(guild_id, None)
+        await self.flush(guild_id)
+
+    async def flush(self, guild_id: int = None):
+        """
+            Writes pending changes now for one or every guild
+        """
+        if guild_id is None:
+            for guild_id in list(self._pending):
+                await self.flush(guild_id)
+            return
+        task = self._pending.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+        if self._guilds is None or guild_id not in self._guilds:
+            return
+        async with config_lock("pickems", guild_id):
+            data = [p.to_json() for p in self._guilds[guild_id]]
+            await hockey_config().guild(discord.Object(id=guild_id)).pickems.set(data)
+
+    def clear(self):
+        for task in self._pending.values():
+            task.cancel()
+        self._pending = {}
+        self._guilds = None
+        self._messages = {}
+        self._closed = OrderedDict()
+
+
+pickems_store = PickemsStore()
+
+
+class Leaderboards:
+    """
+        Sorted pickems leaderboards per guild
+
+        Sorted once after each change to a guilds leaderboard
+        instead of every time it is posted
+    """
+
+    def __init__(self):
+        self._sorted = {}
+
+    def invalidate(self, guild_id: int):
+        self._sorted.pop(guild_id, None)
+
+    async def get(self, guild, leaderboard_type: str) -> list:
+        """
+            Returns `(user_id, data)` pairs sorted best first,
+            `worst` is sorted by incorrect votes
+        """
+        if guild.id not in self._sorted:
+            leaderboard = await hockey_config().guild(guild).leaderboard()
+            items = list((leaderboard or {}).items())
+            self._sorted[guild.id] = {
+                "season": sorted(items, key=lambda i: i[1]["season"], reverse=True),
+                "weekly": sorted(items, key=lambda i: i[1]["weekly"], reverse=True),
+                "worst": sorted(items, key=lambda i: i[1]["total"] - i[1]["season"], reverse=True),
+            }
+        return self._sorted[guild.id][leaderboard_type]
+
+
+leaderboards = Leaderboards()
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+import unicodedata
+
+from .constants import TEAMS
+from .hockeyapi import api
+
+log = logging.getLogger("red.Hockey")
+
+
+def normalize(name: str) -> str:
+    """
+        Lowercases a name and strips accents and punctuation
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = "".join(c if c.isalnum() else " " for c in name.lower())
+    return " ".join(name.split())
+
+
+def trigrams(name: str) -> set:
+    padded = "  {} ".format(name)
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class PlayerIndex:
+    """
+        Every teams roster kept in memory for player searches
+
+        Rosters are downloaded concurrently at most once every `ttl` seconds,
+        the cog loop refreshes them in the background once they expire.
+        Once loaded an out of date index keeps answering searches while
+        it's refreshed in the background.
+    """
+
+    def __init__(self, ttl: float = 86400.0, min_score: float = 0.3):
+        self.ttl = ttl
+        self.min_score = min_score
+        self.updated = None
+        self.players = []
+        self.names = []
+        self.teams = {}
+        self._trigrams = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def _get_roster(self, team: str) -> list:
+        try:
+            data = await api.get(f"/api/v1/teams/{TEAMS[team]['id']}/roster")
+            return data["roster"]
+        except Exception as e:
+            log.debug("Error grabbing the {} roster".format(team), exc_info=True)
+            return []
+
+    async def refresh(self):
+        rosters = await asyncio.gather(*[self._get_roster(team) for team in TEAMS])
+        players = []
+        teams = {}
+        for team, roster in zip(TEAMS, rosters):
+            teams[team] = roster
+            players += roster
+        if players == []:
+            return
+        names = [normalize(player["person"]["fullName"]) for player in players]
+        index = {}
+        for i, name in enumerate(names):
+            for gram in trigrams(name):
+                index.setdefault(gram, set()).add(i)
+        self.players = players
+        self.names = names
+        self.teams = teams
+        self._trigrams = index
+        self.updated = time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.updated is None or time.monotonic() - self.updated > self.ttl
+
+    async def _refresh(self):
+        async with self._lock:
+            if self.expired:
+                await self.refresh()
+
+    def start_refresh(self):
+        """
+            Starts refreshing the rosters in the background if they're out of date
+        """
+        if self.expired and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._refresh())
+        return self._task
+
+    async def load(self):
+        if not self.expired:
+            return
+        task = self.start_refresh()
+        if not self.players:
+            await asyncio.shield(task)
+
+    async def get_team(self, team: str) -> list:
+        await self.load()
+        return self.teams.get(team, [])
+
+    async def search(self, search: str, limit: int = 25) -> list:
+        """
+            Returns every player whose name contains `search` followed by
+            the closest misspelled matches up to `limit` players
+        """
+        await self.load()
+        query = normalize(search)
+        if not query:
+            return []
+        matches = [i for i, name in enumerate(self.names) if query in name]
+        matched = set(matches)
+        if len(matches) < limit:
+            grams = trigrams(query)
+            shared = {}
+            for gram in grams:
+                for i in self._trigrams.get(gram, []):
+                    shared[i] = shared.get(i, 0) + 1
+            scores = {}
+            for i, count in shared.items():
+                if i in matched:
+                    continue
+                score = count / len(grams | trigrams(self.names[i]))
+                if score >= self.min_score:
+                    scores[i] = score
+            fuzzy = sorted(scores, key=lambda i: scores[i], reverse=True)
+            matches += fuzzy[: limit - len(matches)]
+        return [self.players[i] for i in matches]
+
+
+player_index = PlayerIndex()
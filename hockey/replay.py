@@ -0,0 +1,548 @@
+"""
+    Recorded game feed replay for end to end benchmarking of the Hockey cog
+
+    Serves a time ordered sequence of game feeds from a local stand in
+    for the stats api and runs the real game check loop against stub
+    channels in N subscribed guilds, no discord connection is made.
+    By default the sequence is built from testgame.json: preview, each
+    period, every goal, an edited goal, a disallowed goal and the final.
+    Run from the repository root with:
+
+        python -m hockey.replay --guilds 200 --interval 1 --speed 60
+
+    or replay a directory of recorded feed json files in filename order
+    with `--feeds path/to/recording`
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from aiohttp import web
+from redbot.core import Config
+
+from . import game as game_module
+from . import hockey as hockey_module
+from . import hockeyapi
+from .gamefeed import FINAL, game_feed
+from .goal import Goal
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "testgame.json")
+
+
+class Counter:
+    def __init__(self):
+        self.config_writes = 0
+        self.rest_calls = 0
+
+
+class MemoryValue:
+    def __init__(self, config, data: dict, defaults: dict, key: str):
+        self._config = config
+        self._data = data
+        self._defaults = defaults
+        self._key = key
+
+    def __getattr__(self, key):
+        value = self._data.setdefault(self._key, {})
+        return MemoryValue(self._config, value, {}, key)
+
+    async def __call__(self, default=None):
+        if self._key in self._data:
+            return copy.deepcopy(self._data[self._key])
+        return copy.deepcopy(self._defaults.get(self._key, default))
+
+    async def set(self, value):
+        self._config.counter.config_writes += 1
+        self._data[self._key] = copy.deepcopy(value)
+
+    async def clear(self):
+        self._config.counter.config_writes += 1
+        self._data.pop(self._key, None)
+
+
+class MemoryGroup:
+    def __init__(self, config, data: dict, defaults: dict):
+        self._config = config
+        self._data = data
+        self._defaults = defaults
+
+    def __getattr__(self, key):
+        return MemoryValue(self._config, self._data, self._defaults, key)
+
+    async def clear(self):
+        self._config.counter.config_writes += 1
+        self._data.clear()
+
+
+class MemoryConfig:
+    """
+        Just enough of Config for the Hockey cog
+    """
+
+    def __init__(self, counter: Counter):
+        self.counter = counter
+        self._global = {}
+        self._global_defaults = {}
+        self._defaults = {"GUILD": {}, "CHANNEL": {}}
+        self._scopes = {"GUILD": {}, "CHANNEL": {}}
+
+    def register_global(self, force_registration=False, **defaults):
+        self._global_defaults.update(copy.deepcopy(defaults))
+
+    def register_guild(self, **defaults):
+        self._defaults["GUILD"].update(copy.deepcopy(defaults))
+
+    def register_channel(self, **defaults):
+        self._defaults["CHANNEL"].update(copy.deepcopy(defaults))
+
+    def __getattr__(self, key):
+        return MemoryValue(self, self._global, self._global_defaults, key)
+
+    def _group(self, scope: str, obj_id: int) -> MemoryGroup:
+        data = self._scopes[scope].setdefault(int(obj_id), {})
+        return MemoryGroup(self, data, self._defaults[scope])
+
+    def guild(self, guild):
+        return self._group("GUILD", guild.id)
+
+    def channel(self, channel):
+        return self._group("CHANNEL", channel.id)
+
+    async def _all(self, scope: str) -> dict:
+        result = {}
+        for obj_id, data in self._scopes[scope].items():
+            values = copy.deepcopy(self._defaults[scope])
+            values.update(copy.deepcopy(data))
+            result[obj_id] = values
+        return result
+
+    async def all_guilds(self):
+        return await self._all("GUILD")
+
+    async def all_channels(self):
+        return await self._all("CHANNEL")
+
+    async def _clear_scope(self, scope, obj_id):
+        self.counter.config_writes += 1
+        name = "GUILD" if scope == Config.GUILD else "CHANNEL"
+        self._scopes[name].pop(int(obj_id), None)
+
+
+class StubPermissions:
+    def __getattr__(self, key):
+        return True
+
+
+class StubMessage:
+    def __init__(self, channel, id, content=None, embed=None):
+        self.channel = channel
+        self.guild = channel.guild
+        self.id = id
+        self.content = content
+        self.embed = embed
+
+    async def add_reaction(self, emoji):
+        self.channel.rest()
+
+    async def remove_reaction(self, emoji, member):
+        self.channel.rest()
+
+    async def pin(self):
+        self.channel.rest()
+
+    async def edit(self, content=None, embed=None):
+        self.channel.rest()
+        self.content = content if content is not None else self.content
+        self.embed = embed if embed is not None else self.embed
+
+    async def delete(self):
+        self.channel.rest()
+        self.channel.messages.pop(self.id, None)
+
+
+class StubChannel:
+    def __init__(self, harness, guild, id):
+        self.harness = harness
+        self.guild = guild
+        self.id = id
+        self.name = "hockey-{}".format(id)
+        self.mention = "<#{}>".format(id)
+        self.messages = {}
+
+    def rest(self):
+        self.harness.counter.rest_calls += 1
+
+    def permissions_for(self, member):
+        return StubPermissions()
+
+    async def send(self, content=None, *, embed=None):
+        self.rest()
+        self.harness.record_send(embed)
+        message = StubMessage(self, self.harness.next_id(), content, embed)
+        self.messages[message.id] = message
+        return message
+
+    async def get_message(self, id):
+        self.rest()
+        return self.messages.get(id)
+
+    async def webhooks(self):
+        self.rest()
+        return []
+
+
+class StubGuild:
+    def __init__(self, id):
+        self.id = id
+        self.name = "guild{}".format(id)
+        self.me = SimpleNamespace(id=0, name="Hockey", display_name="Hockey")
+        self.roles = []
+
+    def get_member(self, member_id):
+        return None
+
+
+class StubHTTP:
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def edit_message(self, message_id, channel_id, **fields):
+        channel = self.bot.get_channel(channel_id)
+        channel.rest()
+        message = channel.messages[message_id]
+        message.content = fields.get("content", message.content)
+        message.embed = fields.get("embed", message.embed)
+
+    async def delete_message(self, channel_id, message_id, *, reason=None):
+        channel = self.bot.get_channel(channel_id)
+        channel.rest()
+        channel.messages.pop(message_id, None)
+
+
+class StubBot:
+    def __init__(self, loop):
+        self.loop = loop
+        self.http = StubHTTP(self)
+        self.cogs = {}
+        self.guilds = {}
+        self.channels = {}
+        self._ready = asyncio.Event()
+
+    async def wait_until_ready(self):
+        await self._ready.wait()
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    def get_guild(self, id):
+        return self.guilds.get(int(id))
+
+    def get_channel(self, id):
+        return self.channels.get(int(id))
+
+
+class ScaledAsyncio:
+    """
+        Stands in for the asyncio module inside the game check loop
+        so poll intervals run `speed` times faster than real time
+    """
+
+    def __init__(self, speed: float):
+        self.speed = speed
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+    async def sleep(self, delay, *args, **kwargs):
+        await asyncio.sleep(delay / self.speed, *args, **kwargs)
+
+
+def is_goal(play: dict) -> bool:
+    return play["result"]["eventTypeId"] == "GOAL" or (
+        play["result"]["eventTypeId"] in ["SHOT", "MISSED_SHOT"]
+        and play["about"]["ordinalNum"] == "SO"
+    )
+
+
+def make_frame(template: dict, state: str, period: int, plays: list, start: str) -> dict:
+    frame = copy.deepcopy(template)
+    frame["gameData"]["status"]["abstractGameState"] = state
+    frame["gameData"]["datetime"]["dateTime"] = start
+    frame["liveData"]["plays"]["allPlays"] = plays
+    linescore = frame["liveData"]["linescore"]
+    linescore["intermissionInfo"] = {"inIntermission": False, "intermissionTimeRemaining": 0}
+    if state == "Final":
+        return frame
+    frame["liveData"]["decisions"] = {}
+    linescore["currentPeriod"] = period
+    if state == "Preview":
+        linescore.pop("currentPeriodOrdinal", None)
+        linescore.pop("currentPeriodTimeRemaining", None)
+    else:
+        ordinal = [p["ordinalNum"] for p in linescore["periods"] if p["num"] == period]
+        linescore["currentPeriodOrdinal"] = ordinal[0] if ordinal else "SO"
+        linescore["currentPeriodTimeRemaining"] = "20:00"
+    score = plays[-1]["about"]["goals"] if plays else {"home": 0, "away": 0}
+    linescore["teams"]["home"]["goals"] = score["home"]
+    linescore["teams"]["away"]["goals"] = score["away"]
+    return frame
+
+
+def synthetic_feeds(template: dict) -> list:
+    """
+        Builds a game from preview to final out of a single finished game feed
+    """
+    start = (datetime.utcnow() - timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    plays = template["liveData"]["plays"]["allPlays"]
+    periods = sorted({p["about"]["period"] for p in plays if p["about"]["period"] > 0})
+    frames = [make_frame(template, "Preview", 0, [], start)]
+    edited = disallowed = False
+    for period in periods:
+        first = [i for i, p in enumerate(plays) if p["about"]["period"] == period][0]
+        frames.append(make_frame(template, "Live", period, plays[:first], start))
+        for i in range(first, len(plays)):
+            if plays[i]["about"]["period"] != period:
+                break
+            if not is_goal(plays[i]):
+                continue
+            frames.append(make_frame(template, "Live", period, plays[: i + 1], start))
+            if not edited:
+                # The scorer is changed after the goal is first posted
+                changed = copy.deepcopy(plays[i])
+                changed["result"]["description"] += " (scoring change)"
+                frames.append(make_frame(template, "Live", period, plays[:i] + [changed], start))
+                edited = True
+            elif not disallowed:
+                # A goal that is posted then called back on review
+                called_back = copy.deepcopy(plays[i])
+                called_back["result"]["eventCode"] += "R"
+                frame_plays = plays[: i + 1] + [called_back]
+                frames.append(make_frame(template, "Live", period, frame_plays, start))
+                frames.append(make_frame(template, "Live", period, plays[: i + 1], start))
+                disallowed = True
+    frames.append(make_frame(template, "Final", periods[-1], plays, start))
+    return frames
+
+
+def load_feeds(path: str) -> list:
+    files = sorted(f for f in os.listdir(path) if f.endswith(".json"))
+    feeds = []
+    for name in files:
+        with open(os.path.join(path, name), "r") as infile:
+            feeds.append(json.loads(infile.read()))
+    return feeds
+
+
+class ReplayHarness:
+    def __init__(self, feeds: list, guild_count: int, interval: float, speed: float):
+        self.feeds = feeds
+        self.guild_count = guild_count
+        self.interval = interval
+        self.speed = speed
+        self.counter = Counter()
+        self.frame = 0
+        self.http_requests = 0
+        self.not_modified = 0
+        self.published = {}
+        self.deliveries = {}
+        self.events = {}
+        self.events_at = {}
+        self._embeds = {}
+        self._last_id = 0
+        self.finished = asyncio.Event()
+
+    def next_id(self) -> int:
+        self._last_id += 1
+        return self._last_id
+
+    @property
+    def feed(self) -> dict:
+        return self.feeds[self.frame]
+
+    @property
+    def link(self) -> str:
+        return "/api/v1/game/{}/feed/live".format(self.feed["gamePk"])
+
+    def record_send(self, embed):
+        goal_id = self._embeds.get(id(embed))
+        if goal_id is not None and goal_id in self.published:
+            latency = time.monotonic() - self.published[goal_id]
+            self.deliveries.setdefault(goal_id, []).append(latency)
+
+    def publish(self, frame: int):
+        self.frame = frame
+        now = time.monotonic()
+        for play in self.feed["liveData"]["plays"]["allPlays"]:
+            if is_goal(play) and play["result"]["eventCode"] not in self.published:
+                self.published[play["result"]["eventCode"]] = now
+
+    # Stand in stats api
+
+    def _respond(self, request, data: dict, etag: str):
+        self.http_requests += 1
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.json_response(data, headers={"ETag": etag})
+
+    async def schedule(self, request):
+        feed = self.feed
+        game = {
+            "gamePk": feed["gamePk"],
+            "link": self.link,
+            "gameDate": feed["gameData"]["datetime"]["dateTime"],
+            "status": {"abstractGameState": feed["gameData"]["status"]["abstractGameState"]},
+        }
+        data = {"dates": [{"games": [game]}]}
+        return self._respond(request, data, '"schedule-{}"'.format(self.frame))
+
+    async def live_feed(self, request):
+        return self._respond(request, self.feed, '"feed-{}"'.format(self.frame))
+
+    async def standings(self, request):
+        return self._respond(request, {"records": []}, '"standings"')
+
+    async def start_server(self) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_get("/api/v1/schedule", self.schedule)
+        app.router.add_get("/api/v1/game/{game_id}/feed/live", self.live_feed)
+        app.router.add_get("/api/v1/standings", self.standings)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        for module in [hockeyapi, game_module]:
+            module.BASE_URL = "http://127.0.0.1:{}".format(port)
+        return runner
+
+    # Instrumentation
+
+    def instrument(self):
+        post_embed = Goal.goal_post_embed
+        dispatch = game_feed.dispatch
+
+        async def goal_post_embed(goal, game):
+            em = await post_embed(goal, game)
+            self._embeds[id(em)] = goal.goal_id
+            # Keep the embed alive so its id isn't reused
+            self._embeds.setdefault("embeds", []).append(em)
+            return em
+
+        async def dispatch_events(bot, game, events):
+            for event in events:
+                self.events[event.kind] = self.events.get(event.kind, 0) + 1
+            await dispatch(bot, game, events)
+            if game.game_state == "Final" and any(e.kind == FINAL for e in events):
+                self.finished.set()
+
+        Goal.goal_post_embed = goal_post_embed
+        game_feed.dispatch = dispatch_events
+
+    async def setup_guilds(self, bot, config: MemoryConfig):
+        home = self.feeds[-1]["gameData"]["teams"]["home"]["name"]
+        away = self.feeds[-1]["gameData"]["teams"]["away"]["name"]
+        for i in range(1, self.guild_count + 1):
+            guild = StubGuild(i)
+            channel = StubChannel(self, guild, i * 1000)
+            bot.guilds[guild.id] = guild
+            bot.channels[channel.id] = channel
+            teams = [["all"], [home], [away]][i % 3]
+            await config.channel(channel).team.set(teams)
+            await config.guild(guild).create_channels.set(False)
+
+    async def play(self):
+        for frame in range(len(self.feeds)):
+            self.publish(frame)
+            await asyncio.sleep(self.interval)
+
+    async def run(self, timeout: float):
+        loop = asyncio.get_event_loop()
+        config = MemoryConfig(self.counter)
+        Config.get_conf = lambda *args, **kwargs: config
+        hockey_module.asyncio = ScaledAsyncio(self.speed)
+        self.instrument()
+        runner = await self.start_server()
+        bot = StubBot(loop)
+        await self.setup_guilds(bot, config)
+        setup_writes = self.counter.config_writes
+
+        self.publish(0)
+        cog = hockey_module.Hockey(bot)
+        bot.cogs["Hockey"] = cog
+        start = time.monotonic()
+        bot._ready.set()
+        player = loop.create_task(self.play())
+        try:
+            await asyncio.wait_for(self.finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            print("Timed out before the game went final")
+        elapsed = time.monotonic() - start
+        await asyncio.sleep(0.5)
+        player.cancel()
+        cog._Hockey__unload()
+        await asyncio.sleep(0.1)
+        await runner.cleanup()
+        self.report(elapsed, self.counter.config_writes - setup_writes)
+
+    def report(self, elapsed: float, config_writes: int):
+        total_events = sum(self.events.values())
+        print(
+            "Replayed {} frames to {} guilds in {:.2f}s".format(
+                len(self.feeds), self.guild_count, elapsed
+            )
+        )
+        print("Events: " + ", ".join("{} {}".format(k, v) for k, v in sorted(self.events.items())))
+        latencies = sorted(t for values in self.deliveries.values() for t in values)
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            slowest = max(max(values) for values in self.deliveries.values())
+            print(
+                "Goal to post latency over {} posts: p50 {:.3f}s p99 {:.3f}s max {:.3f}s".format(
+                    len(latencies), p50, p99, slowest
+                )
+            )
+        per_event = max(total_events, 1)
+        print(
+            "Config writes: {} ({:.1f} per event)".format(config_writes, config_writes / per_event)
+        )
+        print(
+            "Discord REST calls: {} ({:.1f} per event)".format(
+                self.counter.rest_calls, self.counter.rest_calls / per_event
+            )
+        )
+        print(
+            "Stats api requests: {} ({} not modified)".format(
+                self.http_requests, self.not_modified
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between frames")
+    parser.add_argument("--speed", type=float, default=60.0, help="poll interval divisor")
+    parser.add_argument("--feeds", default=None, help="directory of recorded feed json")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    if args.feeds is not None:
+        feeds = load_feeds(args.feeds)
+    else:
+        with open(TEMPLATE, "r") as infile:
+            feeds = synthetic_feeds(json.loads(infile.read()))
+    harness = ReplayHarness(feeds, args.guilds, args.interval, args.speed)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(harness.run(args.timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
+import asyncio
+import hashlib
+import json
+import time
 from datetime import datetime
-import aiohttp
 import discord
 from .constants import BASE_URL, TEAMS
+from .dispatcher import dispatcher
 from .helper import hockey_config
+from .hockeyapi import api
 import logging
 
 log = logging.getLogger("red.Hockey")
@@ -77,63 +82,15 @@ class Standings:
             returns a list of standings objects and the location of the given
             style in the list
         """
-        async with aiohttp.ClientSession() as session:
-            async with session.get(BASE_URL + "/api/v1/standings") as resp:
-                data = await resp.json()
+        cache = await standings_cache.get()
         conference = ["eastern", "western", "conference"]
         division = ["metropolitan", "atlantic", "pacific", "central", "division"]
         if style.lower() in conference:
-            e = [
-                await Standings.from_json(
-                    team, record["division"]["name"], record["conference"]["name"]
-                )
-                for record in data["records"]
-                for team in record["teamRecords"]
-                if record["conference"]["name"] == "Eastern"
-            ]
-            w = [
-                await Standings.from_json(
-                    team, record["division"]["name"], record["conference"]["name"]
-                )
-                for record in data["records"]
-                for team in record["teamRecords"]
-                if record["conference"]["name"] == "Western"
-            ]
-
-            index = 0
-            for div in [e, w]:
-                if div[0].conference.lower() == style and style != "conference":
-                    index = [e, w].index(div)
-            return [e, w], index
+            return cache.conferences, cache.conference_index.get(style.lower(), 0)
         if style.lower() in division:
-            new_list = []
-            for record in data["records"]:
-                new_list.append(
-                    [
-                        await Standings.from_json(
-                            team, record["division"]["name"], record["conference"]["name"]
-                        )
-                        for team in record["teamRecords"]
-                    ]
-                )
-            index = 0
-            for div in new_list:
-                if div[0].division.lower() == style and style != "division":
-                    index = new_list.index(div)
-            return new_list, index
+            return cache.divisions, cache.division_index.get(style.lower(), 0)
         else:
-            all_teams = [
-                await Standings.from_json(
-                    team, record["division"]["name"], record["conference"]["name"]
-                )
-                for record in data["records"]
-                for team in record["teamRecords"]
-            ]
-            index = 0
-            for team in all_teams:
-                if team.name.lower() == style:
-                    index = all_teams.index(team)
-            return all_teams, index
+            return cache.all_teams, cache.team_index.get(style.lower(), 0)
 
     @staticmethod
     async def post_automatic_standings(bot):
@@ -143,35 +100,19 @@ class Standings:
         """
         log.debug("Updating Standings.")
         config = hockey_config()
-        all_guilds = await config.all_guilds()
-        for guilds in all_guilds:
-            guild = bot.get_guild(guilds)
-            if guild is None:
+        messages = {}
+        for guild_id, data in (await config.all_guilds()).items():
+            if not data["post_standings"] or bot.get_guild(guild_id) is None:
                 continue
-            log.debug(guild.name)
-            if await config.guild(guild).post_standings():
-
-                search = await config.guild(guild).standings_type()
-                if search is None:
-                    continue
-                standings_channel = await config.guild(guild).standings_channel()
-                if standings_channel is None:
-                    continue
-                channel = bot.get_channel(standings_channel)
-                if channel is None:
-                    continue
-                standings_msg = await config.guild(guild).standings_msg()
-                if standings_msg is None:
-                    continue
-                message = await channel.get_message(standings_msg)
-
-                standings, page = await Standings.get_team_standings(search)
-                if search != "all":
-                    em = await Standings.build_standing_embed(standings, page)
-                else:
-                    em = await Standings.all_standing_embed(standings, page)
-                if message is not None:
-                    await message.edit(embed=em)
+            search = data["standings_type"]
+            channel_id = data["standings_channel"]
+            message_id = data["standings_msg"]
+            if search is None or channel_id is None or message_id is None:
+                continue
+            messages.setdefault(search.lower(), {})[str(channel_id)] = message_id
+        await asyncio.gather(
+            *[standings_cache.update_messages(bot, s, msgs) for s, msgs in messages.items()]
+        )
 
     @classmethod
     async def from_json(cls, data: dict, division: str, conference: str):
@@ -315,3 +256,109 @@ class Standings:
             em.set_thumbnail(url=logo[conference])
             em.set_footer(text="Stats last Updated", icon_url=logo[conference])
             return em
+
+
+class StandingsCache:
+    """
+        Parsed standings shared by every command and guild
+
+        The standings are downloaded and grouped at most once every
+        `ttl` seconds and each standings type embed is built once per refresh.
+    """
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self.updated = 0.0
+        self.divisions = []
+        self.conferences = []
+        self.all_teams = []
+        self.division_index = {}
+        self.conference_index = {}
+        self.team_index = {}
+        self.teams = {}
+        self._embeds = {}
+        self._posted = {}
+        self._lock = asyncio.Lock()
+
+    async def refresh(self):
+        data = await api.get("/api/v1/standings")
+        divisions = []
+        for record in data["records"]:
+            divisions.append(
+                [
+                    await Standings.from_json(
+                        team, record["division"]["name"], record["conference"]["name"]
+                    )
+                    for team in record["teamRecords"]
+                ]
+            )
+        all_teams = [team for div in divisions for team in div]
+        conferences = [
+            [team for team in all_teams if team.conference == "Eastern"],
+            [team for team in all_teams if team.conference == "Western"],
+        ]
+        self.divisions = divisions
+        self.conferences = conferences
+        self.all_teams = all_teams
+        self.division_index = {div[0].division.lower(): i for i, div in enumerate(divisions)}
+        self.conference_index = {
+            conf[0].conference.lower(): i for i, conf in enumerate(conferences) if conf
+        }
+        self.team_index = {team.name.lower(): i for i, team in enumerate(all_teams)}
+        self.teams = {team.name: team for team in all_teams}
+        self._embeds = {}
+        self.updated = time.monotonic()
+
+    async def get(self):
+        if time.monotonic() - self.updated > self.ttl:
+            async with self._lock:
+                if time.monotonic() - self.updated > self.ttl:
+                    await self.refresh()
+        return self
+
+    async def get_team(self, team_name: str):
+        """
+            Returns a single teams standings or None
+        """
+        return (await self.get()).teams.get(team_name)
+
+    async def embed(self, search: str) -> discord.Embed:
+        """
+            Returns the standings embed for a standings type
+        """
+        search = search.lower()
+        await self.get()
+        if search not in self._embeds:
+            standings, page = await Standings.get_team_standings(search)
+            if search != "all":
+                em = await Standings.build_standing_embed(standings, page)
+            else:
+                em = await Standings.all_standing_embed(standings, page)
+            self._embeds[search] = em
+        return self._embeds[search]
+
+    @staticmethod
+    def digest(em: discord.Embed) -> str:
+        data = em.to_dict()
+        data.pop("timestamp", None)
+        return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def update_messages(self, bot, search: str, messages: dict):
+        """
+            Edits every saved `{channel_id: message_id}` with the `search` standings
+
+            Messages already showing the same standings are skipped
+        """
+        em = await self.embed(search)
+        digest = self.digest(em)
+        to_edit = {c: m for c, m in messages.items() if self._posted.get(m) != digest}
+
+        fields = {"embed": em.to_dict()}
+        label = "Standings {}".format(search)
+        edited = await dispatcher.edit(label, bot, to_edit, lambda channel: fields)
+        for channel_id, done in edited.items():
+            if done:
+                self._posted[to_edit[channel_id]] = digest
+
+
+standings_cache = StandingsCache()
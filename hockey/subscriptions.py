@@ -0,0 +1,96 @@
+import asyncio
+import logging
+
+from redbot.core import Config
+
+from .helper import hockey_config
+
+log = logging.getLogger("red.Hockey")
+
+
+class Subscriptions:
+    """
+        In-memory index of which channels post updates for which teams
+
+        Built once from config and kept up to date by the commands and
+        game day channel functions that change a channels teams so that
+        posting a goal doesn't need to read every channels settings.
+    """
+
+    def __init__(self):
+        self._teams = {}
+        self._channels = {}
+        self._gdc = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            config = hockey_config()
+            for channel_id, data in (await config.all_channels()).items():
+                self.set_channel(int(channel_id), data.get("team", []))
+            for guild_id, data in (await config.all_guilds()).items():
+                self.set_gdc(int(guild_id), data.get("gdc", []))
+            self._loaded = True
+
+    def clear(self):
+        self._teams = {}
+        self._channels = {}
+        self._gdc = {}
+        self._loaded = False
+
+    def set_channel(self, channel_id: int, teams: list):
+        """
+            Replaces the teams posted in a channel, an empty list unsubscribes it
+        """
+        self.remove_channel(channel_id)
+        if not teams:
+            return
+        self._channels[channel_id] = set(teams)
+        for team in teams:
+            self._teams.setdefault(team, set()).add(channel_id)
+
+    def remove_channel(self, channel_id: int):
+        for team in self._channels.pop(channel_id, []):
+            self._teams[team].discard(channel_id)
+            if not self._teams[team]:
+                del self._teams[team]
+
+    def set_gdc(self, guild_id: int, channels: list):
+        self._gdc[guild_id] = set(channels or [])
+
+    async def teams(self, channel_id: int) -> set:
+        await self.load()
+        return self._channels.get(channel_id, set())
+
+    async def is_gdc(self, channel) -> bool:
+        await self.load()
+        return channel.id in self._gdc.get(channel.guild.id, set())
+
+    async def get_channels(self, bot, post_state: list) -> list:
+        """
+            Returns every channel posting any of the teams in `post_state`
+
+            Channels that no longer exist are removed from the index and config
+        """
+        await self.load()
+        channel_ids = set()
+        for team in post_state:
+            channel_ids |= self._teams.get(team, set())
+        channels = []
+        for channel_id in channel_ids:
+            channel = bot.get_channel(id=channel_id)
+            if channel is None:
+                self.remove_channel(channel_id)
+                await hockey_config()._clear_scope(Config.CHANNEL, str(channel_id))
+                log.info("{} channel was removed because it no longer exists".format(channel_id))
+                continue
+            channels.append(channel)
+        return channels
+
+
+subscriptions = Subscriptions()
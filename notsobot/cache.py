@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import aiohttp
+
+
+class DownloadTooLarge(Exception):
+    pass
+
+
+class DownloadCache:
+    """
+        Downloaded files shared by every command
+
+        Bodies are stored once per sha1 of their content, in memory up to
+        `memory_size` bytes and on disk up to `disk_size` bytes, the least
+        recently used are dropped first. Urls point at a body for `ttl`
+        seconds. Anything bigger than `max_size` is never downloaded.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        session: aiohttp.ClientSession,
+        max_size: int = 16 * 1024 * 1024,
+        memory_size: int = 64 * 1024 * 1024,
+        disk_size: int = 512 * 1024 * 1024,
+        ttl: float = 3600.0,
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.session = session
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.ttl = ttl
+        self._urls = OrderedDict()
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk = OrderedDict()
+        self._disk_used = 0
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        files = sorted(self.path.iterdir(), key=lambda f: f.stat().st_mtime)
+        for file in files:
+            self._disk[file.name] = file.stat().st_size
+            self._disk_used += file.stat().st_size
+        self._prune_disk()
+
+    def _remember(self, url: str, digest: str):
+        self._urls[url] = (digest, time.monotonic())
+        self._urls.move_to_end(url)
+        while len(self._urls) > 4096:
+            self._urls.popitem(last=False)
+
+    def _store_memory(self, digest: str, data: bytes):
+        if digest in self._memory:
+            self._memory.move_to_end(digest)
+            return
+        if len(data) > self.memory_size:
+            return
+        self._memory[digest] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_size:
+            old, old_data = self._memory.popitem(last=False)
+            self._memory_used -= len(old_data)
+
+    def _write(self, digest: str, data: bytes):
+        with open(self.path / digest, "wb") as outfile:
+            outfile.write(data)
+
+    def _read(self, digest: str) -> bytes:
+        with open(self.path / digest, "rb") as infile:
+            return infile.read()
+
+    async def _store_disk(self, digest: str, data: bytes):
+        if digest in self._disk:
+            self._disk.move_to_end(digest)
+            return
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._write, digest, data)
+        if digest in self._disk:
+            return
+        self._disk[digest] = len(data)
+        self._disk_used += len(data)
+        self._prune_disk()
+
+    def _prune_disk(self):
+        while self._disk_used > self.disk_size and self._disk:
+            old, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            try:
+                os.remove(self.path / old)
+            except OSError:
+                pass
+
+    async def _load(self, digest: str):
+        if digest in self._memory:
+            self._memory.move_to_end(digest)
+            return self._memory[digest]
+        if digest in self._disk:
+            loop = asyncio.get_event_loop()
+            try:
+                data = await loop.run_in_executor(None, self._read, digest)
+            except OSError:
+                self._disk_used -= self._disk.pop(digest, 0)
+                return None
+            if digest not in self._disk:
+                # Pruned while it was being read
+                return data
+            self._disk.move_to_end(digest)
+            self._store_memory(digest, data)
+            return data
+        return None
+
+    async def _download(self, url: str) -> bytes:
+        async with self.session.get(url) as resp:
+            resp.raise_for_status()
+            if resp.content_length is not None and resp.content_length > self.max_size:
+                raise DownloadTooLarge(url)
+            data = bytearray()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                data.extend(chunk)
+                if len(data) > self.max_size:
+                    raise DownloadTooLarge(url)
+        return bytes(data)
+
+    async def _fetch(self, url: str) -> bytes:
+        data = await self._download(url)
+        loop = asyncio.get_event_loop()
+        digest = await loop.run_in_executor(None, lambda: hashlib.sha1(data).hexdigest())
+        self._store_memory(digest, data)
+        await self._store_disk(digest, data)
+        self._remember(url, digest)
+        return data
+
+    async def get(self, url: str, cache: bool = True) -> bytes:
+        """
+            Returns the body at `url` downloading it only when it isn't cached
+
+            Generated images and api responses should pass `cache=False`
+            so every call downloads a fresh copy
+        """
+        if not cache:
+            return await self._download(url)
+        cached = self._urls.get(url)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            data = await self._load(cached[0])
+            if data is not None:
+                self.hits += 1
+                if url in self._urls:
+                    self._urls.move_to_end(url)
+                return data
+        task = self._pending.get(url)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(url))
+            self._pending[url] = task
+            task.add_done_callback(lambda t: self._pending.pop(url, None))
+        return await asyncio.shield(task)
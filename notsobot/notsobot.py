@@ -10,6 +10,7 @@ import numpy as np
 import jpglitch
 from .vw import macintoshplus
 from io import BytesIO, StringIO
+from concurrent.futures.process import BrokenProcessPool
 from redbot.core import commands
 from redbot.core import checks
 from pyfiglet import figlet_format
@@ -19,6 +20,8 @@ from typing import Optional
 
 from redbot.core.data_manager import bundled_data_path, cog_data_path
 
+from .cache import DownloadCache, DownloadTooLarge
+from .pool import TransformBusy, TransformPool
 from .converter import ImageFinder
 
 try:
@@ -137,6 +140,8 @@ class NotSoBot(getattr(commands, "Cog", object)):
             r"((https)(\:\/\/|)?u2\.photofunia\.com\/.\/results\/.\/.\/.*(\.jpg\?download))"
         )
         self.session = aiohttp.ClientSession(loop=self.bot.loop)
+        self.cache = DownloadCache(cog_data_path(self) / "cache", self.session)
+        self.pool = TransformPool()
         self.image_mimes = ["image/png", "image/pjpeg", "image/jpeg", "image/x-icon"]
 
     def random(self, image=False, ext: str = False):
@@ -191,28 +196,43 @@ class NotSoBot(getattr(commands, "Cog", object)):
         except:
             return False
 
-    async def download(self, url: str, path: str):
+    async def download(self, url: str, path: str, cache: bool = True):
         try:
-            async with self.session.get(url) as resp:
-                data = await resp.read()
-                with open(path, "wb") as f:
-                    f.write(data)
-        except asyncio.TimeoutError:
+            data = await self.cache.get(url, cache)
+            with open(path, "wb") as f:
+                f.write(data)
+            return True
+        except (asyncio.TimeoutError, aiohttp.ClientError, DownloadTooLarge):
             return False
 
-    async def bytes_download(self, url: str):
+    async def bytes_download(self, url: str, cache: bool = True):
         try:
-            async with self.session.get(url) as resp:
-                data = await resp.read()
-                b = BytesIO(data)
-                b.seek(0)
-                return b
+            data = await self.cache.get(url, cache)
+            b = BytesIO(data)
+            b.seek(0)
+            return b
         except asyncio.TimeoutError:
             return False
         except Exception as e:
             print(e)
             return False
 
+    async def run_transform(self, ctx, func, *args):
+        """
+            Runs a cpu heavy image function in the process pool
+
+            Replies and returns None if the pool is busy or it takes too long
+        """
+        try:
+            return await self.pool.run(ctx.author.id, func, *args)
+        except TransformBusy as e:
+            await ctx.send(str(e))
+        except asyncio.TimeoutError:
+            await ctx.send(":warning: **Processing that image took too long.**")
+        except BrokenProcessPool:
+            await ctx.send(":warning: **Command image processing failed...**")
+        return None
+
     async def run_process(self, code, response=False):
         try:
             loop = self.bot.loop
@@ -247,7 +267,8 @@ class NotSoBot(getattr(commands, "Cog", object)):
                 url = await r.text()
                 await ctx.send("Uploaded to paste, URL: <{0}>".format(url))
 
-    def do_magik(self, scale, img):
+    @staticmethod
+    def do_magik(scale, img):
         try:
             list_imgs = []
             exif = {}
@@ -302,7 +323,11 @@ class NotSoBot(getattr(commands, "Cog", object)):
             msg = await ctx.message.channel.send("ok, processing")
             list_imgs = []
             b = await self.bytes_download(urls[0])
-            final, content_msg = await self.bot.loop.run_in_executor(None, self.do_magik, scale, b)
+            result = await self.run_transform(ctx, self.do_magik, scale, b)
+            if result is None:
+                await msg.delete()
+                return
+            final, content_msg = result
             if type(final) == str:
                 await ctx.send(final)
                 return
@@ -318,7 +343,8 @@ class NotSoBot(getattr(commands, "Cog", object)):
         except Exception as e:
             await ctx.send(e)
 
-    def do_gmagik(self, is_owner, gif, gif_dir, rand, is_gif):
+    @staticmethod
+    def do_gmagik(is_owner, gif, gif_dir, rand, is_gif):
         try:
             try:
                 frame = PIL.Image.open(gif)
@@ -415,16 +441,27 @@ class NotSoBot(getattr(commands, "Cog", object)):
             rand = self.random()
             gifin = gif_dir + "1_{0}.gif".format(rand)
             gifout = gif_dir + "2_{0}.gif".format(rand)
-            await self.download(url, gifin)
+            if not await self.download(url, gifin):
+                await x.delete()
+                await ctx.send(":warning: **Command download function failed...**")
+                return
             is_owner = await ctx.bot.is_owner(ctx.author)
             if os.path.getsize(gifin) > 5000000 and not is_owner:
                 await ctx.send(":no_entry: `GIF Too Large (>= 5 mb).`")
                 os.remove(gifin)
                 return
             try:
-                result = await self.bot.loop.run_in_executor(
-                    None, self.do_gmagik, is_owner, gifin, gif_dir, rand, check
+                result = await self.run_transform(
+                    ctx, self.do_gmagik, is_owner, gifin, gif_dir, rand, check
                 )
+                if result is None:
+                    # The worker may have been stopped part way through the frames
+                    for image in glob.glob(gif_dir + "*_{0}.png".format(rand)):
+                        os.remove(image)
+                    if os.path.exists(gifin):
+                        os.remove(gifin)
+                    await x.delete()
+                    return
             except Exception as e:
                 print("Failing here")
                 print(e)
@@ -556,9 +593,14 @@ class NotSoBot(getattr(commands, "Cog", object)):
             avatar = urls[0]
             path = str(bundled_data_path(self)) + "/" + self.random(True)
             path2 = path[:-3] + "gif"
-            await self.download(avatar, path)
             t_path = str(bundled_data_path(self)) + "/zDAY2yo.jpg"
-            await self.download("https://i.imgur.com/zDAY2yo.jpg", t_path)
+            if not await self.download(avatar, path) or not await self.download(
+                "https://i.imgur.com/zDAY2yo.jpg", t_path
+            ):
+                if os.path.exists(path):
+                    os.remove(path)
+                await ctx.send(":warning: **Command download function failed...**")
+                return
             await self.run_process(
                 [
                     "convert",
@@ -671,10 +713,9 @@ class NotSoBot(getattr(commands, "Cog", object)):
         file = discord.File(final, filename="ascii.png")
         await ctx.send(msg, file=file)
 
-    def generate_ascii(self, image):
-        font = PIL.ImageFont.truetype(
-            str(cog_data_path(self)) + "/FreeMonoBold.ttf", 15
-        )
+    @staticmethod
+    def generate_ascii(image, font_path):
+        font = PIL.ImageFont.truetype(font_path, 15)
         image_width, image_height = image.size
         aalib_screen_width = int(image_width / 24.9) * 10
         aalib_screen_height = int(image_height / 41.39) * 10
@@ -722,7 +763,8 @@ class NotSoBot(getattr(commands, "Cog", object)):
                 await ctx.send(":warning: **Command download function failed...**")
                 return
             im = PIL.Image.open(b)
-            img = await self.bot.loop.run_in_executor(None, self.generate_ascii, im)
+            font_path = str(cog_data_path(self) / "FreeMonoBold.ttf")
+            img = await self.bot.loop.run_in_executor(None, self.generate_ascii, im, font_path)
             final = BytesIO()
             img.save(final, "png")
             final.seek(0)
@@ -732,7 +774,8 @@ class NotSoBot(getattr(commands, "Cog", object)):
         except Exception as e:
             await ctx.send(e)
 
-    def do_gascii(self, b):
+    @staticmethod
+    def do_gascii(b, font_path):
         img_list = []
         temp = BytesIO()
         try:
@@ -745,7 +788,7 @@ class NotSoBot(getattr(commands, "Cog", object)):
             try:
                 for frame in gif_list[:20]:
                     im = frame.copy()
-                    new_im = self.generate_ascii(im)
+                    new_im = NotSoBot.generate_ascii(im, font_path)
                     img_list.append(new_im)
                     count += 1
 
@@ -774,10 +817,9 @@ class NotSoBot(getattr(commands, "Cog", object)):
         try:
             x = await ctx.message.channel.send("ok, processing")
             b = await self.bytes_download(url)
-            result = self.bot.loop.run_in_executor(None, self.do_gascii, b)
-            try:
-                result = await asyncio.wait_for(result, timeout=60)
-            except asyncio.TimeoutError:
+            font_path = str(cog_data_path(self) / "FreeMonoBold.ttf")
+            result = await self.run_transform(ctx, self.do_gascii, b, font_path)
+            if result is None:
                 return
             if type(result) == str:
                 await ctx.send(result)
@@ -933,7 +975,7 @@ class NotSoBot(getattr(commands, "Cog", object)):
             quote(txt)
         )
         r = await self.get_text(api)
-        b = await self.bytes_download(r)
+        b = await self.bytes_download(r, cache=False)
         file = discord.File(b, filename="tti.png")
         await ctx.send(file=file)
 
@@ -944,7 +986,7 @@ class NotSoBot(getattr(commands, "Cog", object)):
             quote(txt)
         )
         r = await self.get_text(api)
-        b = await self.bytes_download(r)
+        b = await self.bytes_download(r, cache=False)
         file = discord.File(b, filename="tti.png")
         await ctx.send(file=file)
 
@@ -970,7 +1012,8 @@ class NotSoBot(getattr(commands, "Cog", object)):
         file = discord.File(final, filename="needsmorejpeg.jpg")
         await ctx.send(file=file)
 
-    def do_vw(self, b, txt):
+    @staticmethod
+    def do_vw(b, txt):
         im = PIL.Image.open(b)
         k = random.randint(0, 100)
         im = macintoshplus.draw_method1(k, txt, im)
@@ -989,7 +1032,9 @@ class NotSoBot(getattr(commands, "Cog", object)):
         if txt is None:
             txt = "vapor wave"
         b = await self.bytes_download(url)
-        final = await self.bot.loop.run_in_executor(None, self.do_vw, b, txt)
+        final = await self.run_transform(ctx, self.do_vw, b, txt)
+        if final is None:
+            return
         file = discord.File(final, filename="vapewave.png")
         await ctx.send(file=file)
 
@@ -999,10 +1044,10 @@ class NotSoBot(getattr(commands, "Cog", object)):
         api = "https://mcgen.herokuapp.com/a.php?i=1&h=Achievement-{0}&t={1}".format(
             ctx.message.author.name, txt
         )
-        b = await self.bytes_download(api)
+        b = await self.bytes_download(api, cache=False)
         i = 0
         while sys.getsizeof(b) == 88 and i != 10:
-            b = await self.bytes_download(api)
+            b = await self.bytes_download(api, cache=False)
             if sys.getsizeof(b) != 0:
                 i = 10
             else:
@@ -1060,7 +1105,8 @@ class NotSoBot(getattr(commands, "Cog", object)):
                 )
             )
 
-    def do_glitch(self, b, amount, seed, iterations):
+    @staticmethod
+    def do_glitch(b, amount, seed, iterations):
         b.seek(0)
         img = jpglitch.Jpeg(bytearray(b.getvalue()), amount, seed, iterations)
         final = BytesIO()
@@ -1069,7 +1115,8 @@ class NotSoBot(getattr(commands, "Cog", object)):
         final.seek(0)
         return final
 
-    def do_gglitch(self, b):
+    @staticmethod
+    def do_gglitch(b):
         b = bytearray(b.getvalue())
         for x in range(0, sys.getsizeof(b)):
             if b[x] == 33:
@@ -1113,9 +1160,9 @@ class NotSoBot(getattr(commands, "Cog", object)):
                 img = img.convert("RGB")
                 b = BytesIO()
                 img.save(b, format="JPEG")
-                final = await self.bot.loop.run_in_executor(
-                    None, self.do_glitch, b, amount, seed, iterations
-                )
+                final = await self.run_transform(ctx, self.do_glitch, b, amount, seed, iterations)
+                if final is None:
+                    return
                 file = discord.File(final, filename="glitch.jpeg")
                 await ctx.send(
                     "Iterations: `{0}` | Amount: `{1}` | Seed: `{2}`".format(
@@ -1124,7 +1171,9 @@ class NotSoBot(getattr(commands, "Cog", object)):
                     file=file,
                 )
             else:
-                final = await self.bot.loop.run_in_executor(None, self.do_gglitch, b)
+                final = await self.run_transform(ctx, self.do_gglitch, b)
+                if final is None:
+                    return
                 file = discord.File(final, filename="glitch.gif")
                 await ctx.send(file=file)
         except Exception as e:
@@ -1140,7 +1189,9 @@ class NotSoBot(getattr(commands, "Cog", object)):
         url = urls[0]
         try:
             path = str(bundled_data_path(self)) + "/" + self.random(True)
-            await self.download(url, path)
+            if not await self.download(url, path):
+                await ctx.send(":warning: **Command download function failed...**")
+                return
             args = [
                 "convert",
                 "(",
@@ -1323,7 +1374,7 @@ class NotSoBot(getattr(commands, "Cog", object)):
         match = self.retro_regex.findall(txt)
         if match:
             download_url = match[0][0]
-            b = await self.bytes_download(download_url)
+            b = await self.bytes_download(download_url, cache=False)
             return b
         return False
 
@@ -1357,7 +1408,8 @@ class NotSoBot(getattr(commands, "Cog", object)):
             file = discord.File(retro_result, filename="retro.png")
             await ctx.send(file=file)
 
-    def do_waaw(self, b):
+    @staticmethod
+    def do_waaw(b):
         f = BytesIO()
         f2 = BytesIO()
         with wand.image.Image(file=b, format="png") as img:
@@ -1393,11 +1445,14 @@ class NotSoBot(getattr(commands, "Cog", object)):
         if b is False:
             await ctx.send(":warning: **Command download function failed...**")
             return
-        final = await self.bot.loop.run_in_executor(None, self.do_waaw, b)
+        final = await self.run_transform(ctx, self.do_waaw, b)
+        if final is None:
+            return
         file = discord.File(final, filename="waaw.png")
         await ctx.send(file=file)
 
-    def do_haah(self, b):
+    @staticmethod
+    def do_haah(b):
         f = BytesIO()
         f2 = BytesIO()
         with wand.image.Image(file=b, format="png") as img:
@@ -1431,11 +1486,14 @@ class NotSoBot(getattr(commands, "Cog", object)):
         if b is False:
             await ctx.send(":warning: **Command download function failed...**")
             return
-        final = await self.bot.loop.run_in_executor(None, self.do_haah, b)
+        final = await self.run_transform(ctx, self.do_haah, b)
+        if final is None:
+            return
         file = discord.File(final, filename="haah.png")
         await ctx.send(file=file)
 
-    def do_woow(self, b):
+    @staticmethod
+    def do_woow(b):
         f = BytesIO()
         f2 = BytesIO()
         with wand.image.Image(file=b, format="png") as img:
@@ -1470,11 +1528,14 @@ class NotSoBot(getattr(commands, "Cog", object)):
         if b is False:
             await ctx.send(":warning: **Command download function failed...**")
             return
-        final = await self.bot.loop.run_in_executor(None, self.do_woow, b)
+        final = await self.run_transform(ctx, self.do_woow, b)
+        if final is None:
+            return
         file = discord.File(final, filename="woow.png")
         await ctx.send(file=file)
 
-    def do_hooh(self, b):
+    @staticmethod
+    def do_hooh(b):
         f = BytesIO()
         f2 = BytesIO()
         with wand.image.Image(file=b, format="png") as img:
@@ -1509,7 +1570,9 @@ class NotSoBot(getattr(commands, "Cog", object)):
         if b is False:
             await ctx.send(":warning: **Command download function failed...**")
             return
-        final = await self.bot.loop.run_in_executor(None, self.do_hooh, b)
+        final = await self.run_transform(ctx, self.do_hooh, b)
+        if final is None:
+            return
         file = discord.File(final, filename="hooh.png")
         await ctx.send(file=file)
 
@@ -1575,5 +1638,6 @@ class NotSoBot(getattr(commands, "Cog", object)):
 
     def __unload(self):
         self.bot.loop.create_task(self.session.close())
+        self.pool.shutdown()
 
     __del__ = __unload
@@ -0,0 +1,155 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+
+class TransformBusy(Exception):
+    pass
+
+
+class TransformTimeout(BaseException):
+    # Not an Exception so the transforms own error handling doesn't swallow it
+    pass
+
+
+def _to_bytes(value):
+    if isinstance(value, BytesIO):
+        return value.getvalue()
+    if isinstance(value, tuple):
+        return tuple(_to_bytes(v) for v in value)
+    return value
+
+
+def _to_file(value):
+    if isinstance(value, bytes):
+        b = BytesIO(value)
+        b.seek(0)
+        return b
+    if isinstance(value, tuple):
+        return tuple(_to_file(v) for v in value)
+    return value
+
+
+def _timed_out(signum, frame):
+    raise TransformTimeout()
+
+
+def _call(timeout, func, *args):
+    """
+        Runs in the worker, files are passed both ways as bytes
+
+        The job stops itself after `timeout` seconds where SIGALRM exists
+        so the worker can be reused
+    """
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _timed_out)
+        signal.alarm(math.ceil(timeout))
+    try:
+        return _to_bytes(func(*_to_file(args)))
+    finally:
+        if hasattr(signal, "SIGALRM"):
+            signal.alarm(0)
+
+
+def _context():
+    """
+        Workers are started fresh instead of forking the running bot
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class TransformPool:
+    """
+        Runs cpu heavy image functions in worker processes
+
+        `func` must be importable by name, a module function or staticmethod,
+        and BytesIO arguments and results are sent as bytes. Each user can
+        run `per_user` jobs at once and at most `max_queue` jobs can be
+        waiting or running before new ones are turned away. Workers are
+        replaced after `max_tasks` jobs or when a job runs past `timeout`,
+        jobs already sent to the old workers still finish there.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        per_user: int = 1,
+        max_queue: int = 8,
+        timeout: float = 120.0,
+        max_tasks: int = 100,
+    ):
+        self.workers = workers or os.cpu_count() or 2
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self._executor = None
+        self._tasks = 0
+        self._queued = 0
+        self._users = {}
+        self._futures = set()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None or self._tasks >= self.max_tasks:
+            self.recycle()
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_context())
+        return self._executor
+
+    def recycle(self):
+        """
+            Sends new jobs to new workers, the old ones exit once their jobs finish
+        """
+        executor, self._executor = self._executor, None
+        self._tasks = 0
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def shutdown(self):
+        for future in list(self._futures):
+            future.cancel()
+        self.recycle()
+
+    async def run(self, user_id: int, func, *args):
+        if self._users.get(user_id, 0) >= self.per_user:
+            raise TransformBusy(":hourglass: **Please wait for your last image to finish.**")
+        if self._queued >= self.max_queue:
+            raise TransformBusy(":hourglass: **I'm busy processing images, try again soon.**")
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        self._queued += 1
+        try:
+            executor = self.executor
+            self._tasks += 1
+            future = executor.submit(_call, self.timeout, func, *_to_bytes(args))
+            self._futures.add(future)
+            future.add_done_callback(self._futures.discard)
+            # Jobs time themselves out in the worker, this only catches ones stuck
+            # where the alarm can't interrupt them after waiting for a free worker
+            backstop = self.timeout * (math.ceil(self.max_queue / self.workers) + 1)
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=backstop)
+            except TransformTimeout:
+                raise asyncio.TimeoutError
+            except asyncio.TimeoutError:
+                # The old workers are left to finish without new jobs
+                future.cancel()
+                if executor is self._executor:
+                    self.recycle()
+                raise
+            except BrokenProcessPool:
+                # A worker died so start fresh ones for the next job
+                if executor is self._executor:
+                    self.recycle()
+                raise
+            return _to_file(result)
+        finally:
+            self._queued -= 1
+            self._users[user_id] -= 1
+            if not self._users[user_id]:
+                del self._users[user_id]